@@ -0,0 +1,517 @@
+import asyncio
+import collections
+import functools
+import json
+import logging
+import secrets
+import time
+import zmq
+import zmq.asyncio
+import bitslice
+import codec
+import compiler
+import metrics
+import ot
+import util
+import yao
+
+# asyncio implementation of the protocol
+#
+# The messages are the same as those of the blocking implementation, so an
+# AsyncAlice can be served by Bob or server.EvaluatorServer, and an
+# AsyncBob can serve Alice. Sockets never block the event loop and the
+# CPU-heavy steps (garbling, evaluation, OT arithmetic) run in an executor,
+# so that one process drives many concurrent sessions.
+
+
+class AsyncSocket(util.Socket):
+    """ZeroMQ asyncio socket exchanging Python objects, encoded with codec.
+
+    Args:
+        socket_type: The ZeroMQ socket type.
+        endpoint: Optional; the endpoint to bind (REP, ROUTER) or to connect
+            (REQ, DEALER) to.
+        identity: Optional; the routing identity of the socket.
+        context: Optional; the zmq.asyncio.Context of the socket.
+    """
+    def __init__(self, socket_type, endpoint=None, identity=None,
+                 context=None):
+        context = context or zmq.asyncio.Context.instance()
+        self.socket = context.socket(socket_type)
+        self.metrics = metrics.Metrics()
+        self.reset_counters()
+        if identity is not None:
+            self.socket.setsockopt(zmq.IDENTITY, identity)
+        if endpoint:
+            if socket_type in (zmq.REP, zmq.ROUTER):
+                self.socket.bind(endpoint)
+            else:
+                self.socket.connect(endpoint)
+
+    async def send(self, msg):
+        frames = self._encode(msg)
+        await self.socket.send_multipart(frames, copy=False)
+        self._count_sent(frames)
+
+    async def receive(self):
+        start = time.perf_counter()
+        frames = [frame.buffer
+                  for frame in await self.socket.recv_multipart(copy=False)]
+        return self._decode(frames, start)
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+class AsyncSessionSocket(util.Socket):
+    """Socket of one session of an AsyncBob, fed by its ROUTER socket.
+
+    Args:
+        router: The zmq.asyncio ROUTER socket of the server.
+        session_id: The routing identity of Alice's socket.
+        timeout: Optional; the time in seconds to wait for a message before
+            receive() raises TimeoutError, forever by default.
+    """
+    def __init__(self, router, session_id, timeout=None):
+        self.socket = router
+        self.session_id = session_id
+        self.timeout = timeout
+        self.queue = asyncio.Queue()  # frames of the session's messages
+        self.metrics = metrics.Metrics()
+        self.reset_counters()
+
+    async def send(self, msg):
+        frames = self._encode(msg)
+        await self.socket.send_multipart([self.session_id, b""] + frames,
+                                         copy=False)
+        self._count_sent(frames)
+
+    async def receive(self):
+        start = time.perf_counter()
+        try:
+            frames = await asyncio.wait_for(self.queue.get(), self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Session {self.session_id!r} idle for "
+                               f"{self.timeout} s") from None
+        return self._decode([frame.buffer for frame in frames], start)
+
+    async def send_wait(self, msg):
+        await self.send(msg)
+        return await self.receive()
+
+
+class AsyncObliviousTransfer(ot.ObliviousTransfer):
+    """Transfer of Bob's keys over an asyncio socket, see
+    ot.ObliviousTransfer.
+
+    For many short sessions, the "batch" and "extension" modes take a
+    constant number of round trips whatever the number of Bob's wires.
+
+    Args:
+        socket: The AsyncSocket or AsyncSessionSocket connecting Alice and
+            Bob.
+        enabled: Optional; whether Bob's keys are obliviously transferred.
+        mode: Optional; the OT mode, in ot.OT_MODES.
+        group: Optional; the group of the base OTs run by this party, in
+            util.STANDARD_GROUPS.
+        executor: Optional; the executor of the OT arithmetic, the default
+            executor of the event loop by default.
+    """
+    def __init__(self, socket, enabled=True, mode="extension",
+                 group=util.DEFAULT_GROUP, executor=None):
+        super().__init__(socket, enabled=enabled, mode=mode, group=group)
+        self.executor = executor
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def get_result(self, a_inputs, b_keys):
+        """Send Alice's inputs and retrieve Bob's result of evaluation."""
+        await self.send_inputs(a_inputs, b_keys)
+        return await self.socket.receive()
+
+    async def send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and transfer Bob's keys."""
+        if self.enabled and self.mode == "extension":
+            await self.socket.send((a_inputs, self._ext_keys is None))
+            await self.ext_sender(b_keys)
+            return
+        if self.enabled and self.mode == "batch":
+            await self.batch_sender(a_inputs, b_keys)
+            return
+
+        await self.socket.send(a_inputs)
+        for _ in range(len(b_keys)):
+            w = await self.socket.receive()
+            if self.enabled:
+                await self.ot_garbler((codec.encode_label(b_keys[w][0]),
+                                       codec.encode_label(b_keys[w][1])))
+            else:
+                await self.socket.send(b_keys[w])
+
+    async def send_result(self, circuit, g_tables, pbits_out, b_inputs,
+                          scheme=yao.DEFAULT_SCHEME):
+        """Evaluate circuit and send the result to Alice."""
+        a_inputs, b_inputs_encr = await self.receive_inputs(b_inputs)
+        result = await self._run(yao.evaluate, circuit, g_tables, pbits_out,
+                                 a_inputs, b_inputs_encr, scheme)
+        await self.socket.send(result)
+        return result
+
+    async def send_streamed_result(self, circuit, b_inputs,
+                                   scheme=yao.DEFAULT_SCHEME):
+        """Evaluate streamed garbled tables and send the result to Alice."""
+        a_inputs, b_inputs_encr = await self.receive_inputs(b_inputs)
+        evaluator = await self._run(yao.Evaluator, circuit, a_inputs,
+                                    b_inputs_encr, scheme)
+        await self.socket.send(True)
+        while True:
+            g_tables, pbits_out = await self.socket.receive()
+            if pbits_out is not None:
+                break
+            await self.socket.send(True)
+            await self._run(evaluator.feed, g_tables)
+        await self._run(evaluator.feed, g_tables)
+        result = evaluator.result(pbits_out)
+        await self.socket.send(result)
+        return result
+
+    async def receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and obtain Bob's keys.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to
+            (key, encr_bit) inputs. The last message received is still to
+            be answered.
+        """
+        a_inputs = await self.socket.receive()
+        if self.enabled and self.mode == "extension":
+            a_inputs, new_base = a_inputs
+            if new_base:
+                self._ext_keys = None
+            return a_inputs, await self.ext_receiver(b_inputs)
+        if self.enabled and self.mode == "batch":
+            a_inputs, *batch_setup = a_inputs
+            return a_inputs, await self.batch_receiver(b_inputs, *batch_setup)
+
+        b_inputs_encr = {}
+        for w, b_input in b_inputs.items():
+            await self.socket.send(w)
+            if self.enabled:
+                msg = await self.ot_evaluator(b_input)
+                b_inputs_encr[w] = codec.decode_label(msg)
+            else:
+                b_inputs_encr[w] = (await self.socket.receive())[b_input]
+        return a_inputs, b_inputs_encr
+
+    async def ot_garbler(self, msgs):
+        """Oblivious transfer, Alice's side, see ot.ObliviousTransfer."""
+        G = util.get_group(self.group)
+        await self.socket.send_wait(G.id)
+        cs = await self._run(ot.base_ot_setup, G, 1)
+        hs = await self.socket.send_wait(cs[0])
+        transfers = await self._run(ot.base_ot_transfer, G, cs, [hs], [msgs])
+        await self.socket.send(transfers[0])
+
+    async def ot_evaluator(self, b):
+        """Oblivious transfer, Bob's side, see ot.ObliviousTransfer."""
+        G = util.get_group(await self.socket.receive())
+        c = await self.socket.send_wait(True)
+        xs, hs = await self._run(ot.base_ot_choose, G, [c], [b])
+        transfer = await self.socket.send_wait(hs[0])
+        msgs = await self._run(ot.base_ot_retrieve, G, xs, [b], [transfer])
+        return msgs[0]
+
+    async def batch_sender(self, a_inputs, b_keys):
+        """Batched base OTs, Alice's side, see ot.ObliviousTransfer."""
+        G = util.get_group(self.group)
+        wires = list(b_keys)
+        cs = await self._run(ot.base_ot_setup, G, len(wires))
+        hs = await self.socket.send_wait((a_inputs, G.id, wires, cs))
+        pairs = [(codec.encode_label(b_keys[w][0]),
+                  codec.encode_label(b_keys[w][1])) for w in wires]
+        await self.socket.send(
+            await self._run(ot.base_ot_transfer, G, cs, hs, pairs))
+
+    async def batch_receiver(self, b_inputs, group_id, wires, cs):
+        """Batched base OTs, Bob's side, see ot.ObliviousTransfer."""
+        G = util.get_group(group_id)
+        bits = [b_inputs[w] for w in wires]
+        xs, hs = await self._run(ot.base_ot_choose, G, cs, bits)
+        transfers = await self.socket.send_wait(hs)
+        msgs = await self._run(ot.base_ot_retrieve, G, xs, bits, transfers)
+        return {w: codec.decode_label(msg) for w, msg in zip(wires, msgs)}
+
+    async def ext_sender(self, b_keys):
+        """IKNP OT extension, Alice's side, see ot.ObliviousTransfer."""
+        base_setup, wires, u_cols = await self.socket.receive()
+        if base_setup is not None:
+            group_id, cs = base_setup
+            G = util.get_group(group_id)
+            s = secrets.randbits(ot.OT_EXTENSION_BASE)
+            s_bits = [(s >> i) & 1 for i in range(ot.OT_EXTENSION_BASE)]
+            xs, hs = await self._run(ot.base_ot_choose, G, cs, s_bits)
+            transfers = await self.socket.send_wait(hs)
+            seeds = await self._run(ot.base_ot_retrieve, G, xs, s_bits,
+                                    transfers)
+            self._ext_keys = (s, seeds)
+            self._ext_count = 0
+
+        count = self._ext_count
+        self._ext_count += len(wires)
+        await self.socket.send(await self._run(
+            ot.ext_transfer, self._ext_keys, count, wires, u_cols, b_keys))
+
+    async def ext_receiver(self, b_inputs):
+        """IKNP OT extension, Bob's side, see ot.ObliviousTransfer."""
+        wires = list(b_inputs)
+        base_setup = None
+        if self._ext_keys is None:
+            G = util.get_group(self.group)
+            cs = await self._run(ot.base_ot_setup, G, ot.OT_EXTENSION_BASE)
+            seeds = [(secrets.token_bytes(16), secrets.token_bytes(16))
+                     for _ in range(ot.OT_EXTENSION_BASE)]
+            base_setup = (G.id, cs)
+            self._ext_count = 0
+        else:
+            seeds = self._ext_keys
+
+        count = self._ext_count
+        self._ext_count += len(wires)
+        t_cols, u_cols = await self._run(ot.ext_matrix, seeds, count, wires,
+                                         b_inputs)
+        msgs = await self.socket.send_wait((base_setup, wires, u_cols))
+        if base_setup is not None:
+            await self.socket.send(
+                await self._run(ot.base_ot_transfer, G, cs, msgs, seeds))
+            self._ext_keys = seeds
+            msgs = await self.socket.receive()
+        return await self._run(ot.ext_retrieve, t_cols, count, wires,
+                               b_inputs, msgs)
+
+
+class AsyncAlice:
+    """Garbler of one session, driven by asyncio.
+
+    Many AsyncAlice can run concurrently in one event loop, each one with
+    its own socket and session id.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        scheme: Optional; the name of the garbling scheme.
+        ot_mode: Optional; the OT mode, in ot.OT_MODES.
+        oblivious_transfer: Optional; whether Bob's keys are obliviously
+            transferred.
+        endpoint: Optional; the endpoint of Bob.
+        executor: Optional; the executor of garbling and OT arithmetic, the
+            default executor of the event loop by default.
+    """
+    def __init__(self, circuit, scheme=yao.DEFAULT_SCHEME, ot_mode="extension",
+                 oblivious_transfer=True,
+                 endpoint=f"tcp://{util.SERVER_HOST}:{util.SERVER_PORT}",
+                 executor=None):
+        self.circuit = circuit
+        self.scheme = scheme
+        self.executor = executor
+        self.bitlen = circuit.get("bits", len(circuit.get("alice", [])))
+        self.compiled = compiler.compile_circuit(circuit)
+        self.packed_circuit = codec.pack_circuit(circuit)
+        self.session_id = secrets.token_hex(8)
+        self.socket = AsyncSocket(zmq.REQ, endpoint,
+                                  identity=self.session_id.encode())
+        self.ot = AsyncObliviousTransfer(self.socket,
+                                         enabled=oblivious_transfer,
+                                         mode=ot_mode, executor=executor)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close(end_session=exc_info[0] is None)
+
+    async def compute(self, values):
+        """Run the circuit on Alice's values with a fresh garbled instance.
+
+        Args:
+            values: Alice's input values, as many as the circuit takes at
+                most (missing ones are 0).
+
+        Returns:
+            The list of the result values of the circuit.
+        """
+        loop = asyncio.get_running_loop()
+        metrics = self.socket.metrics
+        with metrics.time("garble"):
+            garbled = await loop.run_in_executor(
+                self.executor, functools.partial(
+                    yao.GarbledCircuit, self.circuit, scheme=self.scheme,
+                    compiled=self.compiled))
+        pbits, keys = garbled.pbits, garbled.keys
+        with metrics.time("circuit"):
+            await self.socket.send_wait({
+                "circuit": self.packed_circuit,
+                "garbled_tables": garbled.garbled_tables,
+                "pbits_out": {w: pbits[w] for w in self.circuit["out"]},
+                "scheme": self.scheme,
+                "ot_mode": self.ot.mode,
+                "printout": "none",
+                "bitlength": self.bitlen,
+                "stream": False,
+            })
+
+        a_wires = self.circuit.get("alice", [])
+        bits = util.values_t_bits(values, self.bitlen,
+                                  len(a_wires) // self.bitlen)
+        a_inputs = {w: (keys[w][int(b)], pbits[w] ^ int(b))
+                    for w, b in zip(a_wires, bits)}
+        b_keys = {w: ((keys[w][0], pbits[w]), (keys[w][1], pbits[w] ^ 1))
+                  for w in self.circuit.get("bob", [])}
+        with metrics.time("ot"):
+            result = await self.ot.get_result(a_inputs, b_keys)
+        return util.circuit_t_ints(result, self.circuit.get("results", 1))
+
+    async def close(self, end_session=True):
+        """End the session with Bob and close the socket.
+
+        The metrics of the session are then kept in self.report.
+        """
+        if end_session:
+            await self.socket.send_wait({"end": True})
+        self.socket.close()
+        self.report = self.socket.metrics.end_session()
+        logging.info(f"Session metrics: {json.dumps(self.report)}")
+
+
+class AsyncBob:
+    """Evaluator serving many concurrent sessions, driven by asyncio.
+
+    A ROUTER socket receives the messages of all sessions and dispatches
+    them to one task per session, identified by the session id of Alice's
+    socket.
+
+    Args:
+        data: Bob's data.
+        oblivious_transfer: Optional; whether Bob's keys are obliviously
+            transferred.
+        endpoint: Optional; the endpoint to bind.
+        timeout: Optional; the idle time in seconds after which a session
+            is dropped, forever by default.
+        executor: Optional; the executor of evaluation and OT arithmetic,
+            the default executor of the event loop by default.
+    """
+    def __init__(self, data, oblivious_transfer=True,
+                 endpoint=f"tcp://*:{util.LOCAL_PORT}", timeout=None,
+                 executor=None):
+        self.data = list(data)
+        self.oblivious_transfer = oblivious_transfer
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.executor = executor
+        self.sessions = {}  # map from session id to AsyncSessionSocket
+        self.results = collections.Counter()  # number of results by circuit
+        # Circuits received, compiled once for all the sessions
+        self.circuits = codec.CircuitCache()
+
+    async def serve(self):
+        """Dispatch the messages of sessions to their tasks, forever."""
+        router = zmq.asyncio.Context.instance().socket(zmq.ROUTER)
+        router.bind(self.endpoint)
+        logging.info(f"Serving sessions on {self.endpoint}")
+        tasks = set()
+        try:
+            while True:
+                frames = await router.recv_multipart(copy=False)
+                session_id = frames[0].bytes
+                if session_id not in self.sessions:
+                    socket = AsyncSessionSocket(router, session_id,
+                                                self.timeout)
+                    self.sessions[session_id] = socket
+                    task = asyncio.create_task(self._session(socket))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                self.sessions[session_id].queue.put_nowait(frames[2:])
+        finally:
+            for task in tasks:
+                task.cancel()
+            router.close(linger=0)
+
+    async def _session(self, socket):
+        """Serve the messages of a session until Alice ends it."""
+        logging.info(f"Session {socket.session_id!r} started")
+        session = AsyncBobSession(self, socket)
+        try:
+            while await session.handle(await socket.receive()):
+                pass
+        except TimeoutError as e:
+            logging.warning(e)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"Session {socket.session_id!r} failed: {e!r}")
+        finally:
+            del self.sessions[socket.session_id]
+            logging.info(f"Session {socket.session_id!r} closed, metrics: "
+                         f"{json.dumps(socket.metrics.end_session())}")
+
+
+class AsyncBobSession:
+    """State of a session of an AsyncBob.
+
+    Args:
+        bob: The AsyncBob serving the session.
+        socket: The AsyncSessionSocket of the session.
+    """
+    def __init__(self, bob, socket):
+        self.bob = bob
+        self.socket = socket
+        self.ot = AsyncObliviousTransfer(socket,
+                                         enabled=bob.oblivious_transfer,
+                                         executor=bob.executor)
+        # Last circuit evaluated, its CompiledCircuit and Bob's input
+        # values, for verification
+        self.last = None
+
+    async def handle(self, entry):
+        """Answer a message starting an exchange with Alice, see bob.Bob.
+
+        Returns:
+            False if Alice ended the session, True otherwise.
+        """
+        await self.socket.send(True)
+        if not isinstance(entry, dict):
+            logging.warning(f"Ignoring unexpected message {entry!r}")
+        elif "circuit" in entry:
+            circuit, compiled = self.bob.circuits.get(entry["circuit"])
+            self.ot.mode = entry["ot_mode"]
+            bitlen = entry["bitlength"]
+            values, private_value = util.process_private_data(
+                data=self.bob.data, bit_size=bitlen)
+            count = len(circuit.get("bob", [])) // bitlen
+            if count == 1:
+                values = [int(private_value, 2)]
+            bits = util.values_t_bits(values, bitlen, count)
+            self.last = (circuit, compiled, values)
+            b_inputs = {w: int(b) for w, b in zip(circuit["bob"], bits)}
+            if entry.get("stream"):
+                await self.ot.send_streamed_result(compiled, b_inputs,
+                                                   entry["scheme"])
+            else:
+                await self.ot.send_result(compiled, entry["garbled_tables"],
+                                          entry["pbits_out"], b_inputs,
+                                          entry["scheme"])
+            self.bob.results[circuit["id"]] += 1
+        elif "results" in entry:
+            await self.socket.receive()
+            circuit, compiled, values = self.last
+            expected = bitslice.simulate_values(
+                circuit, [(entry["alice_values"], values)],
+                compiled=compiled)[0]
+            await self.socket.send(expected == entry["results"])
+        elif entry.get("end"):
+            return False
+        else:
+            logging.warning(f"Ignoring message with keys {list(entry)}")
+        return True
@@ -1,37 +1,131 @@
+import codec
+import json
 import logging
 import ot
 import util
+import yao
 
 class Alice(ot.YaoGarbler):
-    def __init__(self, circuits, oblivious_transfer=True, print_mode="none", filename="", bit_size=4):
-        super().__init__(circuits)
-        self.socket = util.GarblerConnection()
-        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
+    def __init__(self, circuits, oblivious_transfer=True, print_mode="none", filename="", bit_size=None,
+                 scheme=yao.DEFAULT_SCHEME, ot_mode="base", chunk_size=0,
+                 workers=1, pregarble=0, pregarble_bytes=None,
+                 pregarble_dir=None, metrics_path=None, socket=None,
+                 seeded_labels=False, optimize=False, verify_results=False):
+        if chunk_size and print_mode != "none":
+            logging.warning("Garbled tables are not streamed in print mode "
+                            f"'{print_mode}'")
+            chunk_size = 0
+        if chunk_size and pregarble:
+            logging.warning("Streamed circuits are garbled while sent, "
+                            "not pregarbled")
+        if seeded_labels and print_mode != "none":
+            logging.warning("Labels are not seeded in print mode "
+                            f"'{print_mode}', which needs all the keys")
+            seeded_labels = False
+        if seeded_labels and (pregarble or workers > 1):
+            logging.warning("Circuits with seeded labels are garbled gate "
+                            "by gate, not pregarbled nor by workers")
+        super().__init__(circuits, scheme=scheme, lazy=bool(chunk_size),
+                         workers=workers, pregarble=pregarble,
+                         pregarble_bytes=pregarble_bytes,
+                         pregarble_dir=pregarble_dir,
+                         seeded_labels=seeded_labels, optimize=optimize)
+        self.chunk_size = chunk_size  # gates per streamed chunk, 0 to send all
+        # Connection to Bob, or a util.Socket over an in-memory transport
+        self.socket = socket or util.GarblerConnection()
+        self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer, mode=ot_mode)
         self.pm = print_mode
-        self.general_max = -1
-        self.bitlen = bit_size
+        # Have Bob check the results, which reveals Alice's inputs to him,
+        # so only when verifying or debugging
+        self.verify_results = verify_results or print_mode == "verify"
+        self.metrics_path = metrics_path  # Prometheus text file of metrics
+        self.report = None  # metrics of the last session
+        self.alice_values = []  # Alice's inputs of the last circuit
+        self.results = []  # results of the last circuit
+        self.bitlen = self._check_bit_size(bit_size)
         if filename == "":
-            _, self.private_value = util.process_private_data("Alice", bit_size=bit_size)
+            self.data, self.private_value = util.process_private_data("Alice", bit_size=self.bitlen)
         else:
-            _, self.private_value = util.process_private_data("Alice", bit_size=bit_size, file_read=True, filename=filename)
+            self.data, self.private_value = util.process_private_data("Alice", bit_size=self.bitlen, file_read=True, filename=filename)
+
+    def _check_bit_size(self, bit_size):
+        """Return the bit size of Alice's values, checked against the circuits.
+
+        Args:
+            bit_size: The requested bit size, None to take the 'bits' of the
+                circuits, or their number of Alice's wires.
+
+        Raises:
+            ValueError: The circuits have different bit sizes, or another
+                one than 'bit_size', or some party's wires are not a whole
+                number of values.
+        """
+        sizes = {entry["circuit"].get("bits",
+                                      len(entry["circuit"].get("alice", [])))
+                 for entry in self.circuits}
+        if bit_size is None and len(sizes) == 1:
+            bit_size = sizes.pop()
+        elif bit_size is None or sizes - {bit_size}:
+            raise ValueError(f"Bit size {bit_size} does not match the "
+                             f"{sorted(sizes)} bits of circuits "
+                             f"'{self.name}'")
+        for entry in self.circuits:
+            circuit = entry["circuit"]
+            for party in ("alice", "bob"):
+                if len(circuit.get(party, [])) % bit_size:
+                    raise ValueError(f"Circuit {circuit['id']} has "
+                                     f"{len(circuit.get(party, []))} wires "
+                                     f"of {party}, not {bit_size}-bit values")
+        return bit_size
 
     def start(self):
-        """Start Yao protocol."""
+        """Start Yao protocol.
+
+        Each circuit is sent with a garbled instance never used before,
+        taken from the pregarbling pool when there is one. The metrics of
+        the session are then kept in self.report.
+        """
+        metrics = self.socket.metrics
         for circuit in self.circuits:
+            with metrics.time("garble"):
+                self.next_garbled(circuit)
+            metrics.count("gates_garbled",
+                          len(circuit["circuit"]["gates"]), "garble")
+            circuit["used"] = True
             to_send = {
-                "circuit": circuit["circuit"],
+                "circuit": codec.pack_circuit(circuit["circuit"]),
                 "garbled_tables": circuit["garbled_tables"],
                 "pbits_out": circuit["pbits_out"],
+                "scheme": self.scheme,
+                "ot_mode": self.ot.mode,
                 "printout": self.pm,
                 "bitlength": self.bitlen,
+                "stream": bool(self.chunk_size),
             }
             logging.debug(f"Sending circuit: {circuit['circuit']['id']}")
-            self.socket.send_wait(to_send)
+            with metrics.time("circuit"):
+                self.socket.send_wait(to_send)
             if self.pm != "none":
-                self.print(circuit)
+                self._modes[self.pm](circuit)
             print("-------------")
             self.calculate_response(circuit)
-            self.verify()
+            if self.verify_results:
+                with metrics.time("verify"):
+                    self.verify()
+        self.end_metrics()
+
+    def end_metrics(self):
+        """Log the metrics of the session, and dump the totals to
+        self.metrics_path if any."""
+        self.report = self.socket.metrics.end_session()
+        logging.info(f"Session metrics: {json.dumps(self.report)}")
+        if self.metrics_path:
+            self.socket.metrics.write_prometheus(self.metrics_path,
+                                                 labels={"role": "alice"})
+
+    def end_session(self):
+        """Tell Bob that Alice has no more circuits to send."""
+        self.socket.send_wait({"end": True})
 
     def calculate_response(self, entry):
         circuit, pbits, keys = entry["circuit"], entry["pbits"], entry["keys"]
@@ -43,14 +137,31 @@ class Alice(ot.YaoGarbler):
             for w, (key0, key1) in keys.items() if w in b_wires
         }
 
-        bits_a = [int(b) for b in self.private_value]
+        count = len(a_wires) // self.bitlen
+        if count == 1:
+            self.alice_values = [int(self.private_value, 2)]
+        else:
+            # Dataset mode, Alice's values are all inputs of the circuit
+            self.alice_values = list(self.data)
+        bits_a = [int(b) for b in util.values_t_bits(self.alice_values,
+                                                      self.bitlen, count)]
 
         for i in range(len(a_wires)):
             a_inputs[a_wires[i]] = (keys[a_wires[i]][bits_a[i]], pbits[a_wires[i]] ^ bits_a[i])
 
-        result = self.ot.get_result(a_inputs, b_keys)
-        int_result = util.circuit_t_int(result)
-        self.general_max = int_result
+        messages, rounds = self.socket.messages_sent, self.socket.round_trips
+        if self.chunk_size:
+            result = self.ot.get_streamed_result(a_inputs, b_keys,
+                                                 entry["garbled_circuit"],
+                                                 self.chunk_size)
+        else:
+            result = self.ot.get_result(a_inputs, b_keys)
+        logging.info(f"Input transfer ({self.ot.mode} OT): "
+                     f"{self.socket.messages_sent - messages} messages sent, "
+                     f"{self.socket.round_trips - rounds} round trips")
+        results = util.circuit_t_ints(result, circuit.get("results", 1))
+        self.results = results
+        int_result = results[0] if len(results) == 1 else results
         print(f"Result of function is {int_result}")
         logging.debug(f"Calculated result: {int_result}")
 
@@ -58,9 +169,11 @@ class Alice(ot.YaoGarbler):
         return ((key0, 0 ^ pbit), (key1, 1 ^ pbit))
 
     def verify(self):
+        """Have Bob check the results of the last circuit against its
+        cleartext evaluation, which reveals Alice's inputs to Bob."""
         to_send = {
-            "alice_max": int(self.private_value, 2),
-            "general_max": self.general_max
+            "alice_values": self.alice_values,
+            "results": self.results
         }
         logging.debug(f"Sending data for verification: {to_send}")
         self.socket.send_wait(to_send)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+import concurrent.futures
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zmq
+import generator
+import ot
+import util
+import yao
+
+# Version of the JSON report, bumped when its fields change
+REPORT_VERSION = 1
+
+# Transports of the OT and end-to-end benchmarks: ZeroMQ endpoints, or
+# None for util.QueueTransport, without ZeroMQ
+TRANSPORTS = {
+    "memory": None,
+    "inproc": "inproc://benchmark",
+    "tcp": "tcp://127.0.0.1:{port}",
+}
+TCP_PORT = 4090
+
+# Synthetic circuits: (kind, bits, count), of increasing size and bit width
+CIRCUITS = [
+    ("maximum", 8, 1),
+    ("maximum", 32, 1),
+    ("maximum", 128, 1),
+    ("tree-maximum", 32, 8),
+    ("tree-maximum", 32, 64),
+]
+QUICK_CIRCUITS = CIRCUITS[:2]
+
+# Numbers of Bob's wires of the OT benchmarks
+OT_WIRES = (8, 64)
+
+# Roles of main.py of the startup benchmarks
+STARTUP_ROLES = ("bob", "local")
+# Time in seconds Bob's process may take to answer its first message
+STARTUP_TIMEOUT = 30
+
+# Metrics of which a larger value is a regression, the others being rates
+LOWER_IS_BETTER = ("seconds", "messages_sent", "bytes_sent", "bytes_received",
+                   "round_trips", "peak_rss_kb", "child_peak_rss_kb")
+# Sizes of the benchmarked circuits, reported but never regressions
+COUNTS = ("gates", "non_free_gates")
+
+
+def bench_garble(kind, bits, count, scheme, repeat):
+    """Benchmark GarbledCircuit construction."""
+    circuit = generator.generate(kind, bits, count)
+    seconds = _best_time(lambda: yao.GarbledCircuit(circuit, scheme=scheme),
+                         repeat)
+    return _gate_rates(circuit, seconds)
+
+
+def bench_evaluate(kind, bits, count, scheme, repeat):
+    """Benchmark yao.evaluate on the garbled circuit of random inputs."""
+    circuit = generator.generate(kind, bits, count)
+    garbled = yao.GarbledCircuit(circuit, scheme=scheme)
+    a_inputs, b_inputs = _random_inputs(garbled)
+    pbits_out = {w: garbled.pbits[w] for w in circuit["out"]}
+    seconds = _best_time(
+        lambda: yao.evaluate(garbled.compiled, garbled.garbled_tables,
+                             pbits_out, a_inputs, b_inputs, garbled.scheme),
+        repeat)
+    return _gate_rates(circuit, seconds)
+
+
+def bench_ot(mode, wires, transport, repeat):
+    """Benchmark the transfer of the keys of 'wires' Bob's wires."""
+    b_keys = {w: ((bytes(16), 0), (bytes(range(16)), 1))
+              for w in range(wires)}
+    b_inputs = {w: random.getrandbits(1) for w in range(wires)}
+
+    def alice(transfer):
+        transfer.send_inputs({}, b_keys)
+        transfer.socket.receive()
+
+    def bob(transfer):
+        _, b_inputs_encr = transfer.receive_inputs(b_inputs)
+        transfer.socket.send(True)
+        if b_inputs_encr != {w: b_keys[w][b] for w, b in b_inputs.items()}:
+            raise ValueError("Oblivious transfer returned wrong keys")
+
+    result = _run_pair(alice, bob, transport, mode, repeat)
+    result["ots_per_sec"] = wires / result["seconds"]
+    return result
+
+
+def bench_protocol(kind, bits, count, scheme, mode, transport, repeat):
+    """Benchmark Alice and Bob's run of a circuit: garbling, sending the
+    circuit, input transfer and evaluation."""
+    circuit = generator.generate(kind, bits, count)
+
+    def alice(transfer):
+        garbled = yao.GarbledCircuit(circuit, scheme=scheme)
+        pbits_out = {w: garbled.pbits[w] for w in circuit["out"]}
+        transfer.socket.send_wait((circuit, garbled.garbled_tables,
+                                   pbits_out))
+        a_inputs, _ = _random_inputs(garbled)
+        b_keys = {w: ((garbled.keys[w][0], garbled.pbits[w]),
+                      (garbled.keys[w][1], garbled.pbits[w] ^ 1))
+                  for w in circuit["bob"]}
+        transfer.get_result(a_inputs, b_keys)
+
+    def bob(transfer):
+        spec, g_tables, pbits_out = transfer.socket.receive()
+        transfer.socket.send(True)
+        b_inputs = {w: random.getrandbits(1) for w in spec["bob"]}
+        transfer.send_result(spec, g_tables, pbits_out, b_inputs, scheme)
+
+    result = _run_pair(alice, bob, transport, mode, repeat)
+    result.update(_gate_rates(circuit, result["seconds"]))
+    return result
+
+
+def bench_startup(role, repeat):
+    """Benchmark the startup of 'python main.py role', imports included:
+    until Bob answers a first message for "bob", a whole run of the default
+    circuit for "local"."""
+    src = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        data_file = os.path.join(directory, "data.txt")
+        with open(data_file, "w") as f:
+            f.write("5 9 1\n")
+        command = [sys.executable, "main.py", role, "-i", data_file]
+        if role == "bob":
+            seconds = _best_time(lambda: _start_bob(command, src), repeat)
+        else:
+            command += ["--bob-input", data_file]
+            seconds = _best_time(
+                lambda: subprocess.run(command, cwd=src, check=True,
+                                       stdout=subprocess.DEVNULL),
+                repeat)
+    # Kilobytes on Linux, of the largest process run
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {"seconds": seconds, "child_peak_rss_kb": rss}
+
+
+def _start_bob(command, cwd):
+    """Start Bob's process, wait until it answers a first message, then
+    stop it."""
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.DEVNULL)
+    socket = util.GarblerConnection(f"tcp://localhost:{util.LOCAL_PORT}")
+    try:
+        # Bob answers the end of a session, then waits for the next one
+        socket.send({"end": True})
+        if not socket.transport.poll(STARTUP_TIMEOUT * 1000):
+            raise TimeoutError(f"Bob did not answer in {STARTUP_TIMEOUT} s")
+        socket.receive()
+    finally:
+        socket.close()
+        process.terminate()
+        process.wait()
+
+
+def _best_time(func, repeat):
+    """Return the best time in seconds of 'repeat' calls of 'func'."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _gate_rates(circuit, seconds):
+    gates = len(circuit["gates"])
+    and_gates = sum(gate["type"] not in ("XOR", "XNOR", "NOT")
+                    for gate in circuit["gates"])
+    return {
+        "gates": gates,
+        "non_free_gates": and_gates,
+        "seconds": seconds,
+        "gates_per_sec": gates / seconds,
+    }
+
+
+def _random_inputs(garbled):
+    """Return Alice's and Bob's (key, encr_bit) inputs for random bits."""
+    inputs = []
+    for party in ("alice", "bob"):
+        labels = {}
+        for w in garbled.circuit.get(party, []):
+            bit = random.getrandbits(1)
+            labels[w] = (garbled.keys[w][bit], garbled.pbits[w] ^ bit)
+        inputs.append(labels)
+    return inputs
+
+
+def _run_pair(alice, bob, transport, mode, repeat):
+    """Run alice() against bob() in a thread, 'repeat' times on the same
+    sockets, and return the best time and the traffic of one run."""
+    context = zmq.Context()
+    if TRANSPORTS[transport] is None:
+        alice_transport, bob_transport = util.queue_pair()
+        bob_socket = util.Socket(transport=bob_transport)
+        alice_socket = util.Socket(transport=alice_transport)
+    else:
+        endpoint = TRANSPORTS[transport].format(port=TCP_PORT)
+        bob_socket = util.Socket(zmq.REP,
+                                 endpoint.replace("127.0.0.1", "*"),
+                                 context=context)
+        alice_socket = util.Socket(zmq.REQ, endpoint, context=context)
+    errors = []
+
+    def serve():
+        transfer = ot.ObliviousTransfer(bob_socket, mode=mode)
+        try:
+            for _ in range(repeat):
+                bob(transfer)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    transfer = ot.ObliviousTransfer(alice_socket, mode=mode)
+    best = None
+    try:
+        for _ in range(repeat):
+            alice_socket.reset_counters()
+            start = time.perf_counter()
+            alice(transfer)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        thread.join()
+        if errors:
+            raise errors[0]
+    finally:
+        alice_socket.close()
+        bob_socket.close()
+        context.term()
+    return {
+        "seconds": best,
+        "messages_sent": alice_socket.messages_sent,
+        "bytes_sent": alice_socket.bytes_sent,
+        "bytes_received": alice_socket.bytes_received,
+        "round_trips": alice_socket.round_trips,
+    }
+
+
+def _run_case(name, params, repeat):
+    """Run a benchmark, in a process of its own for its peak RSS."""
+    result = BENCHMARKS[name](*params.values(), repeat)
+    # Kilobytes on Linux
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+# Benchmarks, by name
+BENCHMARKS = {
+    "garble": bench_garble,
+    "evaluate": bench_evaluate,
+    "ot": bench_ot,
+    "protocol": bench_protocol,
+    "startup": bench_startup,
+}
+
+
+def cases(schemes=(yao.DEFAULT_SCHEME, ), ot_modes=ot.OT_MODES,
+          transports=tuple(TRANSPORTS), quick=False):
+    """Yield the (name, params) of the benchmark cases."""
+    circuits = QUICK_CIRCUITS if quick else CIRCUITS
+    for kind, bits, count in circuits:
+        for scheme in schemes:
+            params = {"kind": kind, "bits": bits, "count": count,
+                      "scheme": scheme}
+            yield "garble", params
+            yield "evaluate", params
+    for mode in ot_modes:
+        for wires in OT_WIRES[:1] if quick else OT_WIRES:
+            for transport in transports:
+                yield "ot", {"mode": mode, "wires": wires,
+                             "transport": transport}
+    for kind, bits, count in circuits:
+        for transport in transports:
+            yield "protocol", {"kind": kind, "bits": bits, "count": count,
+                               "scheme": schemes[0], "mode": "extension",
+                               "transport": transport}
+    for role in STARTUP_ROLES:
+        yield "startup", {"role": role}
+
+
+def run(selected_cases, repeat=3):
+    """Run benchmark cases, each in a new process, and return the report."""
+    results = []
+    for name, params in selected_cases:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(_run_case, name, params, repeat).result()
+        logging.info(f"{name} {params}: {result['seconds']:.4f} s")
+        results.append({"benchmark": name, "params": params,
+                        "metrics": result})
+    return {
+        "version": REPORT_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the regressions of a report against a baseline report.
+
+    A metric regresses when it is worse than in the baseline by more than
+    the 'tolerance' fraction: larger for LOWER_IS_BETTER metrics, smaller
+    for rates. The COUNTS are not compared.
+
+    Returns:
+        A list of (benchmark, params, metric, baseline value, value).
+    """
+    base = {(r["benchmark"], json.dumps(r["params"], sort_keys=True)):
+            r["metrics"] for r in baseline["results"]}
+    regressions = []
+    for r in report["results"]:
+        key = (r["benchmark"], json.dumps(r["params"], sort_keys=True))
+        for metric, value in r["metrics"].items():
+            old = base.get(key, {}).get(metric)
+            if not old or metric in COUNTS:
+                continue
+            if metric in LOWER_IS_BETTER:
+                worse = value > old * (1 + tolerance)
+            else:
+                worse = value < old * (1 - tolerance)
+            if worse:
+                regressions.append((r["benchmark"], r["params"], metric, old,
+                                    value))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Benchmark Yao protocol.")
+        parser.add_argument("-o",
+                            "--output",
+                            metavar="path",
+                            default="",
+                            help="path to the JSON report to write "
+                            "(default is standard output)")
+        parser.add_argument("-b",
+                            "--benchmark",
+                            choices=BENCHMARKS.keys(),
+                            action="append",
+                            help="a benchmark to run (default all)")
+        parser.add_argument("-s",
+                            "--scheme",
+                            choices=yao.SCHEMES.keys(),
+                            action="append",
+                            help="a garbling scheme to benchmark "
+                            f"(default '{yao.DEFAULT_SCHEME}')")
+        parser.add_argument("-r",
+                            "--repeat",
+                            metavar="count",
+                            type=int,
+                            default=3,
+                            help="the number of runs of each case, the best "
+                            "one being reported (default 3)")
+        parser.add_argument("-q",
+                            "--quick",
+                            action="store_true",
+                            help="run only the smallest cases")
+        parser.add_argument("-c",
+                            "--compare",
+                            metavar="path",
+                            default="",
+                            help="path to a baseline report; exit with "
+                            "status 1 on regressions")
+        parser.add_argument("-t",
+                            "--tolerance",
+                            metavar="fraction",
+                            type=float,
+                            default=0.2,
+                            help="the tolerated slowdown against the "
+                            "baseline (default 0.2)")
+
+        args = parser.parse_args()
+        logging.basicConfig(format="[%(levelname)s] %(message)s",
+                            level=logging.INFO)
+        selected = [(name, params) for name, params in
+                    cases(tuple(args.scheme or (yao.DEFAULT_SCHEME, )),
+                          quick=args.quick)
+                    if not args.benchmark or name in args.benchmark]
+        report = run(selected, args.repeat)
+
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare(report, json.load(f), args.tolerance)
+            for name, params, metric, old, value in regressions:
+                logging.error(f"Regression in {name} {params}: {metric} "
+                              f"{old:.6g} -> {value:.6g}")
+            if regressions:
+                sys.exit(1)
+
+    initialize()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+import collections
+import itertools
+import random
+import compiler
+import yao
+
+# Bit-sliced evaluation of circuits in cleartext
+#
+# A wire carries a Python integer used as a vector of bits, one per input
+# assignment (lane): bit j of the integer is the value of the wire for the
+# j-th assignment of a batch. Each gate is then evaluated for all the lanes
+# of a batch by one integer operation, instead of one evaluation of the
+# circuit per assignment.
+#
+# truth_table() evaluates all the assignments of a circuit: assignment n
+# gives the inputs the bits of n, Alice's wires then Bob's, the first wire
+# being the most significant bit. simulate() evaluates given assignments,
+# as a reference for generated circuits and garbling schemes.
+
+# log2 of the number of lanes of a batch
+BATCH_BITS = 16
+
+AND, OR, XOR, NAND, NOR, XNOR, NOT = (compiler.OPCODES[gate_type]
+                                      for gate_type in compiler.GATE_TYPES)
+
+
+def evaluate(circuit, inputs, mask):
+    """Evaluate a circuit over bit vectors.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        inputs: The bit vectors of the input wires, by compiled index.
+        mask: The bit vector with all the lanes set.
+
+    Returns:
+        The list of the bit vectors of all the wires, by compiled index.
+    """
+    circuit = compiler.compile_circuit(circuit)
+    values = list(inputs)
+    append = values.append
+    for op, in_a, in_b in zip(circuit.ops, circuit.in_a, circuit.in_b):
+        a = values[in_a]
+        if op == XOR:
+            append(a ^ values[in_b])
+        elif op == AND:
+            append(a & values[in_b])
+        elif op == NOT:
+            append(a ^ mask)
+        elif op == OR:
+            append(a | values[in_b])
+        elif op == XNOR:
+            append(a ^ values[in_b] ^ mask)
+        elif op == NAND:
+            append(a & values[in_b] ^ mask)
+        else:
+            append((a | values[in_b]) ^ mask)
+    return values
+
+
+def input_vectors(num_inputs, start, lanes):
+    """Return the bit vectors of the inputs for a batch of assignments.
+
+    Args:
+        num_inputs: The number of input wires.
+        start: The first assignment of the batch, a multiple of 'lanes'.
+        lanes: The number of assignments of the batch, a power of 2.
+    """
+    mask = (1 << lanes) - 1
+    vectors = []
+    for i in range(num_inputs):
+        bit = num_inputs - 1 - i  # bit of the assignment read by input i
+        half = 1 << bit
+        if half >= lanes:
+            vectors.append(mask if (start >> bit) & 1 else 0)
+        else:
+            # Runs of 'half' zeros then 'half' ones, repeated over the lanes
+            unit = ((1 << half) - 1) << half
+            vectors.append(mask // ((1 << 2 * half) - 1) * unit)
+    return vectors
+
+
+def truth_table(circuit, batch_bits=BATCH_BITS):
+    """Evaluate a circuit for all its input assignments, batch by batch.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        batch_bits: Optional; log2 of the number of lanes of a batch.
+
+    Yields:
+        Triples (start, lanes, outputs): the first assignment and the
+        number of assignments of a batch, and the bit vectors of the output
+        wires.
+    """
+    circuit = compiler.compile_circuit(circuit)
+    num_inputs = circuit.num_inputs
+    lanes = 1 << min(num_inputs, batch_bits)
+    mask = (1 << lanes) - 1
+    for start in range(0, 1 << num_inputs, lanes):
+        values = evaluate(circuit,
+                          input_vectors(num_inputs, start, lanes), mask)
+        yield start, lanes, [values[out] for out in circuit.out]
+
+
+def rows(circuit, batch_bits=BATCH_BITS):
+    """Yield (assignment, output bits) for all the input assignments."""
+    for start, lanes, outputs in truth_table(circuit, batch_bits):
+        for lane, bits in enumerate(_lane_bits(outputs, lanes)):
+            yield start + lane, [int(bit) for bit in bits]
+
+
+def _lane_bits(vectors, lanes):
+    """Return the string of the bits of each lane of bit vectors."""
+    columns = [format(vector, f"0{lanes}b")[::-1] for vector in vectors]
+    return ["".join(bits) for bits in zip(*columns)]
+
+
+def _simulate_strings(circuit, assignments, batch_bits):
+    """Evaluate a compiled circuit for assignments given as strings of
+    input bits, and return the strings of their output bits."""
+    assignments = iter(assignments)
+    results = []
+    while True:
+        batch = list(itertools.islice(assignments, 1 << batch_bits))
+        if not batch:
+            return results
+        for bits in batch:
+            if len(bits) != circuit.num_inputs:
+                raise ValueError(f"Assignment of {len(bits)} bits for "
+                                 f"{circuit.num_inputs} input wires")
+        # Lane j of each input vector is the input bit of assignment j
+        inputs = [int("".join(bits)[::-1], 2) for bits in zip(*batch)]
+        values = evaluate(circuit, inputs, (1 << len(batch)) - 1)
+        results.extend(_lane_bits([values[out] for out in circuit.out],
+                                  len(batch)))
+
+
+def check_garbled(garbled_circuit):
+    """Check each garbled gate against its cleartext gate.
+
+    Every row of every gate is evaluated with the keys of its input bits,
+    and must give the key and encrypted bit of the output bit. Together
+    with the cleartext truth table, this verifies the garbled circuit for
+    all input assignments with at most 4 evaluations per gate, instead of
+    one evaluation of the circuit per assignment.
+
+    Args:
+        garbled_circuit: A yao.GarbledCircuit, with its garbled tables.
+
+    Returns:
+        A list of (gate output wire, input bits) of the rows that failed.
+
+    Raises:
+        ValueError: The circuit was created lazy, without all its garbled
+            tables.
+    """
+    compiled = garbled_circuit.compiled
+    if len(garbled_circuit.garbled_tables) != len(compiled):
+        raise ValueError(f"Circuit {compiled.id} has "
+                         f"{len(garbled_circuit.garbled_tables)} garbled "
+                         f"tables for {len(compiled)} gates, lazy circuits "
+                         f"cannot be checked")
+    keys = [garbled_circuit.keys[wire] for wire in compiled.wires]
+    pbits = [garbled_circuit.pbits[wire] for wire in compiled.wires]
+    evaluate_gate = garbled_circuit.scheme.evaluate_gate
+    failures = []
+    for table, (gate_type, gate_in, gate_out) in zip(
+            garbled_circuit.garbled_tables, compiled.iter_gates()):
+        operator = yao.OPERATORS[gate_type]
+        for bits in itertools.product((0, 1), repeat=len(gate_in)):
+            inputs = [(keys[wire][bit], pbits[wire] ^ bit)
+                      for wire, bit in zip(gate_in, bits)]
+            bit_out = int(operator(*bits))
+            try:
+                key, encr_bit = evaluate_gate(gate_type, gate_out, table,
+                                              inputs)
+            except Exception:  # a row that cannot be decrypted
+                key = encr_bit = None
+            if (key != keys[gate_out][bit_out]
+                    or encr_bit != pbits[gate_out] ^ bit_out):
+                failures.append((compiled.wires[gate_out], bits))
+    return failures
+
+
+def print_truth_table(circuit, batch_bits=BATCH_BITS):
+    """Print the outputs of a circuit for all its input assignments."""
+    a_wires = circuit.get("alice", [])
+    b_wires = circuit.get("bob", [])
+    outputs = circuit["out"]
+    num_a, num_inputs = len(a_wires), len(a_wires) + len(b_wires)
+    for n, bits_out in rows(circuit, batch_bits):
+        bits = format(n, "b").zfill(num_inputs)
+        print(f"  Alice{a_wires} = {' '.join(bits[:num_a])} "
+              f"Bob{b_wires} = {' '.join(bits[num_a:])}  "
+              f"Outputs{outputs} = {' '.join(map(str, bits_out))}")
+
+
+def summary(circuit, batch_bits=BATCH_BITS):
+    """Return the number of assignments and, for each output wire, the
+    number of assignments setting it."""
+    circuit = compiler.compile_circuit(circuit)
+    ones = [0] * len(circuit.out)
+    for _, _, outputs in truth_table(circuit, batch_bits):
+        for i, vector in enumerate(outputs):
+            ones[i] += bin(vector).count("1")
+    return 1 << circuit.num_inputs, ones
+
+
+def simulate(circuit, assignments, batch_bits=BATCH_BITS):
+    """Evaluate a circuit for independent input assignments.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        assignments: An iterable of lists of input bits, Alice's wires then
+            Bob's.
+        batch_bits: Optional; log2 of the number of assignments evaluated
+            at once.
+
+    Returns:
+        The list of the output bits of each assignment.
+
+    Raises:
+        ValueError: An assignment has not one bit per input wire.
+    """
+    circuit = compiler.compile_circuit(circuit)
+    results = _simulate_strings(
+        circuit, ("".join(map(str, bits)) for bits in assignments),
+        batch_bits)
+    return [[int(bit) for bit in bits] for bits in results]
+
+
+def simulate_values(circuit, pairs, batch_bits=BATCH_BITS, compiled=None):
+    """Evaluate a circuit for pairs of Alice's and Bob's input values.
+
+    Values are given and returned as in util.values_t_bits() and
+    util.circuit_t_ints(): each party's values have the bit size of the
+    circuit ('bits', or the number of Alice's wires), missing values are 0,
+    and the outputs are split into the circuit's 'results' values.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        pairs: An iterable of pairs (Alice's values, Bob's values), lists
+            of integers.
+        batch_bits: Optional; log2 of the number of pairs evaluated at once.
+        compiled: Optional; the CompiledCircuit of 'circuit'.
+
+    Returns:
+        The list of the result values of each pair.
+    """
+    bit_size = circuit.get("bits", len(circuit.get("alice", [])))
+    counts = [len(circuit.get(party, [])) // bit_size
+              for party in ("alice", "bob")]
+    num_results = circuit.get("results", 1)
+    width = len(circuit["out"]) // num_results
+
+    value_format = f"0{bit_size}b"
+
+    def to_bits(values, count):
+        if len(values) > count:
+            raise ValueError(f"{len(values)} values do not fit a circuit of "
+                             f"{count} values")
+        return ("".join(format(value, value_format) for value in values)
+                + "0" * bit_size * (count - len(values)))
+
+    assignments = (to_bits(a_values, counts[0]) + to_bits(b_values, counts[1])
+                   for a_values, b_values in pairs)
+    results = _simulate_strings(
+        compiler.compile_circuit(circuit if compiled is None else compiled),
+        assignments, batch_bits)
+    return [[int(bits[i:i + width], 2) for i in range(0, len(bits), width)]
+            for bits in results]
+
+
+def stats(circuit):
+    """Return the gate counts and depths of a circuit.
+
+    Non-free gates are the gates other than XOR, XNOR and NOT, which cost a
+    garbled table with Free-XOR schemes. The non-free depth is the largest
+    number of non-free gates on a path from an input to an output.
+    """
+    compiled = compiler.compile_circuit(circuit)
+    gate_types = collections.Counter(compiler.GATE_TYPES[op]
+                                     for op in compiled.ops)
+    free = (XOR, XNOR, NOT)
+    depth = [0] * len(compiled.wires)
+    non_free_depth = [0] * len(compiled.wires)
+    out = compiled.num_inputs
+    for op, in_a, in_b in zip(compiled.ops, compiled.in_a, compiled.in_b):
+        ins = (in_a, ) if op == NOT else (in_a, in_b)
+        depth[out] = max(depth[wire] for wire in ins) + 1
+        non_free_depth[out] = (max(non_free_depth[wire] for wire in ins)
+                               + (op not in free))
+        out += 1
+    return {
+        "id": compiled.id,
+        "inputs": compiled.num_inputs,
+        "outputs": len(compiled.out),
+        "gates": len(compiled),
+        "gate_types": dict(gate_types),
+        "non_free_gates": sum(count for gate_type, count in gate_types.items()
+                              if compiler.OPCODES[gate_type] not in free),
+        "depth": max((depth[wire] for wire in compiled.out), default=0),
+        "non_free_depth": max((non_free_depth[wire]
+                               for wire in compiled.out), default=0),
+    }
+
+
+def check_scheme(circuit, scheme=yao.DEFAULT_SCHEME, count=100):
+    """Compare garbled evaluations of a circuit with the simulator.
+
+    The circuit is garbled once and evaluated with 'count' random input
+    assignments.
+
+    Returns:
+        The list of the assignments whose outputs differ.
+    """
+    compiled = compiler.compile_circuit(circuit)
+    garbled = yao.GarbledCircuit(circuit, scheme=scheme)
+    pbits, keys = garbled.pbits, garbled.keys
+    pbits_out = {w: pbits[w] for w in circuit["out"]}
+    inputs = list(compiled.wires[:compiled.num_inputs])
+    assignments = [[random.getrandbits(1) for _ in inputs]
+                   for _ in range(count)]
+    failures = []
+    for bits, expected in zip(assignments, simulate(compiled, assignments)):
+        labels = {w: (keys[w][bit], pbits[w] ^ bit)
+                  for w, bit in zip(inputs, bits)}
+        result = yao.evaluate(compiled, garbled.garbled_tables, pbits_out,
+                              labels, {}, garbled.scheme)
+        if [result[w] for w in circuit["out"]] != expected:
+            failures.append(bits)
+    return failures
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import util
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Simulate circuits in cleartext.")
+        parser.add_argument("circuit",
+                            help="path to the circuit file")
+        parser.add_argument("-n",
+                            "--count",
+                            metavar="assignments",
+                            type=int,
+                            default=0,
+                            help="the number of random input assignments "
+                            "checked against garbled evaluations "
+                            "(default 0, statistics only)")
+        parser.add_argument("-s",
+                            "--scheme",
+                            choices=yao.SCHEMES.keys(),
+                            default=yao.DEFAULT_SCHEME,
+                            help="the garbling scheme checked "
+                            f"(default '{yao.DEFAULT_SCHEME}')")
+
+        args = parser.parse_args()
+        failed = False
+        for circuit in util.parse_circuits(args.circuit)["circuits"]:
+            print(json.dumps(stats(circuit)))
+            if args.count:
+                failures = check_scheme(circuit, args.scheme, args.count)
+                print(f"{circuit['id']}: {args.count - len(failures)} of "
+                      f"{args.count} garbled evaluations match")
+                failed = failed or bool(failures)
+        if failed:
+            raise SystemExit(1)
+
+    initialize()
@@ -1,54 +1,150 @@
+import bitslice
+import codec
+import json
 import logging
 import ot
 import util
 
 class Bob:
-    def __init__(self, oblivious_transfer=True, filename=""):
-        self.socket = util.EvaluatorSocket()
+    """Yao evaluator, serving one Alice at a time on its socket.
+
+    Args:
+        oblivious_transfer: Optional; whether Bob's keys are obliviously
+            transferred.
+        filename: Optional; the data file, standard input by default.
+        socket: Optional; the socket to Alice, a util.EvaluatorSocket
+            bound to the local port by default.
+        data: Optional; Bob's data, read from 'filename' if not given.
+        metrics_path: Optional; the Prometheus text file where the metrics
+            of all sessions are dumped when a session ends.
+        metrics_labels: Optional; a dict of labels of the dumped metrics.
+    """
+    def __init__(self, oblivious_transfer=True, filename="", socket=None,
+                 data=None, metrics_path=None, metrics_labels=None):
+        self.socket = socket or util.EvaluatorSocket()
+        self.metrics_path = metrics_path
+        self.metrics_labels = {"role": "bob", **(metrics_labels or {})}
+        self.oblivious_transfer = oblivious_transfer
         self.ot = ot.ObliviousTransfer(self.socket, enabled=oblivious_transfer)
         self.private_value = "0"
-        if filename == "":
-            self.data, _ = util.process_private_data("Bob")
+        self.values = []  # cleaned data, with the bit size of the circuit
+        self.bitlen = None
+        self.circuit = None  # last circuit evaluated, checked by verify()
+        self.compiled = None  # and its CompiledCircuit
+        # Circuits received, compiled once for all the sessions
+        self.circuits = codec.CircuitCache()
+        # Cleaned up with the bit size of each circuit, see handle()
+        if data is not None:
+            self.data = list(data)
+        elif filename == "":
+            self.data = util.read_private_data()
         else:
-            self.data, _ = util.process_private_data("Bob", file_read=True, filename=filename)
+            self.data = util.read_private_data(file_read=True, filename=filename)
+
+    def listen(self, sessions=None):
+        """Start listening for Alice messages.
 
-    def listen(self):
-        """Start listening for Alice messages."""
+        Args:
+            sessions: Optional; the number of sessions to serve before
+                returning, forever by default.
+        """
         logging.info("Start listening")
         try:
             for entry in self.socket.poll_socket():
-                self.socket.send(True)
-                if len(entry) == 5:
-                    _, self.private_value = util.process_private_data(data=self.data, bit_size=entry["bitlength"])
-                    if entry["printout"] != "none":
-                        self.send_evaluation(entry)
-                    self.send_response(entry)
-                elif len(entry) == 2:
-                    self.verify(entry)
-                else:
-                    logging.info("Stop listening")
-                    exit(1)
+                if not self.handle(entry):
+                    self.new_session()
+                    if sessions is not None:
+                        sessions -= 1
+                        if sessions == 0:
+                            return
         except KeyboardInterrupt:
             logging.info("Stop listening")
 
+    def new_session(self):
+        """Forget the OT state of the previous session."""
+        self.ot = ot.ObliviousTransfer(self.socket,
+                                       enabled=self.oblivious_transfer)
+
+    def end_session(self):
+        """Log the metrics of the session ended, and dump the totals to
+        self.metrics_path if any.
+
+        Returns:
+            The metrics of the session.
+        """
+        report = self.socket.metrics.end_session()
+        logging.info(f"Session metrics: {json.dumps(report)}")
+        if self.metrics_path:
+            self.socket.metrics.write_prometheus(self.metrics_path,
+                                                 labels=self.metrics_labels)
+        return report
+
+    def handle(self, entry):
+        """Answer a message starting an exchange with Alice.
+
+        Returns:
+            False if Alice ended the session, True otherwise.
+        """
+        self.socket.send(True)
+        if not isinstance(entry, dict):
+            logging.warning(f"Ignoring unexpected message {entry!r}")
+        elif "circuit" in entry:
+            entry["circuit"], entry["compiled"] = self.circuits.get(
+                entry["circuit"])
+            self.circuit, self.compiled = entry["circuit"], entry["compiled"]
+            self.ot.mode = entry["ot_mode"]
+            self.bitlen = entry["bitlength"]
+            self.values, self.private_value = util.process_private_data(data=self.data, bit_size=self.bitlen)
+            if entry["printout"] != "none":
+                self.send_evaluation(entry)
+            if entry.get("stream"):
+                self.send_streamed_response(entry)
+            else:
+                self.send_response(entry)
+        elif "results" in entry:
+            with self.socket.metrics.time("verify"):
+                self.verify(entry)
+        elif entry.get("end"):
+            logging.info("Session ended by Alice")
+            self.end_session()
+            return False
+        else:
+            logging.warning(f"Ignoring message with keys {list(entry)}")
+        return True
+
     def send_evaluation(self, entry):
-        circuit, pbits_out = entry["circuit"], entry["pbits_out"]
-        garbled_tables = entry["garbled_tables"]
-        a_wires = circuit.get("alice", [])
-        b_wires = circuit.get("bob", [])
-        N = len(a_wires) + len(b_wires)
+        """Print the outputs of the circuit for all the input assignments.
 
+        They are evaluated in cleartext, in bit-sliced batches, without
+        exchanging with Alice.
+        """
+        circuit = entry["circuit"]
         print(f"Received {circuit['id']}")
+        if entry["printout"] == "verify":
+            assignments, ones = bitslice.summary(circuit)
+            print(f"  {assignments} input assignments, outputs "
+                  f"{circuit['out']} set by {ones}")
+        else:
+            bitslice.print_truth_table(circuit)
 
-        for bits in [format(n, 'b').zfill(N) for n in range(2 ** N)]:
-            bits_b = [int(b) for b in bits[N - len(b_wires):]]
+    def _input_values(self, b_wires):
+        """Return Bob's input values: his local maximum, or all his values
+        if the circuit takes several of them."""
+        if len(b_wires) // self.bitlen == 1:
+            return [int(self.private_value, 2)]
+        return self.values
 
-            b_inputs_clear = {
-                b_wires[i]: bits_b[i]
-                for i in range(len(b_wires))
-            }
+    def _input_bits(self, b_wires):
+        """Return the input bits of Bob's input values."""
+        count = len(b_wires) // self.bitlen
+        return [int(b) for b in util.values_t_bits(
+            self._input_values(b_wires), self.bitlen, count)]
 
-            self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear)
+    def _print_result(self, circuit, result):
+        results = util.circuit_t_ints(result, circuit.get("results", 1))
+        int_result = results[0] if len(results) == 1 else results
+        print(f"Result of function is {int_result}")
+        logging.debug(f"Calculated result: {int_result}")
 
     def send_response(self, entry):
         circuit, pbits_out = entry["circuit"], entry["pbits_out"]
@@ -57,27 +153,51 @@ class Bob:
 
         print(f"Received {circuit['id']}")
 
-        bits_b = [int(b) for b in self.private_value]
+        bits_b = self._input_bits(b_wires)
 
         b_inputs_clear = {
             b_wires[i]: bits_b[i]
             for i in range(len(b_wires))
         }
 
-        result = self.ot.send_result(circuit, garbled_tables, pbits_out, b_inputs_clear)
-        int_result = util.circuit_t_int(result)
-        print(f"Result of function is {int_result}")
-        logging.debug(f"Calculated result: {int_result}")
+        result = self.ot.send_result(entry["compiled"], garbled_tables,
+                                     pbits_out, b_inputs_clear,
+                                     entry["scheme"])
+        self._print_result(circuit, result)
+
+    def send_streamed_response(self, entry):
+        circuit = entry["circuit"]
+        b_wires = circuit.get("bob", [])
+
+        print(f"Received {circuit['id']}")
+
+        bits_b = self._input_bits(b_wires)
+
+        b_inputs_clear = {
+            b_wires[i]: bits_b[i]
+            for i in range(len(b_wires))
+        }
+
+        result = self.ot.send_streamed_result(entry["compiled"],
+                                              b_inputs_clear,
+                                              entry["scheme"])
+        self._print_result(circuit, result)
 
     def verify(self, entry):
+        """Check the results Alice obtained for the last circuit against its
+        cleartext evaluation on Alice's and Bob's inputs."""
         logging.info("Verifying")
         self.socket.receive()
-        alice_max = entry["alice_max"]
-        general_max = entry["general_max"]
-        verification_max = max(alice_max, int(self.private_value, 2))
-        res = verification_max == general_max
+        results = entry["results"]
+        expected = bitslice.simulate_values(
+            self.circuit, [(entry["alice_values"],
+                            self._input_values(self.circuit.get("bob", [])))],
+            compiled=self.compiled)[0]
+        res = results == expected
         if res:
             print("Verified correctly")
         else:
-            print(f"Error! Through transfer obtained: {general_max}, correct value: {verification_max}")
+            if len(results) == len(expected) == 1:
+                results, expected = results[0], expected[0]
+            print(f"Error! Through transfer obtained: {results}, correct value: {expected}")
         self.socket.send(res)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import os
+import codec
+import compiler
+
+# Reader of circuits in the Bristol formats
+#
+# Bristol Fashion files start with the number of gates and wires, then the
+# number of input values and the bit size of each, then the same for output
+# values. The original Bristol format has one line of three sizes instead:
+# the bits of the two inputs and of the output. Each following line is a
+# gate: its number of inputs and outputs, its input wires, its output
+# wires and its type. Input values take the first wires and output values
+# the last ones, least significant bit first.
+#
+# A file becomes a circuit spec: the first half of the input values goes
+# to Alice, the rest to Bob, and each value is listed most significant bit
+# first like generated circuits. INV gates become NOT gates, EQW copies are
+# dropped in favour of their source wire, EQ constants are computed from
+# the first input wire (x XOR x, x XNOR x), and MAND gates are split into
+# AND gates.
+#
+# Parsed circuits are cached in compiled form, packed with
+# codec.pack_compiled(), in CACHE_DIR under the SHA-256 of the file, so that
+# a large circuit is parsed and sorted once, and then only read back. The
+# spec of a circuit is rebuilt from its compiled form, gates in topological
+# order, whether it comes from the cache or not.
+
+# Extensions of Bristol circuit files
+EXTENSIONS = (".txt", ".bristol")
+
+# Directory of the cache, from the YAO_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get("YAO_CACHE_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache",
+                                        "yao"))
+CACHE_EXTENSION = ".ygc"
+# Version of the cached circuits, bumped when parsing changes
+CACHE_VERSION = 2
+
+# Gate types of Bristol files with their type in the circuit format
+GATE_TYPES = {"AND": "AND", "XOR": "XOR", "INV": "NOT", "NOT": "NOT",
+              "OR": "OR", "NAND": "NAND", "NOR": "NOR", "XNOR": "XNOR"}
+
+
+def is_bristol(path):
+    """Return whether a circuit file is in a Bristol format, by extension."""
+    return path.endswith(EXTENSIONS)
+
+
+def load(path, cache_dir=CACHE_DIR):
+    """Return the circuits of a Bristol file, in the form of parsed JSON
+    circuit files, with their compiled form under "compiled".
+
+    Args:
+        path: The path of the Bristol file.
+        cache_dir: Optional; the directory of the cache, None not to cache.
+
+    Raises:
+        ValueError: The file is not a valid Bristol circuit.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.splitext(os.path.basename(path))[0]
+    if cache_dir is None:
+        return _parsed(name, *_parse(data.decode(), name))
+
+    digest = hashlib.sha256(data).hexdigest()
+    cache_path = os.path.join(cache_dir, digest + CACHE_EXTENSION)
+    try:
+        with open(cache_path, "rb") as f:
+            cached = codec.unpack(f.read())
+        if cached["version"] == CACHE_VERSION:
+            logging.debug(f"Read {path} from the cache {cache_path}")
+            compiled = codec.unpack_compiled(cached["compiled"])
+            # The same file may have been cached under another name
+            compiled.id = name
+            return _parsed(name, compiled, cached["options"])
+    except FileNotFoundError:
+        pass
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning(f"Ignoring the cache {cache_path}: {e}")
+
+    compiled, options = _parse(data.decode(), name)
+    cached = codec.pack({"version": CACHE_VERSION,
+                         "compiled": codec.pack_compiled(compiled),
+                         "options": options})
+    os.makedirs(cache_dir, exist_ok=True)
+    # Renamed once written, so that a partial file is never read
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(cached)
+    os.replace(tmp_path, cache_path)
+    return _parsed(name, compiled, options)
+
+
+def _parsed(name, compiled, options):
+    """Return the parsed circuit file of a compiled circuit and the options
+    of its spec (see codec.CIRCUIT_OPTIONS)."""
+    circuit = compiled.spec()
+    circuit.update(options)
+    return {"name": name, "circuits": [circuit], "compiled": [compiled]}
+
+
+def parse(text, circuit_id=None):
+    """Return the circuit spec of the text of a Bristol file.
+
+    Raises:
+        ValueError: The text is not a valid Bristol circuit.
+    """
+    compiled, options = _parse(text, circuit_id)
+    circuit = compiled.spec()
+    circuit.update(options)
+    return circuit
+
+
+def _parse(text, circuit_id):
+    """Return the CompiledCircuit of the text of a Bristol file, and the
+    options of its spec."""
+    lines = [line.split() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    # Header lines are the ones before the first gate, which ends with a type
+    header = next((i for i, line in enumerate(lines)
+                   if not line[-1].isdigit()), len(lines))
+    try:
+        sizes = [[int(field) for field in line] for line in lines[:header]]
+        if header == 3:
+            # Bristol Fashion
+            (num_gates, num_wires), inputs, outputs = sizes
+            if inputs[0] != len(inputs) - 1 or outputs[0] != len(outputs) - 1:
+                raise ValueError("Malformed input or output sizes")
+            inputs, outputs = inputs[1:], outputs[1:]
+        elif header == 2 and len(sizes[1]) == 3:
+            (num_gates, num_wires), (bits_a, bits_b, bits_out) = sizes
+            inputs, outputs = [bits_a, bits_b], [bits_out]
+        else:
+            raise ValueError("Malformed header")
+    except ValueError as e:
+        raise ValueError(f"Bristol circuit {circuit_id}: {e}") from None
+    if len(lines) - header != num_gates:
+        raise ValueError(f"Bristol circuit {circuit_id} has "
+                         f"{len(lines) - header} gates, expected {num_gates}")
+
+    # Input and output values, by wire
+    values_in, wire = [], 0
+    for bits in inputs:
+        values_in.append(list(range(wire, wire + bits)))
+        wire += bits
+    values_out, wire = [], num_wires - sum(outputs)
+    for bits in outputs:
+        values_out.append(list(range(wire, wire + bits)))
+        wire += bits
+
+    gates = []
+    source = {}  # map from copied wires to their source
+    constants = {}  # map from constant bit to its wire
+    for line in lines[header:]:
+        try:
+            num_in, num_out = int(line[0]), int(line[1])
+            wires = [int(field) for field in line[2:-1]]
+        except ValueError:
+            raise ValueError(f"Bristol circuit {circuit_id}: malformed gate "
+                             f"{' '.join(line)}") from None
+        gate_type = line[-1]
+        if len(wires) != num_in + num_out:
+            raise ValueError(f"Bristol circuit {circuit_id}: gate "
+                             f"{' '.join(line)} has not {num_in} inputs and "
+                             f"{num_out} outputs")
+        wires_in = [source.get(w, w) for w in wires[:num_in]]
+        wires_out = wires[num_in:]
+        if gate_type == "EQW":
+            source[wires_out[0]] = wires_in[0]
+        elif gate_type == "EQ":
+            bit = wires[0]
+            if bit not in constants:
+                if not values_in or not values_in[0]:
+                    raise ValueError(f"Bristol circuit {circuit_id} has a "
+                                     f"constant but no input wire")
+                first = values_in[0][0]
+                constants[bit] = wires_out[0]
+                gates.append({"id": wires_out[0],
+                              "type": "XNOR" if bit else "XOR",
+                              "in": [first, first]})
+            else:
+                source[wires_out[0]] = constants[bit]
+        elif gate_type == "MAND":
+            half = num_in // 2
+            for a, b, out in zip(wires_in[:half], wires_in[half:], wires_out):
+                gates.append({"id": out, "type": "AND", "in": [a, b]})
+        elif gate_type in GATE_TYPES:
+            gates.append({"id": wires_out[0], "type": GATE_TYPES[gate_type],
+                          "in": wires_in})
+        else:
+            raise ValueError(f"Bristol circuit {circuit_id} has unknown gate "
+                             f"type '{gate_type}'")
+
+    split = (len(values_in) + 1) // 2
+    circuit = {
+        "id": circuit_id,
+        "alice": [w for value in values_in[:split] for w in value[::-1]],
+        "bob": [w for value in values_in[split:] for w in value[::-1]],
+        "out": [source.get(w, w) for value in values_out
+                for w in value[::-1]],
+        "gates": gates,
+    }
+    options = {}
+    if len(set(inputs)) == 1:
+        options["bits"] = inputs[0]
+    if len(set(outputs)) == 1:
+        options["results"] = len(outputs)
+    # Validated and sorted once, before being cached
+    return compiler.compile_circuit(circuit), options
+
+
+if __name__ == '__main__':
+    import argparse
+    import generator
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Convert a Bristol circuit to a JSON circuit file.")
+        parser.add_argument("circuit",
+                            help="path to the Bristol circuit file")
+        parser.add_argument("-o",
+                            "--output",
+                            metavar="path",
+                            default="",
+                            help="path to the circuit file to write "
+                            "(default is standard output)")
+
+        args = parser.parse_args()
+        parsed = load(args.circuit)
+        text = generator.dumps(parsed["name"], parsed["circuits"])
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text)
+        else:
+            print(text, end="")
+
+    initialize()
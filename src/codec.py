@@ -0,0 +1,516 @@
+import collections
+import hashlib
+import itertools
+import operator
+import struct
+import sys
+from array import array
+import compiler
+
+# Binary wire format of the protocol messages, replacing pickle
+#
+# A message is a list of frames. The first frame holds the header
+# (MAGIC and VERSION) and the encoded value; each following frame is the
+# payload of an out-of-band byte string, vector or array, in order of
+# appearance. Encoded values start with a one-byte tag, integer fields are
+# little-endian and of fixed width.
+MAGIC = b"YG"
+VERSION = 1
+# Payloads of at least this many bytes are sent in their own frame,
+# without being copied into the first one
+OUT_OF_BAND_SIZE = 4096
+
+NONE, TRUE, FALSE = b"N", b"T", b"F"
+INT8, INT32, INT = b"c", b"j", b"i"  # 8, 32 and 64-bit signed integers
+BIG_INT = b"I"  # u32 size, two's complement integer
+STR = b"s"  # u32 size, UTF-8 string
+BYTES, BYTES_OOB = b"b", b"o"  # u32 size, byte string
+# u32 count, u32 width, u32 size of the concatenated byte strings: a list
+# of byte strings or None. If all byte strings have the same width, the
+# count and width are followed by a bitmap of the non-None items, otherwise
+# the width is VARIABLE_WIDTH and is followed by the typecode ("b", "h" or
+# "i") and count items of an array of sizes (-1 for None)
+VECTOR, VECTOR_OOB = b"v", b"V"
+VARIABLE_WIDTH = 0xFFFFFFFF
+ARRAY, ARRAY_OOB = b"a", b"A"  # typecode, u32 count, items of an array
+LIST, TUPLE, DICT = b"l", b"t", b"d"  # u32 count, items (keys and values)
+
+# Array typecodes with the same item size on all platforms
+ARRAY_ITEMSIZES = {"b": 1, "B": 1, "h": 2, "H": 2, "i": 4, "I": 4, "q": 8,
+                   "Q": 8, "f": 4, "d": 8}
+
+# Types of the items of vectors
+BYTES_TYPES = frozenset((bytes, bytearray, memoryview, type(None)))
+BINARY_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+
+# Optional integer keys of circuit specs, see generator.CircuitBuilder.build
+CIRCUIT_OPTIONS = ("bits", "results")
+# Number of circuits kept unpacked and compiled by a CircuitCache
+CIRCUIT_CACHE_SIZE = 16
+
+U32 = struct.Struct("<I")
+I8 = struct.Struct("<b")
+I32 = struct.Struct("<i")
+I64 = struct.Struct("<q")
+
+
+def encode(obj):
+    """Encode a value into the frames of a message.
+
+    Supported values are None, booleans, integers, strings, byte strings,
+    arrays of ARRAY_ITEMSIZES typecodes, and lists, tuples and dicts of
+    supported values.
+
+    Returns:
+        The list of frames, the first one being a bytearray and the others
+        the (uncopied) out-of-band payloads.
+
+    Raises:
+        TypeError: The value cannot be encoded.
+    """
+    head = bytearray(MAGIC)
+    head.append(VERSION)
+    frames = [head]
+    _encode(obj, head, frames)
+    return frames
+
+
+def _encode(obj, out, frames):
+    if obj is None:
+        out += NONE
+    elif obj is True:
+        out += TRUE
+    elif obj is False:
+        out += FALSE
+    elif isinstance(obj, int):
+        if -(1 << 7) <= obj < 1 << 7:
+            out += INT8
+            out += I8.pack(obj)
+        elif -(1 << 31) <= obj < 1 << 31:
+            out += INT32
+            out += I32.pack(obj)
+        elif -(1 << 63) <= obj < 1 << 63:
+            out += INT
+            out += I64.pack(obj)
+        else:
+            data = obj.to_bytes(obj.bit_length() // 8 + 1, "little",
+                                signed=True)
+            out += BIG_INT
+            out += U32.pack(len(data))
+            out += data
+    elif isinstance(obj, str):
+        data = obj.encode()
+        out += STR
+        out += U32.pack(len(data))
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _encode_payload(obj, BYTES, BYTES_OOB, out, frames)
+    elif isinstance(obj, array):
+        if ARRAY_ITEMSIZES.get(obj.typecode) != obj.itemsize:
+            raise TypeError(f"Cannot encode array of typecode "
+                            f"'{obj.typecode}'")
+        if sys.byteorder == "big":
+            obj = array(obj.typecode, obj)
+            obj.byteswap()
+        fields = obj.typecode.encode() + U32.pack(len(obj))
+        _encode_payload(memoryview(obj).cast("B"), ARRAY, ARRAY_OOB, out,
+                        frames, fields)
+    elif isinstance(obj, list) and obj and BYTES_TYPES.issuperset(
+            map(type, obj)):
+        # Typically garbled tables: sizes first, then all byte strings
+        _encode_vector(obj, out, frames)
+    elif isinstance(obj, (list, tuple)):
+        out += LIST if isinstance(obj, list) else TUPLE
+        out += U32.pack(len(obj))
+        for item in obj:
+            _encode(item, out, frames)
+    elif isinstance(obj, dict):
+        out += DICT
+        out += U32.pack(len(obj))
+        for key, value in obj.items():
+            _encode(key, out, frames)
+            _encode(value, out, frames)
+    else:
+        raise TypeError(f"Cannot encode object of type "
+                        f"'{type(obj).__name__}'")
+
+
+def _encode_vector(items, out, frames):
+    """Encode a list of byte strings or None."""
+    present = [item for item in items if item is not None]
+    widths = set(map(len, present))
+    if len(widths) > 1:
+        max_width = max(widths)
+        typecode = "b" if max_width < 1 << 7 else \
+            "h" if max_width < 1 << 15 else "i"
+        sizes = array(typecode, [-1 if item is None else len(item)
+                                 for item in items])
+        if sys.byteorder == "big":
+            sizes.byteswap()
+        fields = U32.pack(VARIABLE_WIDTH) + typecode.encode() + \
+            sizes.tobytes()
+    else:
+        # Bit i of the bitmap is set if item i is not None
+        flags = bytes(map(operator.is_not, items, itertools.repeat(None)))
+        bitmap = int(flags.translate(BINARY_DIGITS)[::-1], 2)
+        fields = U32.pack(widths.pop() if widths else 0) + \
+            bitmap.to_bytes((len(items) + 7) // 8, "little")
+    _encode_payload(b"".join(present), VECTOR, VECTOR_OOB, out, frames,
+                    U32.pack(len(items)) + fields)
+
+
+def _encode_payload(data, tag, tag_oob, out, frames, fields=b""):
+    """Encode a byte payload after its fields, in-band or in its own frame."""
+    oob = len(data) >= OUT_OF_BAND_SIZE
+    out += tag_oob if oob else tag
+    out += fields
+    out += U32.pack(len(data))
+    if oob:
+        frames.append(data)
+    else:
+        out += data
+
+
+def decode(frames):
+    """Decode the frames of a message.
+
+    Out-of-band byte strings are not copied, they are decoded as read-only
+    memoryviews of their frame.
+
+    Args:
+        frames: The frames of the message, as bytes-like objects.
+
+    Raises:
+        ValueError: The message is malformed or of another version.
+    """
+    head = memoryview(frames[0])
+    if bytes(head[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a message of the protocol wire format")
+    if len(head) <= len(MAGIC) or head[len(MAGIC)] != VERSION:
+        raise ValueError(f"Unsupported wire format version, expected "
+                         f"{VERSION}")
+    decoder = _Decoder(head, frames[1:])
+    decoder.pos = len(MAGIC) + 1
+    try:
+        obj = decoder.decode()
+    except (struct.error, IndexError, TypeError, UnicodeDecodeError,
+            RecursionError) as e:
+        raise ValueError(f"Malformed message: {e!r}") from None
+    if decoder.pos != len(head) or decoder.frames:
+        raise ValueError("Malformed message: trailing data")
+    return obj
+
+
+def pack(obj):
+    """Encode a value into a single byte string, e.g. to store it in a file.
+
+    The frames of encode() are concatenated, after their number and each
+    one after its size.
+    """
+    frames = encode(obj)
+    out = bytearray(U32.pack(len(frames)))
+    for frame in frames:
+        out += U32.pack(len(frame))
+        out += frame
+    return bytes(out)
+
+
+def unpack(data):
+    """Decode a value packed by pack().
+
+    Raises:
+        ValueError: The data is malformed or of another version.
+    """
+    data = memoryview(data)
+    try:
+        count, pos = U32.unpack_from(data)[0], U32.size
+        frames = []
+        for _ in range(count):
+            size = U32.unpack_from(data, pos)[0]
+            pos += U32.size
+            if size > len(data) - pos:
+                raise ValueError("Malformed packed message: truncated")
+            frames.append(data[pos:pos + size])
+            pos += size
+    except struct.error:
+        raise ValueError("Malformed packed message: truncated") from None
+    if pos != len(data) or not frames:
+        raise ValueError("Malformed packed message: trailing data")
+    return decode(frames)
+
+
+class _Decoder:
+    """Decoder of the values of a message."""
+
+    def __init__(self, head, frames):
+        self.head = head
+        self.pos = 0
+        self.frames = list(frames)
+        self.frames.reverse()  # popped in order
+
+    def take(self, size):
+        """Return the next 'size' bytes of the first frame."""
+        if size > len(self.head) - self.pos:
+            raise ValueError("Malformed message: truncated")
+        data = self.head[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def u32(self):
+        return U32.unpack(self.take(4))[0]
+
+    def count(self, item_size=1):
+        """Return a count of items, each taking at least 'item_size' bytes."""
+        count = self.u32()
+        if count * item_size > len(self.head) - self.pos:
+            raise ValueError("Malformed message: truncated")
+        return count
+
+    def payload(self, oob):
+        size = self.u32()
+        if not oob:
+            return self.take(size)
+        if not self.frames:
+            raise ValueError("Malformed message: missing frame")
+        data = memoryview(self.frames.pop())
+        if len(data) != size:
+            raise ValueError("Malformed message: frame size mismatch")
+        return data
+
+    def decode(self):
+        tag = bytes(self.take(1))
+        if tag == NONE:
+            return None
+        if tag == TRUE:
+            return True
+        if tag == FALSE:
+            return False
+        if tag == INT8:
+            return I8.unpack(self.take(1))[0]
+        if tag == INT32:
+            return I32.unpack(self.take(4))[0]
+        if tag == INT:
+            return I64.unpack(self.take(8))[0]
+        if tag == BIG_INT:
+            return int.from_bytes(self.take(self.u32()), "little",
+                                  signed=True)
+        if tag == STR:
+            return str(self.take(self.u32()), "utf-8")
+        if tag in (BYTES, BYTES_OOB):
+            data = self.payload(tag == BYTES_OOB)
+            return data.toreadonly() if tag == BYTES_OOB else bytes(data)
+        if tag in (ARRAY, ARRAY_OOB):
+            typecode = str(self.take(1), "ascii")
+            if typecode not in ARRAY_ITEMSIZES:
+                raise ValueError(f"Malformed message: array typecode "
+                                 f"'{typecode}'")
+            count = self.u32()
+            items = array(typecode)
+            data = self.payload(tag == ARRAY_OOB)
+            if len(data) != count * items.itemsize:
+                raise ValueError("Malformed message: array size mismatch")
+            items.frombytes(data)
+            if sys.byteorder == "big":
+                items.byteswap()
+            return items
+        if tag in (VECTOR, VECTOR_OOB):
+            return self.decode_vector(tag == VECTOR_OOB)
+        if tag in (LIST, TUPLE):
+            items = [self.decode() for _ in range(self.count())]
+            return items if tag == LIST else tuple(items)
+        if tag == DICT:
+            return {self.decode(): self.decode() for _ in range(self.count(2))}
+        raise ValueError(f"Malformed message: unknown tag {tag!r}")
+
+    def decode_vector(self, oob):
+        count, width = self.u32(), self.u32()
+        if width == VARIABLE_WIDTH:
+            typecode = str(self.take(1), "ascii")
+            if typecode not in ("b", "h", "i"):
+                raise ValueError(f"Malformed message: vector size typecode "
+                                 f"'{typecode}'")
+            sizes = array(typecode)
+            sizes.frombytes(self.take(sizes.itemsize * count))
+            if sys.byteorder == "big":
+                sizes.byteswap()
+            lengths = [size if size > 0 else 0 for size in sizes]
+        else:
+            bitmap = int.from_bytes(self.take((count + 7) // 8), "little")
+            if bitmap >> count:
+                raise ValueError("Malformed message: vector bitmap")
+            flags = format(bitmap, f"0{count}b")[::-1] if count else ""
+            lengths = [width] * flags.count("1")
+        data = self.payload(oob)
+        if sum(lengths) != len(data):
+            raise ValueError("Malformed message: vector size mismatch")
+        # Slicing bytes is much faster than slicing a memoryview
+        data = bytes(data)
+
+        if width == VARIABLE_WIDTH:
+            starts = itertools.accumulate(lengths, initial=0)
+            return [None if size < 0 else data[start:start + size]
+                    for start, size in zip(starts, sizes)]
+        if width:
+            items = [data[start:start + width]
+                     for start in range(0, len(data), width)]
+        else:
+            items = [data] * len(lengths)
+        if len(items) == count:
+            return items
+        next_item = iter(items).__next__
+        return [next_item() if flag == "1" else None for flag in flags]
+
+
+def encode_label(label):
+    """Encode a (key, encr_bit) label into bytes: the key, then the bit."""
+    key, encr_bit = label
+    return bytes(key) + bytes((encr_bit, ))
+
+
+def decode_label(data):
+    """Decode a (key, encr_bit) label encoded by encode_label().
+
+    Raises:
+        ValueError: The data is not an encoded label.
+    """
+    if len(data) < 2 or data[-1] > 1:
+        raise ValueError("Malformed label")
+    return bytes(data[:-1]), data[-1]
+
+
+def wire_array(wires):
+    """Return an array of wires, of 32-bit integers if they all fit."""
+    wires = list(wires)
+    try:
+        return array("i", wires)
+    except OverflowError:
+        return array("q", wires)
+
+
+def pack_circuit(circuit):
+    """Pack a circuit spec with integer wires into a dict of arrays.
+
+    Gate types become opcodes of compiler.GATE_TYPES, and the inputs of all
+    gates are concatenated (one for NOT gates, two otherwise).
+
+    Raises:
+        ValueError: A gate has an unknown type.
+    """
+    gates = circuit["gates"]
+    types = bytearray()
+    for gate in gates:
+        if gate["type"] not in compiler.OPCODES:
+            raise ValueError(f"Gate {gate['id']} has unknown type "
+                             f"'{gate['type']}'")
+        types.append(compiler.OPCODES[gate["type"]])
+    packed = {
+        "id": circuit.get("id"),
+        "alice": wire_array(circuit.get("alice", [])),
+        "bob": wire_array(circuit.get("bob", [])),
+        "out": wire_array(circuit["out"]),
+        "gates": wire_array(gate["id"] for gate in gates),
+        "types": bytes(types),
+        "in": wire_array(wire for gate in gates for wire in gate["in"]),
+    }
+    packed.update((key, circuit[key]) for key in CIRCUIT_OPTIONS
+                  if key in circuit)
+    return packed
+
+
+def unpack_circuit(packed):
+    """Return the circuit spec packed by pack_circuit().
+
+    Raises:
+        ValueError: The packed circuit is inconsistent.
+    """
+    types, gate_ids, wires_in = packed["types"], packed["gates"], packed["in"]
+    if len(types) != len(gate_ids):
+        raise ValueError("Packed circuit has not one type per gate")
+    gates, pos = [], 0
+    for gate_id, op in zip(gate_ids, types):
+        if op >= len(compiler.GATE_TYPES):
+            raise ValueError(f"Gate {gate_id} has unknown opcode {op}")
+        arity = 1 if op == compiler.OP_NOT else 2
+        gates.append({
+            "id": gate_id,
+            "type": compiler.GATE_TYPES[op],
+            "in": list(wires_in[pos:pos + arity]),
+        })
+        pos += arity
+    if pos != len(wires_in):
+        raise ValueError("Packed circuit has not the inputs of its gates")
+    circuit = {
+        "id": packed["id"],
+        "alice": list(packed["alice"]),
+        "bob": list(packed["bob"]),
+        "out": list(packed["out"]),
+        "gates": gates,
+    }
+    circuit.update((key, packed[key]) for key in CIRCUIT_OPTIONS
+                   if key in packed)
+    return circuit
+
+
+def pack_compiled(compiled):
+    """Pack a compiler.CompiledCircuit with integer wires into a dict of
+    arrays, see compiler.CompiledCircuit.from_arrays()."""
+    return {
+        "id": compiled.id,
+        "wires": wire_array(compiled.wires),
+        "num_inputs": compiled.num_inputs,
+        "alice": compiled.alice,
+        "bob": compiled.bob,
+        "out": compiled.out,
+        "ops": bytes(compiled.ops),
+        "in_a": compiled.in_a,
+        "in_b": compiled.in_b,
+    }
+
+
+def unpack_compiled(packed):
+    """Return the compiler.CompiledCircuit packed by pack_compiled().
+
+    Raises:
+        ValueError: The packed circuit is inconsistent.
+    """
+    return compiler.CompiledCircuit.from_arrays(
+        packed["id"], packed["wires"], packed["num_inputs"], packed["alice"],
+        packed["bob"], packed["out"], packed["ops"], packed["in_a"],
+        packed["in_b"])
+
+
+class CircuitCache:
+    """Circuits packed by pack_circuit(), unpacked and compiled once.
+
+    An evaluator receives the same packed circuit in every session: the
+    cache keys it by the SHA-256 of its encoding, which costs far less than
+    unpacking and compiling it again.
+
+    Args:
+        size: Optional; the number of circuits kept, the least recently
+            used one being dropped first.
+    """
+    def __init__(self, size=CIRCUIT_CACHE_SIZE):
+        self.size = size
+        self._circuits = collections.OrderedDict()
+
+    def get(self, packed):
+        """Return the circuit spec of a packed circuit and its
+        compiler.CompiledCircuit.
+
+        Raises:
+            ValueError: The packed circuit is inconsistent or invalid.
+        """
+        digest = hashlib.sha256()
+        for frame in encode(packed):
+            digest.update(frame)
+        key = digest.digest()
+        if key in self._circuits:
+            self._circuits.move_to_end(key)
+            return self._circuits[key]
+        circuit = unpack_circuit(packed)
+        entry = self._circuits[key] = (circuit,
+                                       compiler.compile_circuit(circuit))
+        if len(self._circuits) > self.size:
+            self._circuits.popitem(last=False)
+        return entry
@@ -0,0 +1,213 @@
+import heapq
+from array import array
+
+# Gate types, indexed by their opcode
+GATE_TYPES = ("AND", "OR", "XOR", "NAND", "NOR", "XNOR", "NOT")
+OPCODES = {gate_type: op for op, gate_type in enumerate(GATE_TYPES)}
+OP_NOT = OPCODES["NOT"]
+
+
+class CompiledCircuit:
+    """A circuit with dense wire indices and topologically sorted gates.
+
+    Input wires come first (Alice's then Bob's) and the output of the i-th
+    gate is the wire of index 'num_inputs + i'. Gates are stored as arrays
+    of opcodes and operand indices, the second operand of a NOT gate being
+    -1.
+
+    Args:
+        circuit: A dict containing circuit spec.
+
+    Raises:
+        ValueError: The circuit is not a valid DAG of known gates.
+    """
+    __slots__ = ("id", "wires", "index", "alice", "bob", "out", "num_inputs",
+                 "ops", "in_a", "in_b")
+
+    def __init__(self, circuit):
+        self.id = circuit.get("id")
+        gates = circuit["gates"]
+        gate_outputs = {}  # map from gate output wire to gate position
+
+        for pos, gate in enumerate(gates):
+            gate_type, gate_in = gate["type"], gate["in"]
+            if gate_type not in OPCODES:
+                raise ValueError(f"Gate {gate['id']} has unknown type "
+                                 f"'{gate_type}'")
+            if len(gate_in) != (1 if gate_type == "NOT" else 2):
+                raise ValueError(f"Gate {gate['id']} of type {gate_type} has "
+                                 f"{len(gate_in)} inputs")
+            if gate["id"] in gate_outputs:
+                raise ValueError(f"Wire {gate['id']} is driven by two gates")
+            gate_outputs[gate["id"]] = pos
+
+        # Input wires
+        alice, bob = circuit.get("alice", []), circuit.get("bob", [])
+        self.wires = list(dict.fromkeys(alice + bob))
+        self.num_inputs = len(self.wires)
+        for wire in self.wires:
+            if wire in gate_outputs:
+                raise ValueError(f"Input wire {wire} is driven by a gate")
+        inputs = set(self.wires)
+        for gate in gates:
+            for wire in gate["in"]:
+                if wire not in gate_outputs and wire not in inputs:
+                    raise ValueError(f"Wire {wire} of gate {gate['id']} is "
+                                     f"neither an input nor a gate output")
+
+        # Kahn's algorithm, ties broken by position in the gate list
+        pending = [0] * len(gates)  # number of inputs not yet computed
+        fanout = {}  # map from gate output wire to positions of its readers
+        for pos, gate in enumerate(gates):
+            for wire in gate["in"]:
+                if wire in gate_outputs:
+                    pending[pos] += 1
+                    fanout.setdefault(wire, []).append(pos)
+        ready = [pos for pos, count in enumerate(pending) if count == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            pos = heapq.heappop(ready)
+            order.append(pos)
+            for reader in fanout.get(gates[pos]["id"], ()):
+                pending[reader] -= 1
+                if pending[reader] == 0:
+                    heapq.heappush(ready, reader)
+        if len(order) != len(gates):
+            blocked = [gates[pos]["id"] for pos, c in enumerate(pending) if c]
+            raise ValueError(f"Circuit has a cycle, gates {blocked} cannot "
+                             f"be ordered")
+
+        self.wires.extend(gates[pos]["id"] for pos in order)
+        self.index = {wire: i for i, wire in enumerate(self.wires)}
+        self.alice = array("i", (self.index[wire] for wire in alice))
+        self.bob = array("i", (self.index[wire] for wire in bob))
+
+        for wire in circuit["out"]:
+            if wire not in self.index:
+                raise ValueError(f"Output wire {wire} is not driven")
+        self.out = array("i", (self.index[wire] for wire in circuit["out"]))
+
+        self.ops = array("B")
+        self.in_a = array("i")
+        self.in_b = array("i")
+        for pos in order:
+            gate_in = gates[pos]["in"]
+            self.ops.append(OPCODES[gates[pos]["type"]])
+            self.in_a.append(self.index[gate_in[0]])
+            self.in_b.append(self.index[gate_in[1]] if len(gate_in) > 1
+                             else -1)
+
+    @classmethod
+    def from_arrays(cls, circuit_id, wires, num_inputs, alice, bob, out, ops,
+                    in_a, in_b):
+        """Return a compiled circuit from its attributes, as packed by
+        codec.pack_compiled(), without sorting its gates again.
+
+        Raises:
+            ValueError: The arrays are not those of a compiled circuit.
+        """
+        compiled = cls.__new__(cls)
+        compiled.id = circuit_id
+        compiled.wires = list(wires)
+        compiled.num_inputs = num_inputs
+        compiled.index = {wire: i for i, wire in enumerate(compiled.wires)}
+        compiled.alice, compiled.bob, compiled.out = (
+            array("i", alice), array("i", bob), array("i", out))
+        compiled.ops, compiled.in_a, compiled.in_b = (
+            array("B", ops), array("i", in_a), array("i", in_b))
+
+        num_wires = len(compiled.wires)
+        if (len(compiled.index) != num_wires
+                or not 0 <= num_inputs <= num_wires
+                or not len(compiled.ops) == len(compiled.in_a)
+                == len(compiled.in_b) == num_wires - num_inputs):
+            raise ValueError(f"Circuit {circuit_id} has inconsistent arrays")
+        if (list(dict.fromkeys(compiled.alice + compiled.bob))
+                != list(range(num_inputs))):
+            raise ValueError(f"Circuit {circuit_id} has inconsistent input "
+                             f"wires")
+        if any(not 0 <= wire < num_wires for wire in compiled.out):
+            raise ValueError(f"Circuit {circuit_id} has inconsistent output "
+                             f"wires")
+        # Gates only read the wires before their own
+        for gate, (op, in_a, in_b) in enumerate(zip(
+                compiled.ops, compiled.in_a, compiled.in_b)):
+            end = num_inputs + gate
+            if (op >= len(GATE_TYPES) or not 0 <= in_a < end
+                    or (in_b != -1 if op == OP_NOT else not 0 <= in_b < end)):
+                raise ValueError(f"Gate {compiled.wires[end]} of circuit "
+                                 f"{circuit_id} is inconsistent")
+        return compiled
+
+    def __len__(self):
+        """Return the number of gates."""
+        return len(self.ops)
+
+    def spec(self):
+        """Return the circuit spec of the compiled circuit, its gates in
+        topological order."""
+        wires = self.wires
+        return {
+            "id": self.id,
+            "alice": [wires[i] for i in self.alice],
+            "bob": [wires[i] for i in self.bob],
+            "out": [wires[i] for i in self.out],
+            "gates": [{"id": wires[gate_out], "type": gate_type,
+                       "in": [wires[i] for i in gate_in]}
+                      for gate_type, gate_in, gate_out in self.iter_gates()],
+        }
+
+    def levels(self):
+        """Return the gate indices grouped by depth.
+
+        Gates of a level only read input wires and outputs of gates of
+        previous levels, so they can be garbled independently.
+        """
+        depth = [0] * len(self.wires)  # depth of each wire, 0 for inputs
+        levels = []
+        out = self.num_inputs
+        for gate, (in_a, in_b) in enumerate(zip(self.in_a, self.in_b)):
+            level = max(depth[in_a], depth[in_b] if in_b >= 0 else 0)
+            depth[out + gate] = level + 1
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(gate)
+        return levels
+
+    def last_reads(self):
+        """Return the index of the last gate reading each wire, as an array
+        indexed by wire, -1 for wires no gate reads.
+
+        The state of a wire can be dropped once its last reader is garbled
+        or evaluated.
+        """
+        last = array("i", [-1]) * len(self.wires)
+        for gate, (in_a, in_b) in enumerate(zip(self.in_a, self.in_b)):
+            last[in_a] = gate
+            if in_b >= 0:
+                last[in_b] = gate
+        return last
+
+    def iter_gates(self):
+        """Yield (gate_type, gate_in, gate_out) of each gate in order.
+
+        Wires are given as dense indices.
+        """
+        out = self.num_inputs
+        for op, in_a, in_b in zip(self.ops, self.in_a, self.in_b):
+            gate_in = (in_a, ) if op == OP_NOT else (in_a, in_b)
+            yield GATE_TYPES[op], gate_in, out
+            out += 1
+
+
+def compile_circuit(circuit):
+    """Return the compiled form of a circuit.
+
+    Args:
+        circuit: A dict containing circuit spec, or a CompiledCircuit which
+            is returned as is.
+    """
+    if isinstance(circuit, CompiledCircuit):
+        return circuit
+    return CompiledCircuit(circuit)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+import json
+
+# Generators of N-bit circuits in the JSON schema of the circuits directory
+#
+# Circuits are designed for Free-XOR garbling: XOR, XNOR and NOT gates are
+# free, so the generators minimize the number of the other gates (AND gates
+# below). Inputs and outputs are lists of values, each listed most
+# significant bit first, Alice's values being the first operands and Bob's
+# the second.
+
+
+class CircuitBuilder:
+    """Build a circuit gate by gate, allocating consecutive wires.
+
+    Args:
+        circuit_id: The id of the circuit.
+        bits: The bit size of each input value.
+        count: Optional; the number of input values of each party.
+    """
+    def __init__(self, circuit_id, bits, count=1):
+        if bits < 1 or count < 1:
+            raise ValueError(f"Bit size and count must be positive, got "
+                             f"{bits} and {count}")
+        self.id = circuit_id
+        self.bits = bits
+        self.gates = []
+        self._next_wire = 1
+        # Wires of each input value, least significant bit first
+        self.alice = [self._value() for _ in range(count)]
+        self.bob = [self._value() for _ in range(count)]
+
+    def _wire(self):
+        wire = self._next_wire
+        self._next_wire += 1
+        return wire
+
+    def _value(self):
+        return [self._wire() for _ in range(self.bits)]
+
+    def gate(self, gate_type, *wires_in):
+        """Add a gate and return its output wire."""
+        wire = self._wire()
+        self.gates.append({"id": wire, "type": gate_type,
+                           "in": list(wires_in)})
+        return wire
+
+    def xor(self, wire_a, wire_b):
+        return self.gate("XOR", wire_a, wire_b)
+
+    def and_(self, wire_a, wire_b):
+        return self.gate("AND", wire_a, wire_b)
+
+    def not_(self, wire):
+        return self.gate("NOT", wire)
+
+    def mux(self, select, wire_1, wire_0):
+        """Return wire_1 if 'select' else wire_0, with one AND gate."""
+        return self.xor(wire_0, self.and_(select, self.xor(wire_1, wire_0)))
+
+    def greater_than(self, value_x, value_y):
+        """Return the wire of x > y, with one AND gate per bit.
+
+        From the least significant bit, c' = x ^ ((x ^ c) & (y ^ c)) is 1
+        if x:c > y:c (Kolesnikov, Sadeghi and Schneider, 2009).
+        """
+        x, y = value_x[0], value_y[0]
+        carry = self.and_(x, self.not_(y))  # c = 0 for the first bit
+        for x, y in zip(value_x[1:], value_y[1:]):
+            carry = self.xor(x, self.and_(self.xor(x, carry),
+                                          self.xor(y, carry)))
+        return carry
+
+    def maximum(self, value_x, value_y):
+        """Return the wires of max(x, y), with two AND gates per bit."""
+        greater = self.greater_than(value_x, value_y)
+        return [self.mux(greater, x, y) for x, y in zip(value_x, value_y)]
+
+    def add(self, value_x, value_y):
+        """Return the wires of x + y on one more bit, with one AND gate per
+        bit (ripple-carry, c' = c ^ ((x ^ c) & (y ^ c)))."""
+        x, y = value_x[0], value_y[0]
+        out = [self.xor(x, y)]
+        carry = self.and_(x, y)
+        for x, y in zip(value_x[1:], value_y[1:]):
+            x_carry = self.xor(x, carry)
+            out.append(self.xor(x_carry, y))
+            carry = self.xor(carry, self.and_(x_carry, self.xor(y, carry)))
+        out.append(carry)
+        return out
+
+    def equal(self, value_x, value_y):
+        """Return the wire of x == y, with one AND gate less than bits in a
+        tree of depth log2(bits)."""
+        wires = [self.gate("XNOR", x, y) for x, y in zip(value_x, value_y)]
+        while len(wires) > 1:
+            pairs = [self.and_(wires[i], wires[i + 1])
+                     for i in range(0, len(wires) - 1, 2)]
+            wires = pairs + wires[len(pairs) * 2:]
+        return wires
+
+    def build(self, results):
+        """Return the circuit spec computing 'results', a list of values
+        given as wires least significant bit first.
+
+        Besides the keys of every circuit spec, 'bits' is the bit size of
+        each input value and 'results' the number of result values, which
+        all have the same width.
+        """
+        return {
+            "id": self.id,
+            "alice": [wire for value in self.alice for wire in value[::-1]],
+            "bob": [wire for value in self.bob for wire in value[::-1]],
+            "out": [wire for value in results for wire in value[::-1]],
+            "bits": self.bits,
+            "results": len(results),
+            "gates": self.gates,
+        }
+
+
+def _circuit_id(verb, bits, count):
+    if count == 1:
+        return f"{verb} {bits}-bit"
+    return f"{verb} {count}x{bits}-bit"
+
+
+def comparator(bits, count=1):
+    """Return a circuit computing [a > b] for 'count' pairs, with 'bits' AND
+    gates per pair."""
+    builder = CircuitBuilder(_circuit_id("compare", bits, count), bits, count)
+    return builder.build([[builder.greater_than(a, b)]
+                          for a, b in zip(builder.alice, builder.bob)])
+
+
+def maximum(bits, count=1):
+    """Return a circuit computing max(a, b) for 'count' pairs, with
+    2 * 'bits' AND gates per pair."""
+    builder = CircuitBuilder(_circuit_id("compute", bits, count), bits, count)
+    return builder.build([builder.maximum(a, b)
+                          for a, b in zip(builder.alice, builder.bob)])
+
+
+def tree_maximum(bits, count=1):
+    """Return a circuit computing the maximum of the 'count' values of each
+    party, with 2 * 'bits' AND gates per value but one.
+
+    The values are reduced pairwise in a tree of depth log2(2 * 'count')
+    maximums.
+    """
+    builder = CircuitBuilder(_circuit_id("reduce", bits, count), bits, count)
+    values = builder.alice + builder.bob
+    while len(values) > 1:
+        pairs = [builder.maximum(values[i], values[i + 1])
+                 for i in range(0, len(values) - 1, 2)]
+        values = pairs + values[len(pairs) * 2:]
+    return builder.build(values)
+
+
+def adder(bits, count=1):
+    """Return a circuit computing a + b on 'bits' + 1 bits for 'count'
+    pairs, with 'bits' AND gates per pair."""
+    builder = CircuitBuilder(_circuit_id("add", bits, count), bits, count)
+    return builder.build([builder.add(a, b)
+                          for a, b in zip(builder.alice, builder.bob)])
+
+
+def equality(bits, count=1):
+    """Return a circuit computing [a == b] for 'count' pairs, with
+    'bits' - 1 AND gates per pair."""
+    builder = CircuitBuilder(_circuit_id("equal", bits, count), bits, count)
+    return builder.build([builder.equal(a, b)
+                          for a, b in zip(builder.alice, builder.bob)])
+
+
+# Circuit generators, by name
+GENERATORS = {
+    "comparator": comparator,
+    "maximum": maximum,
+    "tree-maximum": tree_maximum,
+    "adder": adder,
+    "equality": equality,
+}
+
+
+def generate(kind, bits, count=1):
+    """Return the circuit of kind 'kind' in GENERATORS for 'count' input
+    values of 'bits' bits per party.
+
+    Raises:
+        ValueError: The kind is unknown or the bit size or count is not
+            positive.
+    """
+    if kind not in GENERATORS:
+        raise ValueError(f"Unknown circuit kind '{kind}', "
+                         f"must be in {list(GENERATORS)}")
+    return GENERATORS[kind](bits, count)
+
+
+def dumps(name, circuits):
+    """Return the JSON of a circuit file, one gate per line."""
+    lines = ["{", f'  "name": {json.dumps(name)},', '  "circuits": [']
+    for i, circuit in enumerate(circuits):
+        lines.append("    {")
+        for key in ("id", "alice", "bob", "out", "bits", "results"):
+            if key not in circuit:
+                continue
+            lines.append(f'      "{key}": {json.dumps(circuit[key])},')
+        lines.append('      "gates": [')
+        gates = [f"        {json.dumps(gate)}" for gate in circuit["gates"]]
+        lines.append(",\n".join(gates))
+        lines.append("      ]")
+        lines.append("    }," if i < len(circuits) - 1 else "    }")
+    lines.extend(["  ]", "}"])
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Generate N-bit circuits for Yao protocol.")
+        parser.add_argument("kind",
+                            choices=GENERATORS.keys(),
+                            help="the function computed by the circuit")
+        parser.add_argument("bits",
+                            type=int,
+                            help="the bit size of each input value")
+        parser.add_argument("-n",
+                            "--count",
+                            metavar="values",
+                            type=int,
+                            default=1,
+                            help="the number of input values of each party "
+                            "(default 1)")
+        parser.add_argument("-o",
+                            "--output",
+                            metavar="path",
+                            default="",
+                            help="path to the circuit file to write "
+                            "(default is standard output)")
+
+        args = parser.parse_args()
+        circuit = generate(args.kind, args.bits, args.count)
+        text = dumps(circuit["id"], [circuit])
+
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text)
+        else:
+            print(text, end="")
+
+    initialize()
@@ -1,12 +1,72 @@
 #!/usr/bin/env python3
 import logging
-from ot import YaoGarbler
-from alice import Alice
-from bob import Bob
+import util
+
+# The modules of the protocol (yao, ot, alice, bob, server, aio) and asyncio
+# or multiprocessing are imported by the roles that use them, so that a
+# short lived process only pays for the imports of its role. The choices of
+# the command line are thus copies of the names of yao.SCHEMES, of
+# yao.DEFAULT_SCHEME and of ot.OT_MODES, kept equal by test_main.py.
+SCHEMES = ("fernet", "aes", "grr3", "halfgates")
+DEFAULT_SCHEME = "halfgates"
+OT_MODES = ("base", "batch", "extension")
 
 logging.basicConfig(format="[%(levelname)s] %(message)s",
                     level=logging.WARNING)
 
+
+class LocalTest:
+    """Alice and Bob running the protocol, OT included, without network.
+
+    Bob serves Alice in a thread over a util.QueueTransport, or in another
+    process over a util.PipeTransport.
+
+    Args:
+        alice_args: A dict of the arguments of Alice.
+        bob_data: Bob's data.
+        oblivious_transfer: Optional; whether Bob's keys are obliviously
+            transferred.
+        process: Optional; whether Bob runs in another process.
+    """
+    def __init__(self, alice_args, bob_data, oblivious_transfer=True,
+                 process=False):
+        import multiprocessing
+        import threading
+        from alice import Alice
+
+        alice_transport, bob_transport = (util.pipe_pair() if process
+                                          else util.queue_pair())
+        self.alice = Alice(**alice_args,
+                           oblivious_transfer=oblivious_transfer,
+                           socket=util.Socket(transport=alice_transport))
+        self.process = process
+        worker = multiprocessing.Process if process else threading.Thread
+        self.bob = worker(target=_serve_local,
+                          args=(bob_transport, oblivious_transfer, bob_data),
+                          daemon=True, name="bob")
+
+    def start(self, sessions=1):
+        """Run the protocol 'sessions' times, then end the session."""
+        self.bob.start()
+        try:
+            for _ in range(sessions):
+                self.alice.start()
+            self.alice.end_session()
+            self.bob.join()
+        finally:
+            self.alice.close()
+            if self.process:
+                self.bob.terminate()
+
+
+def _serve_local(transport, oblivious_transfer, data):
+    """Serve one session of a LocalTest as Bob."""
+    from bob import Bob
+
+    bob = Bob(oblivious_transfer=oblivious_transfer,
+              socket=util.Socket(transport=transport), data=data)
+    bob.listen(sessions=1)
+
 # Default print mode
 PRINT_MODE = "none"
 
@@ -17,7 +77,23 @@ def execute(
         output_mode=PRINT_MODE,
         log_level=logging.WARNING,
         data_file="",
-        bit_length=4
+        bit_length=None,
+        scheme=DEFAULT_SCHEME,
+        ot_mode="base",
+        chunk_size=0,
+        workers=1,
+        pregarble=0,
+        pregarble_bytes=None,
+        pregarble_dir=None,
+        sessions=1,
+        session_timeout=util.SESSION_TIMEOUT,
+        use_asyncio=False,
+        metrics_path=None,
+        bob_data_file="",
+        local_process=False,
+        seeded_labels=False,
+        optimize=False,
+        verify_results=False
 ):
     logging.getLogger().setLevel(log_level)
 
@@ -25,18 +101,63 @@ def execute(
         logging.error("Data file must have a .txt extension")
         return
 
+    alice_args = dict(circuits=circuit_file, print_mode=output_mode,
+                      filename=data_file, bit_size=bit_length, scheme=scheme,
+                      ot_mode=ot_mode, chunk_size=chunk_size,
+                      workers=workers, pregarble=pregarble,
+                      pregarble_bytes=pregarble_bytes,
+                      pregarble_dir=pregarble_dir,
+                      metrics_path=metrics_path,
+                      seeded_labels=seeded_labels, optimize=optimize,
+                      verify_results=verify_results)
+
     if role == "alice":
-        alice = Alice(circuit_file, oblivious_transfer=use_ot,
-                      print_mode=output_mode, filename=data_file,
-                      bit_size=int(bit_length))
-        alice.start()
+        from alice import Alice
+
+        alice = Alice(oblivious_transfer=use_ot, **alice_args)
+        try:
+            for _ in range(sessions):
+                alice.start()
+            alice.end_session()
+        finally:
+            alice.close()
     elif role == "bob":
+        from bob import Bob
+
         bob = Bob(oblivious_transfer=use_ot,
-                  filename=data_file)
+                  filename=data_file, metrics_path=metrics_path)
         bob.listen()
+    elif role == "server" and use_asyncio:
+        import asyncio
+        import aio
+
+        data = (util.read_private_data(file_read=True, filename=data_file)
+                if data_file else util.read_private_data())
+        evaluator = aio.AsyncBob(data, oblivious_transfer=use_ot,
+                                 timeout=session_timeout)
+        try:
+            asyncio.run(evaluator.serve())
+        except KeyboardInterrupt:
+            logging.info("Stop serving")
+    elif role == "server":
+        import server
+
+        evaluator = server.EvaluatorServer(workers=workers,
+                                           timeout=session_timeout,
+                                           oblivious_transfer=use_ot,
+                                           filename=data_file,
+                                           metrics_path=metrics_path)
+        evaluator.serve()
     elif role == "local":
-        local = LocalTest(circuit_file, print_mode=output_mode)
-        local.start()
+        bob_data_file = bob_data_file or data_file
+        if not bob_data_file.endswith('.txt'):
+            logging.error("Bob's data file must have a .txt extension")
+            return
+        bob_data = util.read_private_data(file_read=True,
+                                          filename=bob_data_file)
+        local = LocalTest(alice_args, bob_data, oblivious_transfer=use_ot,
+                          process=local_process)
+        local.start(sessions)
     else:
         logging.error(f"Unknown role '{role}'")
 
@@ -55,26 +176,161 @@ if __name__ == '__main__':
 
         parser = argparse.ArgumentParser(description="Execute Yao protocol.")
         parser.add_argument("role",
-                            choices=["alice", "bob", "local"],
+                            choices=["alice", "bob", "server", "local"],
                             help="the role to play in the protocol")
         parser.add_argument("-i",
                             "--input",
                             metavar="path",
                             default="",
                             help="path to the data file to read (default is empty)")
+        parser.add_argument("-f",
+                            "--circuit",
+                            metavar="path",
+                            default="circuits/computerMaximum.json",
+                            help="path to the circuit file used by alice "
+                            "(default 'circuits/computerMaximum.json')")
+        parser.add_argument("-b",
+                            "--bit-size",
+                            metavar="bits",
+                            type=int,
+                            default=None,
+                            help="the bit size of alice's input (default is "
+                            "the number of alice's wires of the circuit)")
         parser.add_argument("-l",
                             "--loglevel",
                             metavar="level",
                             choices=log_levels.keys(),
                             default="warning",
                             help="the logging level (default 'warning')")
+        parser.add_argument("-s",
+                            "--scheme",
+                            choices=SCHEMES,
+                            default=DEFAULT_SCHEME,
+                            help="the garbling scheme used by alice "
+                            f"(default '{DEFAULT_SCHEME}')")
+        parser.add_argument("-o",
+                            "--ot-mode",
+                            choices=OT_MODES,
+                            default="base",
+                            help="the oblivious transfer mode used by alice "
+                            "(default 'base')")
+        parser.add_argument("--print-mode",
+                            choices=["none", "circuit", "table", "verify"],
+                            default=PRINT_MODE,
+                            help="print the evaluation of the circuits for "
+                            "all inputs, their garbled tables, or verify "
+                            f"them (default '{PRINT_MODE}')")
+        parser.add_argument("-c",
+                            "--chunk-size",
+                            metavar="gates",
+                            type=int,
+                            default=0,
+                            help="stream the garbled tables by chunks of this "
+                            "many gates (default 0, sent all at once)")
+        parser.add_argument("--seeded-labels",
+                            action="store_true",
+                            help="derive the keys of wires from a session "
+                            "seed when needed instead of keeping them, to "
+                            "garble large circuits in less memory")
+        parser.add_argument("--optimize",
+                            action="store_true",
+                            help="optimize the circuits before garbling them, "
+                            "see optimizer.py")
+        parser.add_argument("--verify-results",
+                            action="store_true",
+                            help="send alice's inputs and the results to bob, "
+                            "who checks them in cleartext, for debugging "
+                            "(implied by --print-mode verify)")
+        parser.add_argument("-w",
+                            "--workers",
+                            metavar="count",
+                            type=int,
+                            default=1,
+                            help="the number of processes garbling the "
+                            "circuits by level, or of server workers "
+                            "serving sessions (default 1)")
+
+        parser.add_argument("-p",
+                            "--pregarble",
+                            metavar="count",
+                            type=int,
+                            default=0,
+                            help="the number of garbled instances of each "
+                            "circuit kept ready in the background "
+                            "(default 0, garbled on start)")
+        parser.add_argument("--pregarble-memory",
+                            metavar="bytes",
+                            type=int,
+                            default=None,
+                            help="the size of the pregarbled tables kept in "
+                            "memory (default unlimited)")
+        parser.add_argument("--pregarble-dir",
+                            metavar="path",
+                            default=None,
+                            help="the directory where pregarbled instances "
+                            "not kept in memory are stored")
+        parser.add_argument("-t",
+                            "--session-timeout",
+                            metavar="seconds",
+                            type=float,
+                            default=util.SESSION_TIMEOUT,
+                            help="the idle time after which the server drops "
+                            f"a session (default {util.SESSION_TIMEOUT})")
+        parser.add_argument("-a",
+                            "--asyncio",
+                            action="store_true",
+                            help="serve the sessions of the server role "
+                            "with asyncio in a single process")
+        parser.add_argument("-n",
+                            "--sessions",
+                            metavar="count",
+                            type=int,
+                            default=1,
+                            help="the number of times alice runs the "
+                            "protocol, each time with fresh garbled "
+                            "circuits (default 1)")
+        parser.add_argument("-m",
+                            "--metrics",
+                            metavar="path",
+                            default=None,
+                            help="the file where the metrics of the "
+                            "sessions are dumped in the Prometheus text "
+                            "format after each session")
+        parser.add_argument("--bob-input",
+                            metavar="path",
+                            default="",
+                            help="path to bob's data file in the local role "
+                            "(default is the data file of --input)")
+        parser.add_argument("--local-process",
+                            action="store_true",
+                            help="run bob in another process of the local "
+                            "role, over a pipe, instead of a thread")
 
         args = parser.parse_args()
 
         execute(
             role=args.role,
+            circuit_file=args.circuit,
+            bit_length=args.bit_size,
             data_file=args.input,
-            log_level=log_levels[args.loglevel]
+            log_level=log_levels[args.loglevel],
+            output_mode=args.print_mode,
+            scheme=args.scheme,
+            ot_mode=args.ot_mode,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            pregarble=args.pregarble,
+            pregarble_bytes=args.pregarble_memory,
+            pregarble_dir=args.pregarble_dir,
+            sessions=args.sessions,
+            session_timeout=args.session_timeout,
+            use_asyncio=args.asyncio,
+            metrics_path=args.metrics,
+            bob_data_file=args.bob_input,
+            local_process=args.local_process,
+            seeded_labels=args.seeded_labels,
+            optimize=args.optimize,
+            verify_results=args.verify_results
         )
 
     initialize()
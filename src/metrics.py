@@ -0,0 +1,144 @@
+import contextlib
+import os
+import time
+
+# Timers and counters of the phases of the protocol
+#
+# Phases are timed with Metrics.time(); sockets count the messages and
+# bytes they send and receive, labelled with the innermost phase being
+# timed, which stands for the type of the message. Updating the metrics
+# costs a few additions per phase and per message, so they are always on.
+
+# Type of a message received outside any phase, by the key of its dict
+MESSAGE_TYPES = {"circuit": "circuit", "results": "verify", "end": "end"}
+OTHER = "other"  # type of the other messages received outside any phase
+
+
+class Metrics:
+    """Timers and counters of a party, per session and in total.
+
+    Timers of nested phases all run, so that the time of a phase includes
+    the time of the phases within it. end_session() returns the report of
+    the current session and adds it to the totals, which prometheus()
+    dumps.
+    """
+    def __init__(self):
+        self.phase = None  # innermost phase being timed
+        self.sessions = 0
+        self.timers = {}  # map from phase to [count, seconds] of the session
+        self.counters = {}  # map from name to {label: value} of the session
+        self.total_timers = {}
+        self.total_counters = {}
+
+    @contextlib.contextmanager
+    def time(self, phase):
+        """Time a block of code as a phase."""
+        outer, self.phase = self.phase, phase
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase = outer
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase, seconds):
+        """Add a timed run of a phase."""
+        timer = self.timers.get(phase)
+        if timer is None:
+            timer = self.timers[phase] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += seconds
+
+    def count(self, name, value=1, label=None):
+        """Add 'value' to a counter, labelled with the current phase by
+        default."""
+        label = label or self.phase or OTHER
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = {}
+        counter[label] = counter.get(label, 0) + value
+
+    def count_message(self, direction, nbytes, msg=None):
+        """Count a message sent or received and its bytes.
+
+        Args:
+            direction: "sent" or "received".
+            nbytes: The size of the encoded message.
+            msg: Optional; the message received, to tell its type outside
+                any phase.
+        """
+        label = self.phase
+        if label is None:
+            label = OTHER
+            if isinstance(msg, dict):
+                label = next((MESSAGE_TYPES[key] for key in msg
+                              if key in MESSAGE_TYPES), OTHER)
+        self.count(f"messages_{direction}", 1, label)
+        self.count(f"bytes_{direction}", nbytes, label)
+
+    def report(self):
+        """Return the metrics of the current session, as a dict of JSON
+        types."""
+        return _report(self.timers, self.counters)
+
+    def end_session(self):
+        """Return the report of the current session, and start a new one."""
+        report = self.report()
+        for phase, (count, seconds) in self.timers.items():
+            timer = self.total_timers.setdefault(phase, [0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+        for name, counter in self.counters.items():
+            total = self.total_counters.setdefault(name, {})
+            for label, value in counter.items():
+                total[label] = total.get(label, 0) + value
+        self.timers, self.counters = {}, {}
+        self.sessions += 1
+        return report
+
+    def totals(self):
+        """Return the metrics of all the ended sessions."""
+        report = _report(self.total_timers, self.total_counters)
+        report["sessions"] = self.sessions
+        return report
+
+    def prometheus(self, prefix="yao", labels=None):
+        """Return the totals in the Prometheus text exposition format.
+
+        Args:
+            prefix: Optional; the prefix of the metric names.
+            labels: Optional; a dict of labels added to every sample.
+        """
+        extra = "".join(f',{key}="{value}"'
+                        for key, value in (labels or {}).items())
+        lines = [f"# TYPE {prefix}_sessions_total counter",
+                 f"{prefix}_sessions_total{{{extra[1:]}}} {self.sessions}"]
+        for name, index in (("phase_runs_total", 0),
+                            ("phase_seconds_total", 1)):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.extend(f'{prefix}_{name}{{phase="{phase}"{extra}}} '
+                         f'{timer[index]}'
+                         for phase, timer in sorted(self.total_timers.items()))
+        for name, counter in sorted(self.total_counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.extend(f'{prefix}_{name}_total{{type="{label}"{extra}}} '
+                         f'{value}'
+                         for label, value in sorted(counter.items()))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="yao", labels=None):
+        """Write the totals to a Prometheus text file, replaced at once for
+        the scrapers."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus(prefix, labels))
+        os.replace(tmp_path, path)
+
+
+def _report(timers, counters):
+    return {
+        "timers": {phase: {"count": count, "seconds": seconds}
+                   for phase, (count, seconds) in timers.items()},
+        "counters": {name: dict(counter)
+                     for name, counter in counters.items()},
+    }
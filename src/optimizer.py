@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import compiler
+
+# Optimization of circuits before garbling
+#
+# A circuit is rebuilt as a graph of AND and XOR nodes over literals. A
+# literal is 2 * node + negated, node 0 being the constant 0 and the next
+# nodes the input wires, so that the literal 1 is the constant 1. NOT gates
+# become negated literals, NAND, OR and NOR are ANDs of (negated) literals
+# with a negated output, and XNOR is a negated XOR. On the way:
+# - double negations cancel out and NOTs are absorbed in the gate types,
+# - constants (x XOR x, x AND NOT x, x AND 1...) are propagated,
+# - gates of the same type and inputs are merged,
+# - gates no output depends on are dropped.
+# Nodes are then written back as gates of the circuit format. Each node is
+# emitted in the polarity most of its readers want, and an AND of mixed
+# polarities, which has no gate type, reads a NOT gate. Half-gates garbles
+# OR, NAND and NOR as ANDs at no extra cost, so they are not rewritten.
+
+AND, XOR = compiler.OPCODES["AND"], compiler.OPCODES["XOR"]
+FALSE, TRUE = 0, 1  # constant literals
+
+
+def optimize(circuit):
+    """Return an optimized copy of a circuit.
+
+    The copy computes the same outputs, in the same order, from the same
+    input wires. Output wires keep their id when it is free, gates keep
+    the id of the gate they come from, and added gates get new ids.
+
+    Args:
+        circuit: A dict containing circuit spec, with integer wire ids.
+
+    Raises:
+        ValueError: The circuit is not valid, or has a constant output but
+            no input wire to compute it from.
+    """
+    compiled = compiler.compile_circuit(circuit)
+    graph = _Graph(compiled)
+    outputs = [graph.lits[out] for out in compiled.out]
+    writer = _Writer(graph, compiled, outputs,
+                     max(compiled.wires, default=0) + 1)
+    wires_out = [writer.wire(lit) for lit in outputs]
+
+    # Give output wires their original id where it is free
+    rename = {}
+    used = writer.ids.union(compiled.wires[:compiled.num_inputs])
+    for wire_out, wire in zip(circuit["out"], wires_out):
+        if (wire != wire_out and wire in writer.ids and wire not in rename
+                and wire_out not in used):
+            rename[wire] = wire_out
+            used.add(wire_out)
+
+    optimized = dict(circuit)
+    optimized["gates"] = [
+        {"id": rename.get(gate_id, gate_id), "type": gate_type,
+         "in": [rename.get(wire, wire) for wire in gate_in]}
+        for gate_id, gate_type, gate_in in writer.gates
+    ]
+    optimized["out"] = [rename.get(wire, wire) for wire in wires_out]
+    return optimized
+
+
+class _Graph:
+    """AND and XOR nodes of a compiled circuit, with structural hashing.
+
+    Attributes:
+        lits: The literal of each wire, by compiled index.
+        nodes: The (opcode, lit_a, lit_b, origin) of each node, None for
+            the constant and the inputs, origin being the compiled index of
+            the gate that created the node.
+    """
+    def __init__(self, compiled):
+        self.nodes = [None] * (compiled.num_inputs + 1)
+        self.lits = [2 * (i + 1) for i in range(compiled.num_inputs)]
+        self._hashes = {}  # map from (opcode, lit_a, lit_b) to literal
+        gate_ops = {
+            "AND": lambda a, b, o: self.and_lit(a, b, o),
+            "NAND": lambda a, b, o: self.and_lit(a, b, o) ^ 1,
+            "OR": lambda a, b, o: self.and_lit(a ^ 1, b ^ 1, o) ^ 1,
+            "NOR": lambda a, b, o: self.and_lit(a ^ 1, b ^ 1, o),
+            "XOR": lambda a, b, o: self.xor_lit(a, b, o),
+            "XNOR": lambda a, b, o: self.xor_lit(a, b, o) ^ 1,
+        }
+        for gate_type, gate_in, gate_out in compiled.iter_gates():
+            lit_a = self.lits[gate_in[0]]
+            if gate_type == "NOT":
+                self.lits.append(lit_a ^ 1)
+            else:
+                self.lits.append(gate_ops[gate_type](
+                    lit_a, self.lits[gate_in[1]], gate_out))
+
+    def and_lit(self, lit_a, lit_b, origin):
+        """Return the literal of lit_a AND lit_b."""
+        lit_a, lit_b = sorted((lit_a, lit_b))
+        if lit_a == FALSE or lit_a == lit_b ^ 1:
+            return FALSE
+        if lit_a == TRUE or lit_a == lit_b:
+            return lit_b
+        return self._node(AND, lit_a, lit_b, origin)
+
+    def xor_lit(self, lit_a, lit_b, origin):
+        """Return the literal of lit_a XOR lit_b."""
+        negated = (lit_a ^ lit_b) & 1
+        lit_a, lit_b = sorted((lit_a & ~1, lit_b & ~1))
+        if lit_a == FALSE:
+            return lit_b ^ negated
+        if lit_a == lit_b:
+            return negated
+        return self._node(XOR, lit_a, lit_b, origin) ^ negated
+
+    def _node(self, op, lit_a, lit_b, origin):
+        key = (op, lit_a, lit_b)
+        lit = self._hashes.get(key)
+        if lit is None:
+            lit = self._hashes[key] = 2 * len(self.nodes)
+            self.nodes.append((op, lit_a, lit_b, origin))
+        return lit
+
+
+class _Writer:
+    """Gates of the circuit format computing the live nodes of a _Graph.
+
+    Attributes:
+        gates: The (id, type, inputs) of the gates, in topological order.
+        ids: The set of gate ids.
+    """
+    def __init__(self, graph, compiled, outputs, next_id):
+        self.compiled = compiled
+        self.gates = []
+        self.ids = set()
+        self._next_id = next_id
+        self._nots = {}  # map from node to the NOT gate of its wire
+        # Wire of each node and the negation it carries
+        self._wires = [None] + [(wire, 0) for wire in
+                                compiled.wires[:compiled.num_inputs]]
+        self._wires.extend([None] * (len(graph.nodes) - len(self._wires)))
+
+        # Live nodes, and the polarity their readers want, by vote
+        live = [False] * len(graph.nodes)
+        votes = [0] * len(graph.nodes)
+        for lit in outputs:
+            live[lit >> 1] = True
+            votes[lit >> 1] += 1 if lit & 1 else -1
+        for node in range(len(graph.nodes) - 1, 0, -1):
+            if not live[node] or graph.nodes[node] is None:
+                continue
+            op, lit_a, lit_b, _ = graph.nodes[node]
+            for lit in (lit_a, lit_b):
+                live[lit >> 1] = True
+                if op == AND:
+                    votes[lit >> 1] += 1 if lit & 1 else -1
+
+        for node, spec in enumerate(graph.nodes):
+            if live[node] and spec is not None:
+                self._write_node(node, spec, votes[node] > 0)
+
+    def _write_node(self, node, spec, negated):
+        op, lit_a, lit_b, origin = spec
+        gate_id = self.compiled.wires[origin]
+        if op == XOR:
+            (wire_a, neg_a), (wire_b, neg_b) = (self._wires[lit_a >> 1],
+                                                self._wires[lit_b >> 1])
+            parity = (lit_a ^ lit_b) & 1 ^ neg_a ^ neg_b ^ negated
+            self._add(gate_id, "XNOR" if parity else "XOR", [wire_a, wire_b])
+        else:
+            # Negations of the inputs over their wires
+            flip_a = lit_a & 1 ^ self._wires[lit_a >> 1][1]
+            flip_b = lit_b & 1 ^ self._wires[lit_b >> 1][1]
+            if flip_a != flip_b:
+                # AND of the literals, which needs a NOT of the flipped
+                # input, or NOR of their negations, which needs a NOT of
+                # the other one: NOR if that NOT gate exists already
+                unflipped = lit_b if flip_a else lit_a
+                flip_a = flip_b = int(unflipped >> 1 in self._nots)
+            wires_in = [self.wire(lit_a ^ flip_a), self.wire(lit_b ^ flip_b)]
+            gate_types = (("AND", "NAND"), ("NOR", "OR"))[flip_a]
+            self._add(gate_id, gate_types[negated], wires_in)
+        self._wires[node] = (gate_id, negated)
+
+    def wire(self, lit):
+        """Return the wire carrying a literal, adding a NOT gate if needed.
+
+        Raises:
+            ValueError: The literal is constant and there is no input wire.
+        """
+        node = lit >> 1
+        if self._wires[node] is None:
+            # Constant 0, as input XOR input
+            if not self.compiled.num_inputs:
+                raise ValueError(f"Circuit {self.compiled.id} has a constant "
+                                 f"output but no input wire")
+            first = self.compiled.wires[0]
+            self._wires[0] = (self._add(None, "XOR", [first, first]), 0)
+        wire, negated = self._wires[node]
+        if negated == lit & 1:
+            return wire
+        if node not in self._nots:
+            self._nots[node] = self._add(None, "NOT", [wire])
+        return self._nots[node]
+
+    def _add(self, gate_id, gate_type, gate_in):
+        """Add a gate, of a new id if 'gate_id' is None, and return its id."""
+        if gate_id is None:
+            gate_id, self._next_id = self._next_id, self._next_id + 1
+        self.gates.append((gate_id, gate_type, gate_in))
+        self.ids.add(gate_id)
+        return gate_id
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import random
+    import bitslice
+    import util
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Optimize circuits before garbling.")
+        parser.add_argument("circuit",
+                            help="path to the circuit file")
+        parser.add_argument("-o",
+                            "--output",
+                            metavar="path",
+                            default="",
+                            help="path to the optimized circuit file to write "
+                            "(default none, report only)")
+        parser.add_argument("-n",
+                            "--count",
+                            metavar="assignments",
+                            type=int,
+                            default=100,
+                            help="the number of random input assignments "
+                            "checked against the original circuit "
+                            "(default 100)")
+
+        args = parser.parse_args()
+        parsed = util.parse_circuits(args.circuit)
+        optimized = dict(parsed, circuits=[])
+        failed = False
+        for circuit in parsed["circuits"]:
+            result = optimize(circuit)
+            optimized["circuits"].append(result)
+            print(json.dumps({"id": circuit["id"],
+                              "before": bitslice.stats(circuit),
+                              "after": bitslice.stats(result)}))
+            num_inputs = compiler.compile_circuit(circuit).num_inputs
+            assignments = [[random.getrandbits(1) for _ in range(num_inputs)]
+                           for _ in range(args.count)]
+            if (bitslice.simulate(circuit, assignments)
+                    != bitslice.simulate(result, assignments)):
+                print(f"{circuit['id']}: optimized circuit differs")
+                failed = True
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(optimized, f, indent=2)
+                f.write("\n")
+        if failed:
+            raise SystemExit(1)
+
+    initialize()
@@ -1,11 +1,23 @@
 import logging
 from abc import abstractmethod, ABC
+import codec
+import compiler
 import hashlib
 import logging
-import pickle
+import os
+import secrets
 import util
 import yao
 
+# bitslice, optimizer and pregarble are only imported by the garbler
+# features using them, which Bob does not
+
+# OT modes: one base OT per Bob's wire, all base OTs in one round, or IKNP
+# OT extension
+OT_MODES = ("base", "batch", "extension")
+# Number of base OTs of the OT extension (security parameter)
+OT_EXTENSION_BASE = 128
+
 # File kept mostly intact
 # Only change is applied to func send result,
 # which now also return the same value as is sent through channel
@@ -13,74 +25,171 @@ import yao
 class YaoGarbler:
     """Class for Yao garblers (e.g., Alice) supporting local testing."""
 
-    def __init__(self, circuits, print_mode="circuit"):
+    def __init__(self, circuits, print_mode="circuit",
+                 scheme=yao.DEFAULT_SCHEME, lazy=False, workers=1,
+                 pregarble=0, pregarble_bytes=None, pregarble_dir=None,
+                 seeded_labels=False, optimize=False):
+        self.scheme = scheme
+        self.optimize = optimize  # see optimizer.optimize()
+        self.lazy = lazy  # garble when sending, see get_streamed_result()
+        self.seeded_labels = seeded_labels  # see yao.WireLabels
+        # number of garbling processes
+        self.workers = 1 if seeded_labels else workers
+        # instances kept ready
+        self.pregarble = 0 if lazy or seeded_labels else pregarble
+        self.pregarble_bytes = pregarble_bytes
+        self.pregarble_dir = pregarble_dir
         self._load_circuits(circuits)
         self._print_mode = print_mode
         self._modes = {
             "circuit": self._print_evaluation,
             "table": self._print_tables,
+            "verify": self._print_verification,
             "none": self._print_evaluation
         }
         logging.info(f"Print mode: {print_mode}")
 
     def _load_circuits(self, circuits):
-        parsed_circuits = util.parse_json(circuits)
+        """Load the circuits and garble them, or start pregarbling them.
+
+        With pregarbling, each circuit gets a pregarble.PregarblePool and
+        its entry is garbled by next_garbled().
+        """
+        parsed_circuits = util.parse_circuits(circuits)
         self.name = parsed_circuits["name"]
         self.circuits = []
 
-        for circuit_data in parsed_circuits["circuits"]:
-            garbled_circuit = yao.GarbledCircuit(circuit_data)
-            entry = {
-                "circuit": circuit_data,
-                "garbled_circuit": garbled_circuit,
-                "garbled_tables": garbled_circuit.get_garbled_tables(),
-                "keys": garbled_circuit.get_keys(),
-                "pbits": garbled_circuit.get_pbits(),
-                "pbits_out": {w: garbled_circuit.get_pbits()[w] for w in circuit_data["out"]},
-            }
+        self._pool = None
+        if self.workers > 1 and not self.lazy:
+            self._pool = yao.GarblingPool(self.workers)
+
+        # Compiled forms read with the circuits, e.g. from bristol.load()
+        compiled_circuits = parsed_circuits.get(
+            "compiled", [None] * len(parsed_circuits["circuits"]))
+        for circuit_data, compiled in zip(parsed_circuits["circuits"],
+                                          compiled_circuits):
+            if self.optimize:
+                import optimizer  # only when optimizing
+
+                gates = len(circuit_data["gates"])
+                circuit_data = optimizer.optimize(circuit_data)
+                compiled = None
+                logging.info(f"Optimized {circuit_data['id']} from {gates} "
+                             f"to {len(circuit_data['gates'])} gates")
+            # Compiled once, for all the garbled instances of the circuit
+            if compiled is None:
+                compiled = compiler.compile_circuit(circuit_data)
+            entry = {"circuit": circuit_data, "compiled": compiled,
+                     "garbled_circuit": None, "pregarbled": None}
+            if self.pregarble:
+                import pregarble  # only when pregarbling
+
+                entry["pregarbled"] = pregarble.PregarblePool(
+                    circuit_data, scheme=self.scheme, depth=self.pregarble,
+                    max_bytes=self.pregarble_bytes,
+                    directory=self.pregarble_dir, pool=self._pool,
+                    compiled=entry["compiled"])
+            else:
+                self.next_garbled(entry)
             self.circuits.append(entry)
 
+        if self._pool is not None and not self.pregarble:
+            self._pool.close()
+            self._pool = None
+
+    def next_garbled(self, entry):
+        """Fill a circuit entry with a garbled instance never used before.
+
+        The instance comes from the pregarbling pool of the circuit if any,
+        else it is garbled now, unless the entry holds one not used yet.
+        """
+        if entry.get("used") is False:
+            return
+        if entry["pregarbled"] is not None:
+            garbled_circuit = entry["pregarbled"].get()
+        else:
+            circuit_data = entry["circuit"]
+            garbled_circuit = yao.GarbledCircuit(
+                circuit_data, scheme=self.scheme, lazy=self.lazy,
+                pool=self._pool, seeded_labels=self.seeded_labels,
+                compiled=entry["compiled"])
+        entry.update({
+            "garbled_circuit": garbled_circuit,
+            "garbled_tables": garbled_circuit.get_garbled_tables(),
+            "keys": garbled_circuit.get_keys(),
+            "pbits": garbled_circuit.get_pbits(),
+            "pbits_out": None,
+            "used": False,
+        })
+        if self.lazy:
+            # Only known once streamed
+            entry["garbled_tables"] = None
+        else:
+            entry["pbits_out"] = {w: garbled_circuit.get_pbits()[w]
+                                  for w in entry["circuit"]["out"]}
+
+    def close(self):
+        """Stop pregarbling and the garbling workers."""
+        for entry in self.circuits:
+            if entry["pregarbled"] is not None:
+                entry["pregarbled"].close()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
     def start(self):
         """Start local Yao protocol."""
         for circuit_entry in self.circuits:
+            self.next_garbled(circuit_entry)
             self._modes[self.print_mode](circuit_entry)
+            circuit_entry["used"] = True
 
     def _print_tables(self, circuit_entry):
         """Print garbled tables."""
         circuit_entry["garbled_circuit"].print_garbled_tables()
 
     def _print_evaluation(self, circuit_entry):
-        """Print circuit evaluation."""
+        """Print circuit evaluation for all the input assignments.
+
+        The garbled circuit is checked gate by gate, and the outputs are
+        evaluated in cleartext, in bit-sliced batches of assignments.
+        """
+        import bitslice
+
+        print(f"======== {circuit_entry['circuit']['id']} ========")
+        self._check_garbled(circuit_entry)
+        bitslice.print_truth_table(circuit_entry["circuit"])
+        print()
+
+    def _print_verification(self, circuit_entry):
+        """Verify the garbled circuit and print a summary of its outputs
+        for all the input assignments, which are not printed."""
+        import bitslice
+
         circuit_data = circuit_entry["circuit"]
-        pbits = circuit_entry["garbled_circuit"].get_pbits()
-        keys = circuit_entry["keys"]
-        garbled_tables = circuit_entry["garbled_tables"]
-        outputs = circuit_data["out"]
-        a_wires = circuit_data.get("alice", [])  # Alice's wires
-        b_wires = circuit_data.get("bob", [])  # Bob's wires
-        pbits_out = circuit_entry["pbits_out"]
-        N = len(a_wires) + len(b_wires)
-        
         print(f"======== {circuit_data['id']} ========")
-
-        for bits in [format(n, 'b').zfill(N) for n in range(2**N)]:
-            a_inputs = {a_wires[i]: (keys[a_wires[i]][int(b)], pbits[a_wires[i]] ^ int(b))
-                        for i, b in enumerate(bits[:len(a_wires)])}
-            b_inputs = {b_wires[i]: (keys[b_wires[i]][int(b)], pbits[b_wires[i]] ^ int(b))
-                        for i, b in enumerate(bits[-len(b_wires):])}
-            
-            result = yao.evaluate(circuit_data, garbled_tables, pbits_out, a_inputs, b_inputs)
-            
-            str_bits_a = ' '.join(bits[:len(a_wires)])
-            str_bits_b = ' '.join(bits[-len(b_wires):])
-            str_result = ' '.join([str(result[w]) for w in outputs])
-            
-            print(f"  Alice{a_wires} = {str_bits_a} "
-                  f"Bob{b_wires} = {str_bits_b}  "
-                  f"Outputs{outputs} = {str_result}")
-        
+        if self._check_garbled(circuit_entry):
+            print(f"  Garbled gates match the {len(circuit_data['gates'])} "
+                  f"cleartext gates")
+        assignments, ones = bitslice.summary(
+            circuit_entry["garbled_circuit"].compiled)
+        print(f"  {assignments} input assignments, outputs "
+              f"{circuit_data['out']} set by {ones}")
         print()
 
+    def _check_garbled(self, circuit_entry):
+        """Log the garbled gates not matching their cleartext gate.
+
+        Returns:
+            Whether all the garbled gates match.
+        """
+        import bitslice
+
+        failures = bitslice.check_garbled(circuit_entry["garbled_circuit"])
+        for wire, bits in failures:
+            logging.error(f"Garbled gate {wire} is wrong for inputs {bits}")
+        return not failures
+
     @property
     def print_mode(self):
         return self._print_mode
@@ -94,9 +203,30 @@ class YaoGarbler:
         self._print_mode = print_mode
      
 class ObliviousTransfer:
-    def __init__(self, socket, enabled=True):
+    """Transfer of Bob's keys from Alice to Bob.
+
+    In "base" mode, each of Bob's wires costs a full OT exchange. In "batch"
+    mode, the base OTs of all of Bob's wires run side by side, in a constant
+    number of round trips. In "extension" mode, OT_EXTENSION_BASE base OTs
+    are run once per session and the keys of all of Bob's wires are then
+    derived from them with symmetric-key operations only (IKNP OT
+    extension), in one message.
+
+    Args:
+        socket: The socket connecting Alice and Bob.
+        enabled: Optional; whether Bob's keys are obliviously transferred.
+        mode: Optional; the OT mode, in OT_MODES.
+        group: Optional; the group of the base OTs run by this party, in
+            util.STANDARD_GROUPS.
+    """
+    def __init__(self, socket, enabled=True, mode="base",
+                 group=util.DEFAULT_GROUP):
         self.socket = socket
         self.enabled = enabled
+        self.mode = mode
+        self.group = group
+        self._ext_keys = None  # OT extension base keys (Alice or Bob's)
+        self._ext_count = 0  # number of extended OTs since base OTs
 
     def get_result(self, a_inputs, b_keys):
         """Send Alice's inputs and retrieve Bob's result of evaluation.
@@ -108,7 +238,72 @@ class ObliviousTransfer:
         Returns:
             The result of the yao circuit evaluation.
         """
+        metrics = self.socket.metrics
+        with metrics.time("ot"):
+            self.send_inputs(a_inputs, b_keys)
+        with metrics.time("result"):
+            return self.socket.receive()
+
+    def get_streamed_result(self, a_inputs, b_keys, garbled_circuit,
+                            chunk_size):
+        """Send Alice's inputs, then stream the garbled tables to Bob.
+
+        The circuit is garbled chunk by chunk, each chunk being sent as soon
+        as it is garbled. The p-bits of outputs
+        go with the last chunk, which Bob answers with the result.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+            garbled_circuit: The yao.GarbledCircuit to garble, created lazy.
+            chunk_size: The number of gates per chunk.
+
+        Returns:
+            The result of the yao circuit evaluation.
+        """
+        metrics = self.socket.metrics
+        with metrics.time("ot"):
+            self.send_inputs(a_inputs, b_keys)
+            self.socket.receive()  # Bob is ready for the tables
+
+        num_gates = len(garbled_circuit.compiled)
+        garbled = 0
+        with metrics.time("stream"):
+            tables = garbled_circuit.iter_garbled_tables(chunk_size)
+            while True:
+                with metrics.time("garble"):
+                    g_tables = next(tables, None)
+                if g_tables is None:
+                    break
+                garbled += len(g_tables)
+                pbits_out = None
+                if garbled == num_gates:
+                    pbits_out = {w: garbled_circuit.pbits[w]
+                                 for w in garbled_circuit.circuit["out"]}
+                logging.debug(f"Sending {len(g_tables)} garbled tables")
+                self.socket.send((g_tables, pbits_out))
+                reply = self.socket.receive()
+        return reply
+
+    def send_inputs(self, a_inputs, b_keys):
+        """Send Alice's inputs and transfer Bob's keys.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
         logging.debug("Sending inputs to Bob")
+        self.socket.metrics.count("transfers", len(b_keys), self.mode
+                                  if self.enabled else "disabled")
+        if self.enabled and self.mode == "extension":
+            # Also tell Bob if base OTs must be run
+            self.socket.send((a_inputs, self._ext_keys is None))
+            self.ext_sender(b_keys)
+            return
+        if self.enabled and self.mode == "batch":
+            self.batch_sender(a_inputs, b_keys)
+            return
+
         self.socket.send(a_inputs)
 
         for _ in range(len(b_keys)):
@@ -116,27 +311,94 @@ class ObliviousTransfer:
             logging.debug(f"Received gate ID {w}")
 
             if self.enabled:  # perform oblivious transfer
-                pair = (pickle.dumps(b_keys[w][0]), pickle.dumps(b_keys[w][1]))
+                pair = (codec.encode_label(b_keys[w][0]),
+                        codec.encode_label(b_keys[w][1]))
                 self.ot_garbler(pair)
             else:
                 to_send = (b_keys[w][0], b_keys[w][1])
                 self.socket.send(to_send)
 
-        return self.socket.receive()
-
-    def send_result(self, circuit, g_tables, pbits_out, b_inputs):
+    def send_result(self, circuit, g_tables, pbits_out, b_inputs,
+                    scheme=yao.DEFAULT_SCHEME):
         """Evaluate circuit and send the result to Alice.
 
         Args:
-            circuit: A dict containing circuit spec.
+            circuit: A dict containing circuit spec, or its CompiledCircuit.
             g_tables: Garbled tables of yao circuit.
             pbits_out: p-bits of outputs.
             b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; the garbling scheme of the tables.
 
         Returns:
             result: Output of the evaluation, formatted as dictionary {no_of_wire: bit}
                     It is the same value as is sent to the counterpart.
         """
+        metrics = self.socket.metrics
+        with metrics.time("ot"):
+            a_inputs, b_inputs_encr = self.receive_inputs(b_inputs)
+        with metrics.time("evaluate"):
+            result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
+                                  b_inputs_encr, scheme)
+        metrics.count("gates_evaluated", len(g_tables), "evaluate")
+
+        logging.debug("Sending circuit evaluation")
+        with metrics.time("result"):
+            self.socket.send(result)
+        return result
+
+    def send_streamed_result(self, circuit, b_inputs,
+                             scheme=yao.DEFAULT_SCHEME):
+        """Evaluate streamed garbled tables and send the result to Alice.
+
+        Each chunk is acknowledged before being evaluated, so that Alice
+        garbles and sends the next chunk meanwhile. Tables are dropped once
+        evaluated.
+
+        Args:
+            circuit: A dict containing circuit spec, or its CompiledCircuit.
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            scheme: Optional; the garbling scheme of the tables.
+
+        Returns:
+            The output of the evaluation, as sent to Alice.
+        """
+        metrics = self.socket.metrics
+        with metrics.time("ot"):
+            a_inputs, b_inputs_encr = self.receive_inputs(b_inputs)
+            evaluator = yao.Evaluator(circuit, a_inputs, b_inputs_encr,
+                                      scheme)
+            self.socket.send(True)
+
+        with metrics.time("stream"):
+            while True:
+                g_tables, pbits_out = self.socket.receive()
+                logging.debug(f"Received {len(g_tables)} garbled tables")
+                if pbits_out is not None:
+                    break
+                self.socket.send(True)
+                with metrics.time("evaluate"):
+                    evaluator.feed(g_tables)
+
+            with metrics.time("evaluate"):
+                evaluator.feed(g_tables)
+                result = evaluator.result(pbits_out)
+        metrics.count("gates_evaluated", evaluator.evaluated, "evaluate")
+        logging.debug("Sending circuit evaluation")
+        with metrics.time("result"):
+            self.socket.send(result)
+        return result
+
+    def receive_inputs(self, b_inputs):
+        """Receive Alice's inputs and obtain Bob's keys.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A pair of dicts mapping Alice's and Bob's wires to
+            (key, encr_bit) inputs. The last message received is still to
+            be answered.
+        """
         # map from Alice's wires to (key, encr_bit) inputs
         a_inputs = self.socket.receive()
         # map from Bob's wires to (key, encr_bit) inputs
@@ -144,23 +406,28 @@ class ObliviousTransfer:
 
         logging.debug("Received Alice's inputs")
 
+        if self.enabled and self.mode == "extension":
+            a_inputs, new_base = a_inputs
+            if new_base:
+                self._ext_keys = None
+            return a_inputs, self.ext_receiver(b_inputs)
+        if self.enabled and self.mode == "batch":
+            a_inputs, *batch_setup = a_inputs
+            return a_inputs, self.batch_receiver(b_inputs, *batch_setup)
+
         for w, b_input in b_inputs.items():
             logging.debug(f"Sending gate ID {w}")
             self.socket.send(w)
 
             if self.enabled:
-                b_inputs_encr[w] = pickle.loads(self.ot_evaluator(b_input))
+                msg = self.ot_evaluator(b_input)
+                b_inputs_encr[w] = codec.decode_label(msg)
             else:
                 pair = self.socket.receive()
                 logging.debug(f"Received key pair, key {b_input} selected")
                 b_inputs_encr[w] = pair[b_input]
 
-        result = yao.evaluate(circuit, g_tables, pbits_out, a_inputs,
-                              b_inputs_encr)
-
-        logging.debug("Sending circuit evaluation")
-        self.socket.send(result)
-        return result
+        return a_inputs, b_inputs_encr
 
     def ot_garbler(self, msgs):
         """Oblivious transfer, Alice's side.
@@ -169,8 +436,8 @@ class ObliviousTransfer:
             msgs: A pair (msg1, msg2) to suggest to Bob.
         """
         logging.debug("OT protocol started")
-        G = util.PrimeGroup()
-        self.socket.send_wait(G)
+        G = util.get_group(self.group)
+        self.socket.send_wait(G.id)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
         c = G.gen_pow(G._random_integer())
@@ -194,7 +461,7 @@ class ObliviousTransfer:
             The message selected by Bob.
         """
         logging.debug("OT protocol started")
-        G = self.socket.receive()
+        G = util.get_group(self.socket.receive())
         self.socket.send(True)
 
         # OT protocol based on Nigel Smart’s "Cryptography Made Simple"
@@ -210,9 +477,299 @@ class ObliviousTransfer:
         logging.debug("OT protocol ended")
         return mb
 
+    def batch_sender(self, a_inputs, b_keys):
+        """Batched base OTs, Alice's side.
+
+        Alice's inputs go with the first step of the OTs of all Bob's wires,
+        Bob answers all of them in one message and Alice sends back all
+        the transfers in one message.
+
+        Args:
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("Batched OT started")
+        G = util.get_group(self.group)
+        wires = list(b_keys)
+        cs = base_ot_setup(G, len(wires))
+        hs = self.socket.send_wait((a_inputs, G.id, wires, cs))
+        pairs = [(codec.encode_label(b_keys[w][0]),
+                  codec.encode_label(b_keys[w][1])) for w in wires]
+        self.socket.send(base_ot_transfer(G, cs, hs, pairs))
+        logging.debug("Batched OT ended")
+
+    def batch_receiver(self, b_inputs, group_id, wires, cs):
+        """Batched base OTs, Bob's side.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+            group_id: The group of the OTs chosen by Alice.
+            wires: Bob's wires, in the order of the OTs.
+            cs: Alice's random elements, one per wire.
+
+        Returns:
+            A dict mapping Bob's wires to (key, encr_bit) inputs.
+        """
+        logging.debug("Batched OT started")
+        G = util.get_group(group_id)
+        bits = [b_inputs[w] for w in wires]
+        xs, hs = base_ot_choose(G, cs, bits)
+        transfers = self.socket.send_wait(hs)
+        msgs = base_ot_retrieve(G, xs, bits, transfers)
+        logging.debug("Batched OT ended")
+        return {w: codec.decode_label(msg) for w, msg in zip(wires, msgs)}
+
+    def ext_sender(self, b_keys):
+        """IKNP OT extension, Alice's side.
+
+        Alice plays the receiver of the base OTs, with a random secret
+        choice vector s, then answers Bob's extension matrix with one pair
+        of masked keys per wire.
+
+        Args:
+            b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+        """
+        logging.debug("OT extension started")
+        base_setup, wires, u_cols = self.socket.receive()
+
+        if base_setup is not None:
+            logging.debug("Running base OTs")
+            with self.socket.metrics.time("base_ot"):
+                group_id, cs = base_setup
+                G = util.get_group(group_id)
+                s = secrets.randbits(OT_EXTENSION_BASE)
+                s_bits = [(s >> i) & 1 for i in range(OT_EXTENSION_BASE)]
+                xs, hs = base_ot_choose(G, cs, s_bits)
+                transfers = self.socket.send_wait(hs)
+                self._ext_keys = (s, base_ot_retrieve(G, xs, s_bits,
+                                                      transfers))
+            self._ext_count = 0
+
+        msgs = ext_transfer(self._ext_keys, self._ext_count, wires, u_cols,
+                            b_keys)
+        self._ext_count += len(wires)
+
+        self.socket.send(msgs)
+        logging.debug("OT extension ended")
+
+    def ext_receiver(self, b_inputs):
+        """IKNP OT extension, Bob's side.
+
+        Bob plays the sender of the base OTs, with pairs of random seeds,
+        then sends the extension matrix of his choice bits.
+
+        Args:
+            b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+        Returns:
+            A dict mapping Bob's wires to (key, encr_bit) inputs.
+        """
+        logging.debug("OT extension started")
+        wires = list(b_inputs)
+        base_setup = None
+
+        if self._ext_keys is None:
+            G = util.get_group(self.group)
+            cs = base_ot_setup(G, OT_EXTENSION_BASE)
+            seeds = [(os.urandom(16), os.urandom(16))
+                     for _ in range(OT_EXTENSION_BASE)]
+            base_setup = (G.id, cs)
+            self._ext_count = 0
+        else:
+            seeds = self._ext_keys
+
+        t_cols, u_cols = ext_matrix(seeds, self._ext_count, wires, b_inputs)
+        msgs = self.socket.send_wait((base_setup, wires, u_cols))
+        if base_setup is not None:
+            logging.debug("Running base OTs")
+            with self.socket.metrics.time("base_ot"):
+                self.socket.send(base_ot_transfer(G, cs, msgs, seeds))
+                self._ext_keys = seeds
+                msgs = self.socket.receive()
+
+        b_inputs_encr = ext_retrieve(t_cols, self._ext_count, wires,
+                                     b_inputs, msgs)
+        self._ext_count += len(wires)
+
+        logging.debug("OT extension ended")
+        return b_inputs_encr
+
     @staticmethod
     def ot_hash(pub_key, msg_length):
         """Hash function for OT keys."""
         key_length = (pub_key.bit_length() + 7) // 8  # key length in bytes
         bytes = pub_key.to_bytes(key_length, byteorder="big")
         return hashlib.shake_256(bytes).digest(msg_length)
+
+
+def base_ot_setup(G, count):
+    """Batched OT, sender's first step.
+
+    Returns:
+        A list of 'count' random elements c of group G.
+    """
+    return [G.gen_pow(G._random_integer()) for _ in range(count)]
+
+
+def base_ot_choose(G, cs, bits):
+    """Batched OT, receiver's step.
+
+    Args:
+        G: The group of the OTs.
+        cs: The sender's random elements.
+        bits: The receiver's choice bits.
+
+    Returns:
+        A pair (xs, hs) of the receiver's secrets and the public keys to
+        send.
+    """
+    xs, hs = [], []
+    for c, b in zip(cs, bits):
+        x = G._random_integer()
+        x_pow = G.gen_pow(x)
+        h = (x_pow, G.mul(c, G.inv(x_pow)))
+        xs.append(x)
+        hs.append(h[b])
+    return xs, hs
+
+
+def base_ot_transfer(G, cs, hs, pairs):
+    """Batched OT, sender's last step.
+
+    Args:
+        G: The group of the OTs.
+        cs: The random elements sent by base_ot_setup().
+        hs: The receiver's public keys.
+        pairs: The pairs (msg0, msg1) to suggest to the receiver.
+
+    Returns:
+        A list of (c1, e0, e1) to send.
+    """
+    transfers = []
+    for c, h0, (m0, m1) in zip(cs, hs, pairs):
+        h1 = G.mul(c, G.inv(h0))
+        k = G._random_integer()
+        c1 = G.gen_pow(k)
+        e0 = util.xor_bytes(
+            m0, ObliviousTransfer.ot_hash(G.pow(h0, k), len(m0)))
+        e1 = util.xor_bytes(
+            m1, ObliviousTransfer.ot_hash(G.pow(h1, k), len(m1)))
+        transfers.append((c1, e0, e1))
+    return transfers
+
+
+def base_ot_retrieve(G, xs, bits, transfers):
+    """Batched OT, receiver's last step.
+
+    Returns:
+        The list of messages selected by the receiver.
+    """
+    msgs = []
+    for x, b, (c1, e0, e1) in zip(xs, bits, transfers):
+        e = (e0, e1)[b]
+        msgs.append(util.xor_bytes(e, ObliviousTransfer.ot_hash(G.pow(c1, x),
+                                                                len(e))))
+    return msgs
+
+
+def ext_matrix(seeds, counter, wires, b_inputs):
+    """OT extension, Bob's first step.
+
+    Args:
+        seeds: The pairs of seeds of Bob's base OTs.
+        counter: The number of extended OTs since the base OTs.
+        wires: Bob's wires, in the order of the OTs.
+        b_inputs: A dict mapping Bob's wires to (clear) input bits.
+
+    Returns:
+        A pair (t_cols, u_cols) of the columns of Bob's matrix and of the
+        extension matrix to send.
+    """
+    # Column i of the matrix: t_i, and u_i = t_i ^ G(seed_i1) ^ r
+    r = sum(b_inputs[w] << j for j, w in enumerate(wires))
+    t_cols, u_cols = [], []
+    for seed0, seed1 in seeds:
+        t = ext_prg(seed0, len(wires), counter)
+        t_cols.append(t)
+        u_cols.append(t ^ ext_prg(seed1, len(wires), counter) ^ r)
+    return t_cols, u_cols
+
+
+def ext_transfer(ext_keys, counter, wires, u_cols, b_keys):
+    """OT extension, Alice's step.
+
+    Args:
+        ext_keys: The pair (s, seeds) of Alice's base OTs.
+        counter: The number of extended OTs since the base OTs.
+        wires: Bob's wires, in the order of the OTs.
+        u_cols: The columns of Bob's extension matrix.
+        b_keys: A dict mapping each Bob's wire to a pair (key, encr_bit).
+
+    Returns:
+        The list of pairs of masked keys to send, one per wire.
+    """
+    # q_i = t_i ^ s_i * r, hence q_j = t_j ^ r_j * s for each row j
+    s, seeds = ext_keys
+    q_cols = [
+        ext_prg(seed, len(wires), counter) ^ u * ((s >> i) & 1)
+        for i, (seed, u) in enumerate(zip(seeds, u_cols))
+    ]
+    msgs = []
+    for j, (w, q) in enumerate(zip(wires, transpose(q_cols, len(wires)))):
+        index = counter + j
+        m0 = codec.encode_label(b_keys[w][0])
+        m1 = codec.encode_label(b_keys[w][1])
+        msgs.append((util.xor_bytes(m0, ext_hash(index, q, len(m0))),
+                     util.xor_bytes(m1, ext_hash(index, q ^ s, len(m1)))))
+    return msgs
+
+
+def ext_retrieve(t_cols, counter, wires, b_inputs, msgs):
+    """OT extension, Bob's last step.
+
+    Returns:
+        A dict mapping Bob's wires to (key, encr_bit) inputs.
+    """
+    b_inputs_encr = {}
+    for j, (w, t) in enumerate(zip(wires, transpose(t_cols, len(wires)))):
+        msg = msgs[j][b_inputs[w]]
+        mask = ext_hash(counter + j, t, len(msg))
+        b_inputs_encr[w] = codec.decode_label(util.xor_bytes(msg, mask))
+    return b_inputs_encr
+
+
+def ext_prg(seed, num_bits, counter):
+    """Expand a base OT seed into a 'num_bits' integer.
+
+    'counter' separates the successive extensions of a session.
+    """
+    stream = hashlib.shake_256(seed + counter.to_bytes(8, "big"))
+    return int.from_bytes(stream.digest((num_bits + 7) // 8),
+                          "little") & ((1 << num_bits) - 1)
+
+
+def ext_hash(index, row, msg_length):
+    """Hash a row of the OT extension matrix into a mask.
+
+    'index' is the number of the extended OT in the session.
+    """
+    data = index.to_bytes(8, "big") + row.to_bytes(OT_EXTENSION_BASE // 8,
+                                                  "big")
+    return hashlib.shake_256(data).digest(msg_length)
+
+
+def transpose(cols, num_rows):
+    """Transpose a bit matrix given as a list of integer columns.
+
+    Returns:
+        The list of the 'num_rows' rows as integers, bit i of a row being
+        column i.
+    """
+    rows = [0] * num_rows
+    for i, col in enumerate(cols):
+        # Only visit the bits set in the column
+        while col:
+            low = col & -col
+            rows[low.bit_length() - 1] |= 1 << i
+            col ^= low
+    return rows
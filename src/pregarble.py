@@ -0,0 +1,282 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import codec
+import compiler
+import yao
+
+# Extension of the files of persisted instances
+FILE_EXTENSION = ".yg"
+
+
+class PregarblePool:
+    """Garble instances of a circuit in the background, ahead of demand.
+
+    A thread keeps up to 'depth' garbled instances ready, so that taking
+    one with get() leaves only the input transfer and the evaluation on the
+    critical path of a session. Instances are kept in memory while their
+    garbled tables take at most 'max_bytes'. The others are written to
+    'directory' if given, else the thread waits for room. Files left in
+    'directory' by a previous pool of the same circuit and scheme are
+    handed out first.
+
+    A garbled instance must never be used twice, so each one is handed out
+    at most once: it leaves the pool, its file is claimed by an atomic
+    rename and deleted before it is returned, and the pool refuses an
+    instance it has already handed out. Pools sharing a directory thus
+    never hand out the same file, and skip the files the others took.
+
+    Args:
+        circuit: A dict containing circuit spec.
+        scheme: Optional; the name of the garbling scheme.
+        depth: Optional; the number of instances kept ready.
+        max_bytes: Optional; the size of the garbled tables kept in memory,
+            unlimited by default.
+        directory: Optional; the directory where instances are persisted.
+        pool: Optional; a yao.GarblingPool garbling each instance level by
+            level, left open by the pool.
+        compiled: Optional; the compiler.CompiledCircuit of 'circuit',
+            compiled here if not given.
+
+    Raises:
+        ValueError: The depth is not positive.
+    """
+    def __init__(self, circuit, scheme=yao.DEFAULT_SCHEME, depth=1,
+                 max_bytes=None, directory=None, pool=None, compiled=None):
+        if depth < 1:
+            raise ValueError(f"Pregarbling depth must be positive, "
+                             f"got {depth}")
+        self.circuit = circuit
+        # Compiled once for all the instances
+        self.compiled = compiler.compile_circuit(
+            circuit if compiled is None else compiled)
+        self.scheme = scheme
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.pool = pool
+        self.tag = circuit_tag(circuit, scheme)
+
+        self._memory = collections.deque()  # (id, GarbledCircuit, size)
+        self._memory_bytes = 0
+        self._files = collections.deque()  # paths of persisted instances
+        self._issued = set()  # ids of the instances handed out
+        self._error = None  # exception raised while garbling
+        self._closed = False
+        self._cond = threading.Condition()
+
+        if directory is not None:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            self._files.extend(sorted(
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if name.startswith(self.tag + "-")
+                and name.endswith(FILE_EXTENSION)))
+            if self._files:
+                logging.info(f"Found {len(self._files)} pregarbled "
+                             f"instances of {circuit['id']}")
+
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=f"pregarble {circuit['id']}")
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Return the number of instances ready."""
+        with self._cond:
+            return len(self._memory) + len(self._files)
+
+    def close(self):
+        """Stop garbling. Persisted instances are left for the next pool."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._memory.clear()
+        self._memory_bytes = 0
+
+    def get(self, timeout=None):
+        """Return a garbled instance that was never handed out.
+
+        Waits for an instance if none is ready.
+
+        Args:
+            timeout: Optional; the time to wait in seconds, forever by
+                default.
+
+        Raises:
+            TimeoutError: No instance is ready after 'timeout' seconds.
+            ValueError: The pool is closed, or the instance was already
+                handed out.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                ready = self._cond.wait_for(
+                    lambda: self._memory or self._files or self._error
+                    or self._closed,
+                    None if deadline is None
+                    else max(deadline - time.monotonic(), 0))
+                if not ready:
+                    raise TimeoutError(f"No garbled instance of "
+                                       f"{self.circuit['id']} ready after "
+                                       f"{timeout} s")
+                if self._memory:
+                    instance_id, garbled, size = self._memory.popleft()
+                    self._memory_bytes -= size
+                    path = None
+                elif self._files:
+                    path = self._files.popleft()
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    raise ValueError("Pregarbling pool is closed")
+                self._cond.notify_all()
+            if path is None:
+                break
+            instance = self._read(path)
+            if instance is not None:
+                instance_id, garbled = instance
+                break
+
+        with self._cond:
+            if instance_id in self._issued:
+                raise ValueError(f"Garbled instance {instance_id} was "
+                                 f"already handed out")
+            self._issued.add(instance_id)
+        return garbled
+
+    def _run(self):
+        """Garble instances until the pool is closed."""
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(
+                        lambda: self._closed or
+                        len(self._memory) + len(self._files) < self.depth)
+                    if self._closed:
+                        return
+                garbled = yao.GarbledCircuit(self.circuit, scheme=self.scheme,
+                                             pool=self.pool,
+                                             compiled=self.compiled)
+                self._put(secrets.token_hex(16), garbled)
+        except Exception as e:
+            logging.error(f"Pregarbling {self.circuit['id']} failed: {e!r}")
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+
+    def _put(self, instance_id, garbled):
+        """Keep a garbled instance in memory, or on disk if it does not fit."""
+        size = table_bytes(garbled.garbled_tables)
+        with self._cond:
+            if self._fits(size) or self.directory is None:
+                # Without a directory, wait for room in memory
+                self._cond.wait_for(lambda: self._closed or self._fits(size))
+                if self._closed:
+                    return
+                self._memory.append((instance_id, garbled, size))
+                self._memory_bytes += size
+                self._cond.notify_all()
+                return
+        path = self._write(instance_id, garbled)
+        with self._cond:
+            self._files.append(path)
+            self._cond.notify_all()
+
+    def _fits(self, size):
+        """Return whether an instance of 'size' bytes fits in memory.
+
+        An instance always fits in an empty pool, so that the pool cannot
+        stall on an instance larger than max_bytes.
+        """
+        return (self.max_bytes is None or not self._memory
+                or self._memory_bytes + size <= self.max_bytes)
+
+    def _write(self, instance_id, garbled):
+        """Write a garbled instance to the directory and return its path.
+
+        The file holds the keys of the instance, so only its owner can read
+        it. It is renamed once written, so that a partial file is never
+        read.
+        """
+        path = os.path.join(self.directory,
+                            f"{self.tag}-{instance_id}{FILE_EXTENSION}")
+        state = {
+            "id": instance_id,
+            "scheme": garbled.scheme.name,
+            "scheme_state": garbled.scheme.__getstate__(),
+            "pbits": garbled.pbits,
+            "keys": garbled.keys,
+            "garbled_tables": garbled.garbled_tables,
+        }
+        tmp_path = path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(codec.pack(state))
+        os.replace(tmp_path, path)
+        logging.debug(f"Persisted garbled instance {path}")
+        return path
+
+    def _read(self, path):
+        """Claim, read and delete the file of a garbled instance.
+
+        The file is first renamed to a name of this claim only, so that of
+        several pools sharing the directory, only one can read it. It is
+        deleted before being decoded, so that it cannot be handed out again
+        whatever happens next.
+
+        Returns:
+            A pair (instance id, GarbledCircuit), or None if the file was
+            claimed by another pool.
+
+        Raises:
+            ValueError: The file is malformed or of another instance.
+        """
+        claimed = f"{path}.claimed-{secrets.token_hex(8)}"
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            logging.debug(f"Garbled instance {path} was taken by another "
+                          f"pool")
+            return None
+        with open(claimed, "rb") as f:
+            data = f.read()
+        os.unlink(claimed)
+        state = codec.unpack(data)
+        instance_id = state["id"]
+        if not path.endswith(f"-{instance_id}{FILE_EXTENSION}"):
+            raise ValueError(f"File {path} holds instance {instance_id}")
+        scheme = yao.restore_scheme(state["scheme"], state["scheme_state"])
+        garbled = yao.GarbledCircuit.restore(self.circuit, scheme,
+                                             state["pbits"], state["keys"],
+                                             state["garbled_tables"],
+                                             self.compiled)
+        return instance_id, garbled
+
+
+def circuit_tag(circuit, scheme):
+    """Return a tag identifying a circuit garbled with a scheme."""
+    spec = json.dumps(circuit, sort_keys=True).encode()
+    return hashlib.sha256(spec + scheme.encode()).hexdigest()[:16]
+
+
+def table_bytes(garbled_tables):
+    """Return the size in bytes of garbled tables."""
+    size = 0
+    for table in garbled_tables:
+        if isinstance(table, (bytes, bytearray, memoryview)):
+            size += len(table)
+        elif table is not None:
+            size += sum(len(row) for row in table)
+    return size
@@ -0,0 +1,186 @@
+import collections
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import zmq
+import util
+from bob import Bob
+
+# Message of a worker ready to serve a new session
+READY = b"READY"
+
+
+class EvaluatorServer:
+    """Bob's evaluator service, serving many Alice's sessions concurrently.
+
+    A ROUTER socket receives the messages of all sessions, identified by
+    the session id of Alice's socket (see util.GarblerConnection). Each new
+    session is assigned to a free worker, which serves all the messages of
+    the session until Alice ends it or it stays idle for 'timeout' seconds.
+    Sessions arriving while all workers are busy wait for a free worker, so
+    a slow session only holds its own worker.
+
+    Args:
+        workers: Optional; the number of workers, each serving one session
+            at a time.
+        kind: Optional; "process" or "thread", the kind of workers.
+        endpoint: Optional; the endpoint Alice's sessions connect to.
+        timeout: Optional; the idle time in seconds after which a session
+            is dropped.
+        oblivious_transfer: Optional; whether Bob's keys are obliviously
+            transferred.
+        filename: Optional; Bob's data file, standard input by default.
+        metrics_path: Optional; the Prometheus text file of the metrics of
+            the sessions, dumped by each worker in its own file, suffixed
+            with the worker's name.
+
+    Raises:
+        ValueError: The number or kind of workers is invalid.
+    """
+    KINDS = ("process", "thread")
+
+    def __init__(self, workers=4, kind="process",
+                 endpoint=f"tcp://*:{util.LOCAL_PORT}",
+                 timeout=util.SESSION_TIMEOUT, oblivious_transfer=True,
+                 filename="", metrics_path=None):
+        if workers < 1:
+            raise ValueError(f"Number of workers must be positive, "
+                             f"got {workers}")
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown worker kind '{kind}', "
+                             f"must be in {list(self.KINDS)}")
+        self.workers = workers
+        self.kind = kind
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.oblivious_transfer = oblivious_transfer
+        self.metrics_path = metrics_path
+        self.data = (util.read_private_data(file_read=True, filename=filename)
+                     if filename else util.read_private_data())
+
+        self._context = zmq.Context.instance()
+        self._tmpdir = None
+        if kind == "thread":
+            self._backend_endpoint = f"inproc://bob-workers-{id(self)}"
+        else:
+            self._tmpdir = tempfile.mkdtemp(prefix="bob-")
+            self._backend_endpoint = (
+                f"ipc://{os.path.join(self._tmpdir, 'workers')}")
+        self._workers = []
+
+    def serve(self):
+        """Route the messages of sessions to workers until interrupted."""
+        frontend = self._context.socket(zmq.ROUTER)
+        frontend.bind(self.endpoint)
+        backend = self._context.socket(zmq.ROUTER)
+        backend.bind(self._backend_endpoint)
+        self._start_workers()
+        logging.info(f"Serving sessions on {self.endpoint} with "
+                     f"{self.workers} {self.kind} workers")
+
+        free = collections.deque()  # ids of workers without a session
+        sessions = {}  # map from session id to worker id
+        workers = {}  # map from worker id to session id
+        pending = collections.deque()  # first messages of waiting sessions
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(backend, zmq.POLLIN)
+        try:
+            while True:
+                events = dict(poller.poll())
+                if backend in events:
+                    worker, *frames = backend.recv_multipart(copy=False)
+                    worker = worker.bytes
+                    if len(frames) == 1 and frames[0].bytes == READY:
+                        session = workers.pop(worker, None)
+                        if session is not None:
+                            del sessions[session]
+                            logging.info(f"Session {session!r} closed")
+                        free.append(worker)
+                    else:
+                        frontend.send_multipart(frames, copy=False)
+                if frontend in events:
+                    frames = frontend.recv_multipart(copy=False)
+                    session = frames[0].bytes
+                    if session in sessions:
+                        backend.send_multipart([sessions[session]] + frames,
+                                               copy=False)
+                    else:
+                        pending.append(frames)
+                while pending and free:
+                    frames = pending.popleft()
+                    worker, session = free.popleft(), frames[0].bytes
+                    sessions[session], workers[worker] = worker, session
+                    logging.info(f"Session {session!r} assigned to "
+                                 f"worker {worker!r}")
+                    backend.send_multipart([worker] + frames, copy=False)
+        except KeyboardInterrupt:
+            logging.info("Stop serving")
+        finally:
+            self.close()
+            frontend.close(linger=0)
+            backend.close(linger=0)
+
+    def close(self):
+        """Stop the workers."""
+        for worker in self._workers:
+            if isinstance(worker, multiprocessing.Process):
+                worker.terminate()
+                worker.join()
+        self._workers = []
+        if self._tmpdir is not None:
+            for name in os.listdir(self._tmpdir):
+                os.unlink(os.path.join(self._tmpdir, name))
+            os.rmdir(self._tmpdir)
+            self._tmpdir = None
+
+    def _start_workers(self):
+        args = (self._backend_endpoint, self.timeout, self.oblivious_transfer,
+                self.data, self.metrics_path)
+        for i in range(self.workers):
+            name = f"worker-{i}"
+            if self.kind == "thread":
+                worker = threading.Thread(target=_serve_sessions,
+                                          args=(name, ) + args, daemon=True,
+                                          name=name)
+            else:
+                worker = multiprocessing.Process(target=_serve_sessions,
+                                                 args=(name, ) + args,
+                                                 daemon=True, name=name)
+            worker.start()
+            self._workers.append(worker)
+
+
+def _serve_sessions(name, endpoint, timeout, oblivious_transfer, data,
+                    metrics_path=None):
+    """Serve sessions one at a time, as a worker of an EvaluatorServer.
+
+    Each session gets a new OT state. A session ends when Alice ends it,
+    when it stays idle for 'timeout' seconds or on a protocol error.
+    """
+    if metrics_path:
+        root, ext = os.path.splitext(metrics_path)
+        metrics_path = f"{root}-{name}{ext}"
+    socket = zmq.Context.instance().socket(zmq.DEALER)
+    socket.setsockopt(zmq.IDENTITY, name.encode())
+    socket.connect(endpoint)
+    session = util.SessionSocket(socket, timeout=timeout)
+    bob = Bob(oblivious_transfer=oblivious_transfer, socket=session,
+              data=data, metrics_path=metrics_path,
+              metrics_labels={"worker": name})
+    while True:
+        socket.send(READY)
+        entry = session.accept()
+        bob.new_session()
+        try:
+            while bob.handle(entry):
+                entry = session.receive()
+        except TimeoutError as e:
+            logging.warning(f"{name}: {e}")
+            bob.end_session()
+        except (ValueError, KeyError, TypeError) as e:
+            logging.error(f"{name}: session {session.session_id!r} "
+                          f"failed: {e!r}")
+            bob.end_session()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+import codec
+import yao
+
+# Files of garbled tables, evaluated straight from a memory mapping
+#
+# A file starts with PREFIX: MAGIC, VERSION, and the positions of the
+# offsets and of the header. The garbled tables follow, concatenated in
+# compiled gate order, then the offsets: gates + 1 little-endian u64 such
+# that the table of gate i is tables[offsets[i]:offsets[i + 1]] (empty for
+# gates without a table). The header comes last, packed with codec.pack():
+# the circuit id and hash, the scheme and the p-bits of outputs. Both are
+# written after the tables, so that a circuit can be garbled into a file
+# chunk by chunk, never holding all its tables.
+#
+# The file holds no keys: the garbler keeps the seed of the labels (see
+# yao.WireLabels) to encode inputs, and the file can be shipped to the
+# evaluator.
+MAGIC = b"YGTB"
+VERSION = 1
+PREFIX = struct.Struct("<4sIQQ")  # magic, version, offsets pos, header pos
+ALIGNMENT = 8  # alignment of the offsets, to read them without copy
+
+# Extension of garbled table files
+FILE_EXTENSION = ".ygt"
+
+# Gates garbled at a time when writing a lazy circuit
+CHUNK_SIZE = 10000
+
+
+def circuit_hash(circuit):
+    """Return the SHA-256 hex digest of a circuit spec."""
+    spec = json.dumps(circuit, sort_keys=True).encode()
+    return hashlib.sha256(spec).hexdigest()
+
+
+def write(path, garbled, chunk_size=CHUNK_SIZE):
+    """Write the garbled tables of a circuit to a file.
+
+    Tables garbled already are written as is. The tables of a circuit
+    created lazy are garbled 'chunk_size' gates at a time while written;
+    with seeded labels too, the file can be larger than memory. The file is
+    renamed once written, so that a partial file is never read.
+
+    Args:
+        path: The path of the file.
+        garbled: The yao.GarbledCircuit.
+        chunk_size: Optional; the number of gates garbled at a time.
+
+    Raises:
+        ValueError: The tables of the scheme are not byte strings.
+    """
+    compiled = garbled.compiled
+    if len(garbled.garbled_tables) == len(compiled):
+        chunks = [garbled.garbled_tables]
+    else:
+        chunks = garbled.iter_garbled_tables(chunk_size)
+
+    offsets = array("Q", [0])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(bytes(PREFIX.size))
+            for g_tables in chunks:
+                for table in g_tables:
+                    if table is not None:
+                        if not isinstance(table, (bytes, bytearray,
+                                                  memoryview)):
+                            raise ValueError(
+                                f"Tables of scheme '{garbled.scheme.name}' "
+                                f"are not byte strings")
+                        f.write(table)
+                    offsets.append(f.tell() - PREFIX.size)
+
+            f.write(bytes(-f.tell() % ALIGNMENT))
+            offsets_pos = f.tell()
+            if sys.byteorder != "little":
+                offsets.byteswap()
+            f.write(offsets)
+
+            header_pos = f.tell()
+            f.write(codec.pack({
+                "id": garbled.circuit.get("id"),
+                "circuit": circuit_hash(garbled.circuit),
+                "scheme": garbled.scheme.name,
+                "gates": len(compiled),
+                "pbits_out": {w: garbled.pbits[w]
+                              for w in garbled.circuit["out"]},
+            }))
+            f.seek(0)
+            f.write(PREFIX.pack(MAGIC, VERSION, offsets_pos, header_pos))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    logging.debug(f"Wrote {len(compiled)} garbled tables to {path}")
+
+
+class GarbledFile:
+    """A file of garbled tables, mapped in memory.
+
+    Opening a file only reads its header: tables are read by the OS as
+    they are evaluated, as slices of the mapping, so that circuits larger
+    than memory can be evaluated.
+
+    Args:
+        path: The path of a file written by write().
+        circuit: Optional; a dict containing circuit spec, checked against
+            the hash of the file.
+
+    Raises:
+        ValueError: The file is malformed, of another version or of
+            another circuit.
+    """
+    def __init__(self, path, circuit=None):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load(circuit)
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self, circuit):
+        view = self._view = memoryview(self._mmap)
+        try:
+            magic, version, offsets_pos, header_pos = PREFIX.unpack_from(view)
+        except struct.error:
+            raise ValueError(f"File {self.path} is truncated") from None
+        if magic != MAGIC:
+            raise ValueError(f"File {self.path} is not a garbled table file")
+        if version != VERSION:
+            raise ValueError(f"File {self.path} is of version {version}, "
+                             f"expected {VERSION}")
+        if not PREFIX.size <= offsets_pos <= header_pos <= len(view):
+            raise ValueError(f"File {self.path} is malformed")
+
+        header = codec.unpack(view[header_pos:])
+        self.id = header["id"]
+        self.circuit_hash = header["circuit"]
+        self.scheme = header["scheme"]
+        self.pbits_out = header["pbits_out"]
+        gates = header["gates"]
+        if circuit is not None and circuit_hash(circuit) != self.circuit_hash:
+            raise ValueError(f"File {self.path} holds the tables of another "
+                             f"circuit than {circuit.get('id')}")
+
+        offsets = view[offsets_pos:header_pos]
+        if len(offsets) != 8 * (gates + 1) or offsets_pos % ALIGNMENT:
+            raise ValueError(f"File {self.path} is malformed")
+        if sys.byteorder == "little":
+            self._offsets = offsets.cast("Q")
+        else:
+            self._offsets = array("Q", offsets)
+            self._offsets.byteswap()
+        tables_end = PREFIX.size + self._offsets[-1]
+        if not 0 <= offsets_pos - tables_end < ALIGNMENT:
+            raise ValueError(f"File {self.path} is malformed")
+        self._tables = view[PREFIX.size:tables_end]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        """Return the number of gates."""
+        return len(self._offsets) - 1
+
+    def close(self):
+        """Unmap the file. Tables returned before must not be used after."""
+        for name in ("_tables", "_offsets", "_view"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                view.release()
+        self._mmap.close()
+
+    def table(self, gate):
+        """Return the garbled table of a gate by compiled index, as a slice
+        of the mapping, or None if the gate has no table."""
+        start, end = self._offsets[gate], self._offsets[gate + 1]
+        return self._tables[start:end] if end > start else None
+
+    def iter_tables(self, start=0, stop=None):
+        """Yield the garbled tables of gates start to stop (excluded)."""
+        offsets, tables = self._offsets, self._tables
+        stop = len(self) if stop is None else stop
+        for gate in range(start, stop):
+            begin, end = offsets[gate], offsets[gate + 1]
+            yield tables[begin:end] if end > begin else None
+
+    def evaluate(self, circuit, a_inputs, b_inputs):
+        """Evaluate the circuit from the mapping.
+
+        Args:
+            circuit: A dict containing circuit spec, or its CompiledCircuit.
+            a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+            b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+
+        Returns:
+            A dict mapping output wires with their result bit.
+        """
+        evaluator = yao.Evaluator(circuit, a_inputs, b_inputs, self.scheme)
+        evaluator.feed(self.iter_tables())
+        return evaluator.result(self.pbits_out)
+
+
+if __name__ == '__main__':
+    import argparse
+    import util
+
+    def initialize():
+        parser = argparse.ArgumentParser(
+            description="Garble circuits into garbled table files.")
+        parser.add_argument("circuit",
+                            help="path to the circuit file")
+        parser.add_argument("-o",
+                            "--output",
+                            metavar="directory",
+                            default=".",
+                            help="the directory of the files written "
+                            "(default '.')")
+        parser.add_argument("-s",
+                            "--scheme",
+                            choices=yao.SCHEMES.keys(),
+                            default=yao.DEFAULT_SCHEME,
+                            help="the garbling scheme "
+                            f"(default '{yao.DEFAULT_SCHEME}')")
+        parser.add_argument("-c",
+                            "--chunk-size",
+                            metavar="gates",
+                            type=int,
+                            default=CHUNK_SIZE,
+                            help="the number of gates garbled at a time "
+                            f"(default {CHUNK_SIZE})")
+
+        args = parser.parse_args()
+        logging.basicConfig(format="[%(levelname)s] %(message)s",
+                            level=logging.INFO)
+        os.makedirs(args.output, exist_ok=True)
+        for circuit in util.parse_circuits(args.circuit)["circuits"]:
+            root = os.path.join(args.output, str(circuit["id"]))
+            seed = os.urandom(yao.LABEL_SIZE)
+            garbled = yao.GarbledCircuit(circuit, scheme=args.scheme,
+                                         lazy=True, seed=seed,
+                                         seeded_labels=True)
+            write(root + FILE_EXTENSION, garbled, args.chunk_size)
+            # The seed gives the keys of the inputs: for the garbler only
+            fd = os.open(root + ".seed", os.O_WRONLY | os.O_CREAT
+                         | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(seed)
+            logging.info(f"Wrote {root}{FILE_EXTENSION} and its seed")
+
+    initialize()
@@ -0,0 +1,22 @@
+import unittest
+import main
+import ot
+import yao
+
+# Run from src with: python -m unittest test_main
+
+
+class ChoicesTest(unittest.TestCase):
+    """The choices of main.py, copied so that it imports no protocol module,
+    are those of the protocol."""
+
+    def test_schemes(self):
+        self.assertEqual(main.SCHEMES, tuple(yao.SCHEMES))
+        self.assertEqual(main.DEFAULT_SCHEME, yao.DEFAULT_SCHEME)
+
+    def test_ot_modes(self):
+        self.assertEqual(main.OT_MODES, ot.OT_MODES)
+
+
+if __name__ == "__main__":
+    unittest.main()
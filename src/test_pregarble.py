@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import pregarble
+import util
+
+# Run from src with: python -m unittest test_pregarble
+
+
+def _circuit():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "circuits", "computerMaximum.json")
+    return util.parse_json(path)["circuits"][0]
+
+
+def _instance_key(garbled):
+    """Return what tells garbled instances apart, their keys."""
+    return tuple(sorted((w, keys) for w, keys in garbled.keys.items()))
+
+
+class SharedDirectoryTest(unittest.TestCase):
+    """Pools sharing a directory never hand out the same instance."""
+
+    def setUp(self):
+        self.circuit = _circuit()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.directory = os.path.join(self.tmp.name, "pregarbled")
+        # Persist all but the first instance, kept in memory
+        with pregarble.PregarblePool(self.circuit, depth=5, max_bytes=1,
+                                     directory=self.directory):
+            self._wait_files(4)
+
+    def _wait_files(self, count, timeout=10):
+        for _ in range(timeout * 100):
+            if len(self._files()) >= count:
+                return
+            time.sleep(0.01)
+        self.fail(f"Fewer than {count} instances persisted")
+
+    def _files(self):
+        return [name for name in os.listdir(self.directory)
+                if name.endswith(pregarble.FILE_EXTENSION)]
+
+    def test_files_taken_by_another_pool_are_skipped(self):
+        files = len(self._files())
+        first = pregarble.PregarblePool(self.circuit,
+                                        directory=self.directory)
+        second = pregarble.PregarblePool(self.circuit,
+                                         directory=self.directory)
+        with first, second:
+            taken = {_instance_key(first.get(timeout=10))
+                     for _ in range(files)}
+            self.assertEqual(len(taken), files)
+            # The second pool listed the same files, now all claimed
+            garbled = second.get(timeout=10)
+            self.assertNotIn(_instance_key(garbled), taken)
+
+    def test_concurrent_pools(self):
+        files = len(self._files())
+        pools = [pregarble.PregarblePool(self.circuit,
+                                         directory=self.directory)
+                 for _ in range(2)]
+        results = [[] for _ in pools]
+        errors = []
+
+        def take(pool, out):
+            try:
+                for _ in range(files):
+                    out.append(_instance_key(pool.get(timeout=10)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=take, args=(pool, out))
+                   for pool, out in zip(pools, results)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for pool in pools:
+            pool.close()
+        self.assertEqual(errors, [])
+        taken = results[0] + results[1]
+        self.assertEqual(len(set(taken)), len(taken))
+        self.assertEqual(self._files(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,36 @@
+import codec
 import json
+import metrics
 import operator
-import random
+import queue
 import secrets
-import sympy
+import struct
+import time
 import zmq
 
 # SOCKET
 LOCAL_PORT = 4080
 SERVER_HOST = "localhost"
 SERVER_PORT = 4080
+# Default time in seconds a session may stay idle before being dropped
+SESSION_TIMEOUT = 60
+def read_private_data(file_read: bool = False, filename=None) -> list:
+    """
+    Read private data from standard input or from a file, without cleaning.
+
+    Returns:
+        list: The integers read.
+    """
+    if not file_read:
+        return [*map(int, input().split())]
+    try:
+        with open(filename, "r") as f:
+            print("Reading data from txt file")
+            return list(map(int, f.read().split()))
+    except FileNotFoundError:
+        print("File does not exist")
+        exit(10)
+
 def process_private_data(name: str = "", bit_size: int = 16, file_read: bool = False, filename=None, data: list = []) -> tuple:
     """
     Process private data for computing the maximum value.
@@ -17,16 +39,7 @@ def process_private_data(name: str = "", bit_size: int = 16, file_read: bool = F
         tuple: A tuple containing the cleaned input data and the local maximum.
     """
     if len(data) == 0:
-        if not file_read:
-            line = [*map(int, input().split())]
-        else:
-            try:
-                with open(filename, "r") as f:
-                    print("Reading data from txt file")
-                    line = list(map(int, f.read().split()))
-            except FileNotFoundError:
-                print("File does not exist")
-                exit(10)
+        line = read_private_data(file_read, filename)
     else:
         line = data
 
@@ -36,6 +49,27 @@ def process_private_data(name: str = "", bit_size: int = 16, file_read: bool = F
     local_max = bin(max(line))[2:].zfill(bit_size)
     return line, local_max
 
+def values_t_bits(values: list, bit_size: int, count: int) -> str:
+    """
+    Convert values to the input bits of a circuit taking 'count' values.
+
+    Args:
+        values (list): The values, each of at most 'bit_size' bits.
+        bit_size (int): The bit size of each value.
+        count (int): The number of values, missing ones being 0.
+
+    Returns:
+        str: The bits of the values, each most significant bit first.
+
+    Raises:
+        ValueError: There are more than 'count' values.
+    """
+    if len(values) > count:
+        raise ValueError(f"{len(values)} values do not fit a circuit of "
+                         f"{count} values")
+    values = list(values) + [0] * (count - len(values))
+    return "".join(bin(value)[2:].zfill(bit_size) for value in values)
+
 def circuit_t_int(d: dict) -> int:
     """
     Convert a dictionary of bits to an integer.
@@ -48,25 +82,208 @@ def circuit_t_int(d: dict) -> int:
     """
     return int("".join(str(d[k]) for k in d.keys()), 2)
 
+def circuit_t_ints(d: dict, count: int) -> list:
+    """
+    Convert a dictionary of bits to 'count' integers of the same width.
 
+    Args:
+        d (dict): Dictionary representing bits.
+        count (int): The number of integers.
 
-class Socket:
-    def __init__(self, socket_type, endpoint=None):
-        self.socket = zmq.Context().socket(socket_type)
+    Returns:
+        list: Integer values.
+    """
+    bits = "".join(str(d[k]) for k in d.keys())
+    width = len(bits) // count
+    return [int(bits[i:i + width], 2) for i in range(0, len(bits), width)]
+
+
+
+class ZmqTransport:
+    """Transport of the messages of a Socket over a ZeroMQ socket."""
+    def __init__(self, socket):
+        self.socket = socket
         self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
-        
+        self.poller.register(socket, zmq.POLLIN)
+
+    def send(self, frames):
+        self.socket.send_multipart(frames, copy=False)
+
+    def receive(self):
+        return [frame.buffer
+                for frame in self.socket.recv_multipart(copy=False)]
+
+    def poll(self, timeout):
+        """Return whether a message is ready within 'timeout' ms."""
+        return bool(self.poller.poll(timeout))
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+class QueueTransport:
+    """In-memory transport between two threads of a process.
+
+    Frames are passed by reference, not copied, see queue_pair().
+
+    Args:
+        inbox: The queue.Queue of the messages received.
+        outbox: The queue.Queue of the messages sent.
+    """
+    def __init__(self, inbox, outbox):
+        self.inbox = inbox
+        self.outbox = outbox
+        self._polled = None  # message taken from the inbox by poll()
+
+    def send(self, frames):
+        self.outbox.put(frames)
+
+    def receive(self):
+        frames, self._polled = self._polled, None
+        return frames if frames is not None else self.inbox.get()
+
+    def poll(self, timeout):
+        """Return whether a message is ready within 'timeout' ms."""
+        if self._polled is None:
+            try:
+                self._polled = self.inbox.get(timeout=timeout / 1000)
+            except queue.Empty:
+                return False
+        return True
+
+    def close(self):
+        pass
+
+
+class PipeTransport:
+    """Transport over a multiprocessing.Connection, between two processes
+    of a host or two threads of a process, see pipe_pair().
+
+    A message is sent as its number of frames, then each frame.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def send(self, frames):
+        self.connection.send_bytes(struct.pack("<I", len(frames)))
+        for frame in frames:
+            self.connection.send_bytes(frame)
+
+    def receive(self):
+        count, = struct.unpack("<I", self.connection.recv_bytes())
+        return [self.connection.recv_bytes() for _ in range(count)]
+
+    def poll(self, timeout):
+        """Return whether a message is ready within 'timeout' ms."""
+        return self.connection.poll(timeout / 1000)
+
+    def close(self):
+        self.connection.close()
+
+
+def queue_pair():
+    """Return two QueueTransport connected to each other."""
+    a_to_b, b_to_a = queue.Queue(), queue.Queue()
+    return QueueTransport(b_to_a, a_to_b), QueueTransport(a_to_b, b_to_a)
+
+
+def pipe_pair():
+    """Return two PipeTransport connected to each other."""
+    import multiprocessing
+    a, b = multiprocessing.Pipe()
+    return PipeTransport(a), PipeTransport(b)
+
+
+class Socket:
+    """Socket exchanging Python objects, encoded with codec.
+
+    The socket counts the messages and bytes it sends and receives, and its
+    round trips: a message received after sending one completes a round
+    trip, whose duration is added to round_trip_time (in seconds). Its
+    metrics.Metrics also count them by message type, and time the encoding,
+    decoding and waiting for messages.
+
+    Messages go over a ZeroMQ socket, or over the 'transport' if given: a
+    QueueTransport or PipeTransport connecting Alice and Bob without
+    network.
+
+    Args:
+        socket_type: Optional; the ZeroMQ socket type.
+        endpoint: Optional; the endpoint to bind (REP) or connect (REQ) to.
+        context: Optional; the zmq.Context of the socket, a new one by
+            default. Both ends of an inproc endpoint share their context.
+        transport: Optional; the transport of the messages, instead of a
+            ZeroMQ socket.
+    """
+    def __init__(self, socket_type=None, endpoint=None, context=None,
+                 transport=None):
+        self.metrics = metrics.Metrics()
+        self.reset_counters()
+        if transport is not None:
+            self.socket = None
+            self.transport = transport
+            return
+
+        self.socket = (context or zmq.Context()).socket(socket_type)
+        self.transport = ZmqTransport(self.socket)
+
         if endpoint:
             if socket_type == zmq.REP:
                 self.socket.bind(endpoint)
             elif socket_type == zmq.REQ:
                 self.socket.connect(endpoint)
+
+    def reset_counters(self):
+        """Reset the message and round trip counters."""
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.round_trips = 0
+        self.round_trip_time = 0.0
+        self._sent_at = None  # time of the last send not yet answered
         
+    def _count_sent(self, frames):
+        nbytes = sum(memoryview(frame).nbytes for frame in frames)
+        self.messages_sent += 1
+        self.bytes_sent += nbytes
+        self.metrics.count_message("sent", nbytes)
+        self._sent_at = time.perf_counter()
+
+    def _count_received(self, frames, msg=None):
+        nbytes = sum(memoryview(frame).nbytes for frame in frames)
+        self.messages_received += 1
+        self.bytes_received += nbytes
+        self.metrics.count_message("received", nbytes, msg)
+        if self._sent_at is not None:
+            self.round_trips += 1
+            self.round_trip_time += time.perf_counter() - self._sent_at
+            self.metrics.count("round_trips")
+            self._sent_at = None
+
+    def _encode(self, msg):
+        start = time.perf_counter()
+        frames = codec.encode(msg)
+        self.metrics.add_time("encode", time.perf_counter() - start)
+        return frames
+
+    def _decode(self, frames, waited_since):
+        """Decode a message, whose wait started at 'waited_since'."""
+        start = time.perf_counter()
+        self.metrics.add_time("wait", start - waited_since)
+        msg = codec.decode(frames)
+        self.metrics.add_time("decode", time.perf_counter() - start)
+        self._count_received(frames, msg)
+        return msg
+
     def send(self, msg):
-        self.socket.send_pyobj(msg)
+        frames = self._encode(msg)
+        self.transport.send(frames)
+        self._count_sent(frames)
 
     def receive(self):
-        return self.socket.recv_pyobj()
+        start = time.perf_counter()
+        return self._decode(self.transport.receive(), start)
 
     def send_wait(self, msg):
         self.send(msg)
@@ -75,26 +292,146 @@ class Socket:
     def poll_socket(self, timetick=100):
         try:
             while True:
-                obj = dict(self.poller.poll(timetick))
-                if self.socket in obj and obj[self.socket] == zmq.POLLIN:
+                if self.transport.poll(timetick):
                     yield self.receive()
         except KeyboardInterrupt:
             pass
 
+    def close(self):
+        self.transport.close()
+
 class EvaluatorSocket(Socket):
     def __init__(self, endpoint=f"tcp://*:{LOCAL_PORT}"):
         super().__init__(zmq.REP, endpoint)
 
 class GarblerConnection(Socket):
+    """REQ socket of Alice, whose routing identity is a fresh session id."""
     def __init__(self, endpoint=f"tcp://{SERVER_HOST}:{SERVER_PORT}"):
-        super().__init__(zmq.REQ, endpoint)
+        super().__init__(zmq.REQ)
+        self.session_id = secrets.token_hex(8)
+        self.socket.setsockopt(zmq.IDENTITY, self.session_id.encode())
+        self.socket.connect(endpoint)
+
+class SessionSocket(Socket):
+    """Socket of the sessions served one at a time by a server worker.
+
+    The worker's DEALER socket receives the messages of Alice's sessions
+    prefixed by their session id, see server.EvaluatorServer. accept()
+    waits for the first message of a session, then the socket exchanges
+    messages with that session only.
+
+    Args:
+        socket: The DEALER socket of the worker.
+        timeout: Optional; the time in seconds to wait for a message of the
+            session before receive() raises TimeoutError, forever by default.
+    """
+    def __init__(self, socket, timeout=None):
+        self.socket = socket
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+        self.timeout = timeout
+        self.session_id = None
+        self.metrics = metrics.Metrics()
+        self.reset_counters()
+
+    def accept(self):
+        """Wait for a new session and return its first message."""
+        self.session_id = None
+        self.reset_counters()
+        session_id, msg = self._receive_frames()
+        self.session_id = session_id
+        return msg
+
+    def send(self, msg):
+        frames = self._encode(msg)
+        self.socket.send_multipart([self.session_id, b""] + frames,
+                                   copy=False)
+        self._count_sent(frames)
+
+    def receive(self):
+        if self.timeout is not None and not self.poller.poll(
+                self.timeout * 1000):
+            raise TimeoutError(f"Session {self.session_id!r} idle for "
+                               f"{self.timeout} s")
+        session_id, msg = self._receive_frames()
+        if session_id != self.session_id:
+            raise ValueError(f"Message of session {session_id!r} received "
+                             f"in session {self.session_id!r}")
+        return msg
+
+    def _receive_frames(self):
+        start = time.perf_counter()
+        frames = self.socket.recv_multipart(copy=False)
+        msg = self._decode([frame.buffer for frame in frames[2:]], start)
+        return frames[0].bytes, msg
 
 # Prime group constants
 PRIME_BITS = 64
 
+# Standardized safe-prime groups (generator 2) and the size of the secret
+# exponents used in them
+STANDARD_GROUPS = {
+    # RFC 3526 group 14
+    "modp2048": ("""
+        FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74
+        020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437
+        4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED
+        EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05
+        98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB
+        9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B
+        E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718
+        3995497CEA956AE515D2261898FA051015728E5A8AACAA68FFFFFFFFFFFFFFFF
+    """, 256),
+    # RFC 3526 group 15
+    "modp3072": ("""
+        FFFFFFFFFFFFFFFFC90FDAA22168C234C4C6628B80DC1CD129024E088A67CC74
+        020BBEA63B139B22514A08798E3404DDEF9519B3CD3A431B302B0A6DF25F1437
+        4FE1356D6D51C245E485B576625E7EC6F44C42E9A637ED6B0BFF5CB6F406B7ED
+        EE386BFB5A899FA5AE9F24117C4B1FE649286651ECE45B3DC2007CB8A163BF05
+        98DA48361C55D39A69163FA8FD24CF5F83655D23DCA3AD961C62F356208552BB
+        9ED529077096966D670C354E4ABC9804F1746C08CA18217C32905E462E36CE3B
+        E39E772C180E86039B2783A2EC07A28FB5C55DF06F4C52C9DE2BCBF695581718
+        3995497CEA956AE515D2261898FA051015728E5A8AAAC42DAD33170D04507A33
+        A85521ABDF1CBA64ECFB850458DBEF0A8AEA71575D060C7DB3970F85A6E1E4C7
+        ABF5AE8CDB0933D71E8C94E04A25619DCEE3D2261AD2EE6BF12FFA06D98A0864
+        D87602733EC86A64521F2B18177B200CBBE117577A615D6C770988C0BAD946E2
+        08E24FA074E5AB3143DB5BFCE0FD108E4B82D120A93AD2CAFFFFFFFFFFFFFFFF
+    """, 320),
+    # RFC 7919
+    "ffdhe2048": ("""
+        FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695
+        A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A
+        D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935
+        984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A
+        BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4
+        AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61
+        9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005
+        C58EF1837D1683B2C6F34A26C1B2EFFA886B423861285C97FFFFFFFFFFFFFFFF
+    """, 256),
+    # RFC 7919
+    "ffdhe3072": ("""
+        FFFFFFFFFFFFFFFFADF85458A2BB4A9AAFDC5620273D3CF1D8B9C583CE2D3695
+        A9E13641146433FBCC939DCE249B3EF97D2FE363630C75D8F681B202AEC4617A
+        D3DF1ED5D5FD65612433F51F5F066ED0856365553DED1AF3B557135E7F57C935
+        984F0C70E0E68B77E2A689DAF3EFE8721DF158A136ADE73530ACCA4F483A797A
+        BC0AB182B324FB61D108A94BB2C8E3FBB96ADAB760D7F4681D4F42A3DE394DF4
+        AE56EDE76372BB190B07A7C8EE0A6D709E02FCE1CDF7E2ECC03404CD28342F61
+        9172FE9CE98583FF8E4F1232EEF28183C3FE3B1B4C6FAD733BB5FCBC2EC22005
+        C58EF1837D1683B2C6F34A26C1B2EFFA886B4238611FCFDCDE355B3B6519035B
+        BC34F4DEF99C023861B46FC9D6E6C9077AD91D2691F7F7EE598CB0FAC186D91C
+        AEFE130985139270B4130C93BC437944F4FD4452E2D74DD364F2E21E71F54BFF
+        5CAE82AB9C9DF69EE86D2BC522363A0DABC521979B0DEADA1DBF9A42D5C4484E
+        0ABCD06BFA53DDEF3C1B20EE3FD59D7C25E41D2B66C62E37FFFFFFFFFFFFFFFF
+    """, 320),
+}
+DEFAULT_GROUP = "modp2048"
+
 
 def next_prime(num):
     """Return next prime after 'num' (skip 2)."""
+    # Imported on demand: sympy is slow to import, and only random groups
+    # need it, not the standardized ones of get_group()
+    import sympy
     return 3 if num < 3 else sympy.nextprime(num)
 
 
@@ -115,13 +452,33 @@ def bits(num, width):
 
 
 class PrimeGroup:
-    """Cyclic abelian group of prime order 'prime'."""
+    """Multiplicative group of integers modulo the prime 'prime'.
+
+    Generating a group is costly (prime search and factorization), so the
+    standardized groups of STANDARD_GROUPS should be used through get_group,
+    which builds each of them once per process.
+
+    Args:
+        prime: Optional; the prime modulus, a random PRIME_BITS-bit prime
+            by default.
+        generator: Optional; a generator of the group (or of a large prime
+            order subgroup), a random one is found by default.
+        exponent_bits: Optional; the bit size of random exponents, random
+            exponents cover the whole group by default.
+        group_id: Optional; the name of the group in STANDARD_GROUPS.
+    """
+    # Bit size of the windows of the precomputed powers of the generator
+    WINDOW_BITS = 4
 
-    def __init__(self, prime=None):
+    def __init__(self, prime=None, generator=None, exponent_bits=None,
+                 group_id=None):
         self.prime = prime or self._generate_prime()
         self.prime_minus_1 = self.prime - 1
         self.prime_minus_2 = self.prime - 2
-        self.generator = self._find_generator()
+        self.exponent_bits = exponent_bits
+        self.generator = generator or self._find_generator()
+        self.id = group_id
+        self._gen_table = None  # powers of the generator, built on first use
 
     def _generate_prime(self):
         """Generate a random prime number."""
@@ -130,6 +487,7 @@ class PrimeGroup:
 
     def _find_generator(self):
         """Find a random generator for the group."""
+        import sympy  # see next_prime()
         factors = sympy.primefactors(self.prime_minus_1)
 
         while True:
@@ -138,8 +496,28 @@ class PrimeGroup:
                 return candidate
 
     def _random_integer(self):
-        """Return a random integer in the range [1, prime - 1]."""
-        return random.randint(1, self.prime_minus_1)
+        """Return a random exponent.
+
+        The exponent is uniform in the range [1, prime - 1], or in
+        [1, 2^exponent_bits - 1] if exponent_bits is set.
+        """
+        if self.exponent_bits:
+            return secrets.randbelow((1 << self.exponent_bits) - 1) + 1
+        return secrets.randbelow(self.prime_minus_1) + 1
+
+    def _build_gen_table(self):
+        """Precompute g^(d * 2^(WINDOW_BITS * i)) for each window i, digit d."""
+        window_size = 1 << self.WINDOW_BITS
+        num_windows = -(-self.exponent_bits // self.WINDOW_BITS)
+        table = []
+        base = self.generator
+        for _ in range(num_windows):
+            row = [1, base]
+            for _ in range(window_size - 2):
+                row.append(row[-1] * base % self.prime)
+            table.append(row)
+            base = row[-1] * base % self.prime
+        return table
 
     def mul(self, num1, num2):
         """Multiply two elements in the group."""
@@ -150,12 +528,55 @@ class PrimeGroup:
         return pow(base, exponent, self.prime)
 
     def gen_pow(self, exponent):
-        """Compute nth power of the generator."""
-        return pow(self.generator, exponent, self.prime)
+        """Compute nth power of the generator.
+
+        Exponents of at most exponent_bits bits use precomputed powers of
+        the generator: one multiplication per window instead of a full
+        modular exponentiation.
+        """
+        if not self.exponent_bits or exponent.bit_length() > self.exponent_bits:
+            return pow(self.generator, exponent, self.prime)
+        if self._gen_table is None:
+            self._gen_table = self._build_gen_table()
+
+        mask = (1 << self.WINDOW_BITS) - 1
+        result = 1
+        for row in self._gen_table:
+            if not exponent:
+                break
+            digit = exponent & mask
+            if digit:
+                result = result * row[digit] % self.prime
+            exponent >>= self.WINDOW_BITS
+        return result
 
     def inv(self, num):
         """Compute the multiplicative inverse of an element."""
-        return pow(num, self.prime_minus_2, self.prime)
+        return pow(num, -1, self.prime)
+
+
+_groups = {}  # standardized groups already built in this process
+
+
+def get_group(group_id=DEFAULT_GROUP):
+    """Return the standardized group 'group_id', built once per process.
+
+    Args:
+        group_id: Optional; the name of the group in STANDARD_GROUPS.
+
+    Raises:
+        ValueError: The group is unknown.
+    """
+    group = _groups.get(group_id)
+    if group is None:
+        if group_id not in STANDARD_GROUPS:
+            raise ValueError(f"Unknown group '{group_id}', "
+                             f"must be in {list(STANDARD_GROUPS)}")
+        prime, exponent_bits = STANDARD_GROUPS[group_id]
+        group = PrimeGroup(int("".join(prime.split()), 16), generator=2,
+                           exponent_bits=exponent_bits, group_id=group_id)
+        _groups[group_id] = group
+    return group
 
 # HELPER FUNCTIONS
 def parse_json(json_path):
@@ -163,5 +584,15 @@ def parse_json(json_path):
         return json.load(json_file)
 
 
+def parse_circuits(path):
+    """Return the circuits of a JSON circuit file, or of a Bristol file, see
+    bristol.load()."""
+    import bristol  # by the garbler and circuit tools only, not by Bob
+
+    if bristol.is_bristol(path):
+        return bristol.load(path)
+    return parse_json(path)
+
+
 
 
@@ -1,6 +1,29 @@
-import pickle
-import random
+import base64
+import collections.abc
+import copy
+import hashlib
+import io
+import itertools
+import os
+import codec
+import compiler
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+LABEL_SIZE = 16  # size in bytes of fixed-key AES labels
+FIXED_KEY = bytes(range(LABEL_SIZE))  # public key of the AES permutation
+MASK_128 = (1 << 128) - 1
+
+# Logical function of each gate type
+OPERATORS = {
+    "OR": lambda b1, b2: b1 or b2,
+    "AND": lambda b1, b2: b1 and b2,
+    "XOR": lambda b1, b2: b1 ^ b2,
+    "NOR": lambda b1, b2: not (b1 or b2),
+    "NAND": lambda b1, b2: not (b1 and b2),
+    "XNOR": lambda b1, b2: not (b1 ^ b2),
+    "NOT": lambda b: not b
+}
 
 
 def encrypt(key, data):
@@ -31,52 +54,612 @@ def decrypt(key, data):
     return f.decrypt(data)
 
 
-def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs):
+def double(num):
+    """Multiply a 128-bit integer by 2 in GF(2^128)."""
+    num <<= 1
+    if num > MASK_128:
+        num = (num & MASK_128) ^ 0x87
+    return num
+
+
+class GarblingScheme:
+    """Base class of garbling schemes.
+
+    A scheme decides how the keys of a wire are generated and how each row
+    of a garbled table is encrypted and decrypted. Rows are indexed by the
+    encrypted bits (p-bit XOR clear bit) of the gate's inputs.
+
+    Gates are garbled and evaluated in the compiled form of the circuit:
+    wires are dense indices, which also serve as tweaks.
+    """
+    name = None
+    derived_keys = False  # whether keys of gate outputs come from garbling
+
+    def __init__(self, random_bytes=None):
+        # Source of the randomness of keys, os.urandom or a SeededRandom
+        self.random_bytes = random_bytes or os.urandom
+        self._init_ciphers()
+
+    def _init_ciphers(self):
+        """Create the cipher contexts of the scheme."""
+
+    def __getstate__(self):
+        """Return the state of the scheme, to copy it to garbling workers.
+
+        Cipher contexts and the source of randomness are not copied: keys
+        are generated by the garbler, workers only garble gates.
+        """
+        return {name: value for name, value in self.__dict__.items()
+                if not name.startswith("_") and name != "random_bytes"}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.random_bytes = os.urandom
+        self._init_ciphers()
+
+    def gen_keys(self, pbit, random_bytes=None):
+        """Return a pair of keys (key0, key1) for a wire of p-bit 'pbit'.
+
+        Args:
+            pbit: The p-bit of the wire.
+            random_bytes: Optional; the source of randomness of the keys,
+                the scheme's by default.
+        """
+        raise NotImplementedError
+
+    def encrypt_row(self, keys_in, tweak, key_out, encr_bit_out):
+        """Encrypt an output key and its encrypted bit under input keys.
+
+        Args:
+            keys_in: The list of input keys selecting the row.
+            tweak: An integer unique to the gate.
+            key_out: The output key of the row.
+            encr_bit_out: The encrypted bit of the output key.
+
+        Returns:
+            The ciphertext of the row.
+        """
+        raise NotImplementedError
+
+    def decrypt_row(self, keys_in, tweak, encr_msg):
+        """Decrypt a row with input keys.
+
+        Returns:
+            A pair (key, encr_bit) for the output wire of the gate.
+        """
+        raise NotImplementedError
+
+    def garble_gate(self, gate_type, gate_in, gate_out, keys, pbits):
+        """Garble a gate.
+
+        Args:
+            gate_type: The gate type: OR, AND, ...
+            gate_in: The list of input wires of the gate.
+            gate_out: The output wire of the gate.
+            keys: A list mapping each wire to a pair of keys. Schemes deriving
+                keys set the pair of the output wire.
+            pbits: A list mapping each wire to its p-bit.
+
+        Returns:
+            The garbled table of the gate, None if it needs no table.
+        """
+        gate = {"id": gate_out, "in": gate_in, "type": gate_type}
+        return GarbledGate(gate, keys, pbits, self).get_garbled_table()
+
+    def evaluate_gate(self, gate_type, gate_out, table, inputs):
+        """Evaluate a garbled gate.
+
+        Args:
+            gate_type: The gate type: OR, AND, ...
+            gate_out: The output wire of the gate.
+            table: The garbled table of the gate.
+            inputs: The list of (key, encr_bit) of the gate's input wires.
+
+        Returns:
+            A pair (key, encr_bit) for the output wire of the gate.
+        """
+        keys_in = [key for key, _ in inputs]
+        encr_bits = tuple(encr_bit for _, encr_bit in inputs)
+        return self.decrypt_row(keys_in, gate_out, table[encr_bits])
+
+
+class FernetScheme(GarblingScheme):
+    """Legacy scheme: each row is an encoded (key, encr_bit) label encrypted
+    with one Fernet layer per input key."""
+    name = "fernet"
+
+    def gen_keys(self, pbit, random_bytes=None):
+        # Same as Fernet.generate_key(), from the scheme's randomness
+        random_bytes = random_bytes or self.random_bytes
+        return (base64.urlsafe_b64encode(random_bytes(32)),
+                base64.urlsafe_b64encode(random_bytes(32)))
+
+    def encrypt_row(self, keys_in, tweak, key_out, encr_bit_out):
+        msg = codec.encode_label((key_out, encr_bit_out))
+        # The first input key is the outermost layer
+        for key in reversed(keys_in):
+            msg = encrypt(key, msg)
+        return msg
+
+    def decrypt_row(self, keys_in, tweak, encr_msg):
+        for key in keys_in:
+            encr_msg = decrypt(key, encr_msg)
+        return codec.decode_label(encr_msg)
+
+
+class FixedKeyScheme(GarblingScheme):
+    """Hash-then-XOR scheme with 16-byte labels and fixed-key AES.
+
+    A row is H(keys_in, tweak) XOR key_out, where H(K) = pi(K) XOR K with
+    K = 4*key_a XOR 2*key_b XOR tweak in GF(2^128) and pi is AES under a
+    public fixed key. The encrypted bit of a key is its least significant
+    bit, so rows only carry the output key.
+
+    A garbled table is the flat byte string of its rows, the row of
+    encrypted input bits (e_a, e_b) being the (2 * e_a + e_b)-th.
+    """
+    name = "aes"
+    row_reduction = False  # whether the first row is implicitly zero
+
+    def _init_ciphers(self):
+        # ECB keeps no state between blocks, so one encryptor is reused
+        self._aes = Cipher(algorithms.AES(FIXED_KEY), modes.ECB()).encryptor()
+
+    def gen_keys(self, pbit, random_bytes=None):
+        rand = (random_bytes or self.random_bytes)(2 * LABEL_SIZE)
+        num0 = int.from_bytes(rand[:LABEL_SIZE], "little") & ~1
+        num1 = int.from_bytes(rand[LABEL_SIZE:], "little") & ~1
+        return (self.to_label(num0 | pbit), self.to_label(num1 | (pbit ^ 1)))
+
+    def hash(self, keys_in, tweak):
+        """Return H(keys_in, tweak) as a 128-bit integer."""
+        num = 0
+        for key in keys_in:
+            num = double(num ^ int.from_bytes(key, "little"))
+        num ^= tweak
+        block = self._aes.update(self.to_label(num))
+        return int.from_bytes(block, "little") ^ num
+
+    def garble_gate(self, gate_type, gate_in, gate_out, keys, pbits):
+        wires, out = gate_in, gate_out
+        operator = OPERATORS[gate_type]
+
+        # Doubling is linear, so the i-th input key is multiplied by
+        # 2^(n - i) once per wire instead of once per row
+        nums_in = []
+        for i, wire in enumerate(wires):
+            nums = [int.from_bytes(key, "little") for key in keys[wire]]
+            for _ in range(len(wires) - i):
+                nums = [double(num) for num in nums]
+            nums_in.append(nums)
+
+        # Same model as GarbledGate, with all the rows hashed at once
+        blocks, nums, bits_out = [], [], []
+        for encr_bits in itertools.product((0, 1), repeat=len(wires)):
+            bits = [e ^ pbits[wire] for e, wire in zip(encr_bits, wires)]
+            num = out
+            for nums_wire, bit in zip(nums_in, bits):
+                num ^= nums_wire[bit]
+            blocks.append(self.to_label(num))
+            nums.append(num)
+            bits_out.append(int(operator(*bits)))
+
+        blocks = self._aes.update(b"".join(blocks))
+        hashes = [
+            int.from_bytes(blocks[i * LABEL_SIZE:(i + 1) * LABEL_SIZE],
+                           "little") ^ num for i, num in enumerate(nums)
+        ]
+
+        if self.row_reduction:
+            # The first row decrypts to the output key it selects
+            bit, key = bits_out[0], self.to_label(hashes[0])
+            pbits[out] = (hashes[0] & 1) ^ bit
+            key_other = self.gen_gate_key(out, pbits[out] ^ bit ^ 1)
+            keys[out] = (key, key_other) if bit == 0 else (key_other, key)
+            hashes, bits_out = hashes[1:], bits_out[1:]
+
+        nums_out = [int.from_bytes(key, "little") for key in keys[out]]
+        return b"".join(
+            self.to_label(num ^ nums_out[bit])
+            for num, bit in zip(hashes, bits_out))
+
+    def evaluate_gate(self, gate_type, gate_out, table, inputs):
+        keys_in = [key for key, _ in inputs]
+        row = 0
+        for _, encr_bit in inputs:
+            row = row << 1 | encr_bit
+        if self.row_reduction:
+            row -= 1
+        if row < 0:
+            encr_msg = bytes(LABEL_SIZE)
+        else:
+            encr_msg = table[row * LABEL_SIZE:(row + 1) * LABEL_SIZE]
+        return self.decrypt_row(keys_in, gate_out, encr_msg)
+
+    def encrypt_row(self, keys_in, tweak, key_out, encr_bit_out):
+        num = self.hash(keys_in, tweak) ^ int.from_bytes(key_out, "little")
+        return self.to_label(num)
+
+    def decrypt_row(self, keys_in, tweak, encr_msg):
+        num = self.hash(keys_in, tweak) ^ int.from_bytes(encr_msg, "little")
+        return self.to_label(num), num & 1
+
+    @staticmethod
+    def to_label(num):
+        """Convert a 128-bit integer into a label."""
+        return num.to_bytes(LABEL_SIZE, "little")
+
+
+class GRR3Scheme(FixedKeyScheme):
+    """Fixed-key AES scheme with garbled row reduction (GRR3).
+
+    The output key selected by the first row is the hash of its input keys,
+    so the first row is always zero and is not sent: 2-input gates carry
+    three ciphertexts and NOT gates one.
+    """
+    name = "grr3"
+    derived_keys = True
+    row_reduction = True
+
+    def __init__(self, random_bytes=None):
+        # Secret key of the PRF giving the other key of gate outputs
+        self.prf_key = (random_bytes or os.urandom)(LABEL_SIZE)
+        super().__init__(random_bytes)
+
+    def _init_ciphers(self):
+        super()._init_ciphers()
+        self._prf = Cipher(algorithms.AES(self.prf_key),
+                           modes.ECB()).encryptor()
+
+    def gen_gate_key(self, gate_out, encr_bit):
+        """Return the random key of a gate output not given by its first row.
+
+        The key is derived from the gate's output wire, so that gates can
+        be garbled in any order, or in parallel, with the same result.
+        """
+        num = int.from_bytes(self._prf.update(self.to_label(gate_out)),
+                             "little")
+        return self.to_label((num & ~1) | encr_bit)
+
+
+class HalfGatesScheme(FixedKeyScheme):
+    """Free-XOR and half-gates garbling with fixed-key AES.
+
+    Both keys of a wire differ by a global offset delta whose least
+    significant bit is set. XOR, XNOR and NOT gates only XOR keys and need
+    no garbled table. The other gates are ANDs with negated inputs and
+    output, garbled as two half-gates with two ciphertexts.
+    """
+    name = "halfgates"
+    derived_keys = True
+
+    # (alpha, beta, gamma) such that f(a, b) = ((a ^ alpha) & (b ^ beta)) ^ gamma
+    AND_GATES = {
+        "AND": (0, 0, 0),
+        "NAND": (0, 0, 1),
+        "OR": (1, 1, 1),
+        "NOR": (1, 1, 0)
+    }
+
+    def __init__(self, random_bytes=None):
+        super().__init__(random_bytes)
+        self.delta = int.from_bytes(self.random_bytes(LABEL_SIZE),
+                                    "little") | 1
+
+    def gen_keys(self, pbit, random_bytes=None):
+        rand = (random_bytes or self.random_bytes)(LABEL_SIZE)
+        num = (int.from_bytes(rand, "little") & ~1) | pbit
+        return self.to_label(num), self.to_label(num ^ self.delta)
+
+    def garble_gate(self, gate_type, gate_in, gate_out, keys, pbits):
+        """Derive the keys of the gate output and return its garbled table.
+
+        The table is None for free gates, else the 32 bytes TG || TE.
+        """
+        out, delta, table = gate_out, self.delta, None
+        num_a = int.from_bytes(keys[gate_in[0]][0], "little")
+
+        if gate_type == "NOT":
+            num_out = num_a ^ delta
+        elif gate_type in ("XOR", "XNOR"):
+            num_out = num_a ^ int.from_bytes(keys[gate_in[1]][0], "little")
+            if gate_type == "XNOR":
+                num_out ^= delta
+        else:
+            alpha, beta, gamma = self.AND_GATES[gate_type]
+            num_b = int.from_bytes(keys[gate_in[1]][0], "little")
+            # Zero keys of the (possibly negated) inputs
+            a0, b0 = num_a ^ alpha * delta, num_b ^ beta * delta
+            pa, pb = a0 & 1, b0 & 1
+            ha0, ha1, hb0, hb1 = self.hash_keys(
+                (a0, a0 ^ delta, b0, b0 ^ delta), 2 * out)
+
+            # Garbler half-gate
+            t_g = ha0 ^ ha1 ^ pb * delta
+            w_g = ha0 ^ pa * t_g
+            # Evaluator half-gate
+            t_e = hb0 ^ hb1 ^ a0
+            w_e = hb0 ^ pb * (t_e ^ a0)
+
+            num_out = w_g ^ w_e ^ gamma * delta
+            table = self.to_label(t_g) + self.to_label(t_e)
+
+        keys[out] = (self.to_label(num_out), self.to_label(num_out ^ delta))
+        pbits[out] = num_out & 1
+        return table
+
+    def evaluate_gate(self, gate_type, gate_out, table, inputs):
+        num_a = int.from_bytes(inputs[0][0], "little")
+
+        if gate_type == "NOT":
+            num_out = num_a
+        elif gate_type in ("XOR", "XNOR"):
+            num_out = num_a ^ int.from_bytes(inputs[1][0], "little")
+        else:
+            num_b = int.from_bytes(inputs[1][0], "little")
+            t_g = int.from_bytes(table[:LABEL_SIZE], "little")
+            t_e = int.from_bytes(table[LABEL_SIZE:], "little")
+            h_a, h_b = self.hash_keys((num_a, num_b), 2 * gate_out)
+            w_g = h_a ^ (num_a & 1) * t_g
+            w_e = h_b ^ (num_b & 1) * (t_e ^ num_a)
+            num_out = w_g ^ w_e
+
+        return self.to_label(num_out), num_out & 1
+
+    def hash_keys(self, nums, tweak):
+        """Hash single keys with one call to AES.
+
+        The first half of 'nums' is hashed with 'tweak' and the second half
+        with 'tweak' + 1.
+
+        Returns:
+            The list of H(key, tweak) as 128-bit integers.
+        """
+        half = len(nums) // 2
+        nums = [
+            double(num) ^ (tweak + (i >= half)) for i, num in enumerate(nums)
+        ]
+        blocks = self._aes.update(b"".join(map(self.to_label, nums)))
+        return [
+            int.from_bytes(blocks[i * LABEL_SIZE:(i + 1) * LABEL_SIZE],
+                           "little") ^ num for i, num in enumerate(nums)
+        ]
+
+
+SCHEMES = {
+    scheme.name: scheme
+    for scheme in (FernetScheme, FixedKeyScheme, GRR3Scheme, HalfGatesScheme)
+}
+DEFAULT_SCHEME = HalfGatesScheme.name
+
+
+def get_scheme(scheme, random_bytes=None):
+    """Return an instance of a garbling scheme.
+
+    Args:
+        scheme: A scheme name from SCHEMES or a GarblingScheme instance.
+        random_bytes: Optional; the source of randomness of a new instance,
+            os.urandom by default.
+    """
+    if isinstance(scheme, GarblingScheme):
+        return scheme
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown garbling scheme '{scheme}', "
+                         f"must be in {list(SCHEMES)}")
+    return SCHEMES[scheme](random_bytes)
+
+
+def restore_scheme(scheme, state):
+    """Return an instance of a garbling scheme from its saved state.
+
+    Args:
+        scheme: A scheme name from SCHEMES.
+        state: The state returned by the __getstate__() of the scheme.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown garbling scheme '{scheme}', "
+                         f"must be in {list(SCHEMES)}")
+    instance = SCHEMES[scheme].__new__(SCHEMES[scheme])
+    instance.__setstate__(state)
+    return instance
+
+
+class SeededRandom:
+    """Deterministic random bytes, expanded from a seed with AES-CTR.
+
+    Garbling a circuit twice with the same seed gives the same keys, p-bits
+    and tables (except with the fernet scheme, whose tokens hold a random
+    IV and a timestamp). Meant for tests and benchmarks.
+
+    Args:
+        seed: An integer, string or bytes seed.
+    """
+    def __init__(self, seed):
+        if not isinstance(seed, bytes):
+            seed = str(seed).encode()
+        key = hashlib.sha256(seed).digest()
+        self._ctr = Cipher(algorithms.AES(key),
+                           modes.CTR(bytes(LABEL_SIZE))).encryptor()
+
+    def __call__(self, size):
+        """Return the next 'size' random bytes."""
+        return self._ctr.update(bytes(size))
+
+
+class WireLabels:
+    """Keys and p-bits of wires, derived on demand from a session seed.
+
+    The randomness of the wire of compiled index i is the i-th slice of
+    WIRE_BLOCKS blocks of an AES-CTR keystream, computed from the counters
+    with AES-ECB so that wires are derived in any order. The keys and
+    p-bit of a wire can thus be computed again when needed instead of
+    being kept.
+
+    Args:
+        seed: An integer, string or bytes seed.
+        scheme: The GarblingScheme generating keys from the randomness.
+    """
+    # Blocks per wire: the p-bit, then up to 64 bytes of keys (fernet)
+    WIRE_BLOCKS = 5
+
+    def __init__(self, seed, scheme):
+        if not isinstance(seed, bytes):
+            seed = str(seed).encode()
+        # Another key than SeededRandom's, which may expand the same seed
+        key = hashlib.sha256(b"wire labels" + seed).digest()
+        self._aes = Cipher(algorithms.AES(key), modes.ECB()).encryptor()
+        self.scheme = scheme
+
+    def __call__(self, index):
+        """Return the (pbit, (key0, key1)) of a wire by compiled index."""
+        first = index * self.WIRE_BLOCKS
+        rand = self._aes.update(b"".join(
+            counter.to_bytes(LABEL_SIZE, "little")
+            for counter in range(first, first + self.WIRE_BLOCKS)))
+        pbit = rand[0] & 1
+        stream = io.BytesIO(rand[LABEL_SIZE:])
+        return pbit, self.scheme.gen_keys(pbit, stream.read)
+
+
+class _DerivedDict(dict):
+    """Dict filling its missing entries with a callback."""
+    def __init__(self, derive):
+        super().__init__()
+        self._derive = derive
+
+    def __missing__(self, index):
+        self._derive(index)
+        return dict.__getitem__(self, index)
+
+
+class _LiveWires:
+    """Keys and p-bits of the wires being garbled, by compiled index.
+
+    Both are derived from WireLabels on first access, unless the scheme
+    sets them while garbling, and are dropped once no gate reads them.
+    """
+    def __init__(self, labels):
+        self.labels = labels
+        self.keys = _DerivedDict(self._derive)
+        self.pbits = _DerivedDict(self._derive)
+
+    def _derive(self, index):
+        self.pbits[index], self.keys[index] = self.labels(index)
+
+    def drop(self, index):
+        self.keys.pop(index, None)
+        self.pbits.pop(index, None)
+
+
+class _SeededWires(collections.abc.Mapping):
+    """Read-only view of the keys or p-bits of a garbled circuit with
+    seeded labels, by wire.
+
+    It holds the input wires, derived on each access, and for p-bits the
+    gate outputs of the circuit once they are garbled.
+    """
+    def __init__(self, garbled, part):
+        self._garbled = garbled
+        self._part = part  # 0 for p-bits, 1 for keys
+
+    def __getitem__(self, wire):
+        garbled = self._garbled
+        index = garbled.compiled.index[wire]
+        if index < garbled.compiled.num_inputs:
+            return garbled.labels(index)[self._part]
+        if self._part == 0 and wire in garbled._pbits_out:
+            return garbled._pbits_out[wire]
+        raise KeyError(wire)
+
+    def __iter__(self):
+        garbled = self._garbled
+        yield from garbled.wires[:garbled.compiled.num_inputs]
+        if self._part == 0:
+            yield from garbled._pbits_out
+
+    def __len__(self):
+        garbled = self._garbled
+        return garbled.compiled.num_inputs + (len(garbled._pbits_out)
+                                              if self._part == 0 else 0)
+
+
+def evaluate(circuit, g_tables, pbits_out, a_inputs, b_inputs,
+             scheme=DEFAULT_SCHEME):
     """Evaluate yao circuit with given inputs.
 
     Args:
-        circuit: A dict containing circuit spec.
-        g_tables: The yao circuit garbled tables.
+        circuit: A dict containing circuit spec, or its CompiledCircuit
+            (preferred when evaluating the same circuit many times).
+        g_tables: The list of garbled tables, by compiled gate index.
         pbits_out: The pbits of outputs.
         a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
         b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the garbling scheme the tables were built with.
 
     Returns:
         A dict mapping output wires with their result bit.
     """
-    gates = circuit["gates"]  # dict containing circuit gates
-    wire_outputs = circuit["out"]  # list of output wires
-    wire_inputs = {}  # dict containing Alice and Bob inputs
-    evaluation = {}  # dict containing result of evaluation
-
-    wire_inputs.update(a_inputs)
-    wire_inputs.update(b_inputs)
-
-    # Iterate over all gates
-    for gate in sorted(gates, key=lambda g: g["id"]):
-        gate_id, gate_in, msg = gate["id"], gate["in"], None
-        # Special case if it's a NOT gate
-        if (len(gate_in) < 2) and (gate_in[0] in wire_inputs):
-            # Fetch input key associated with the gate's input wire
-            key_in, encr_bit_in = wire_inputs[gate_in[0]]
-            # Fetch the encrypted message in the gate's garbled table
-            encr_msg = g_tables[gate_id][(encr_bit_in, )]
-            # Decrypt message
-            msg = decrypt(key_in, encr_msg)
-        # Else the gate has two input wires (same model)
-        elif (gate_in[0] in wire_inputs) and (gate_in[1] in wire_inputs):
-            key_a, encr_bit_a = wire_inputs[gate_in[0]]
-            key_b, encr_bit_b = wire_inputs[gate_in[1]]
-            encr_msg = g_tables[gate_id][(encr_bit_a, encr_bit_b)]
-            msg = decrypt(key_b, decrypt(key_a, encr_msg))
-        if msg:
-            wire_inputs[gate_id] = pickle.loads(msg)
-
-    # After all gates have been evaluated, we populate the dict of results
-    for out in wire_outputs:
-        evaluation[out] = wire_inputs[out][1] ^ pbits_out[out]
-
-    return evaluation
+    evaluator = Evaluator(circuit, a_inputs, b_inputs, scheme)
+    evaluator.feed(g_tables)
+    return evaluator.result(pbits_out)
+
+
+class Evaluator:
+    """Incremental evaluation of a yao circuit.
+
+    Garbled tables are fed in topological order, possibly chunk by chunk
+    as they are received, and are not kept once their gate is evaluated.
+
+    Args:
+        circuit: A dict containing circuit spec, or its CompiledCircuit.
+        a_inputs: A dict mapping Alice's wires to (key, encr_bit) inputs.
+        b_inputs: A dict mapping Bob's wires to (key, encr_bit) inputs.
+        scheme: Optional; the garbling scheme the tables were built with.
+
+    Raises:
+        ValueError: Inputs of the circuit are missing.
+    """
+    def __init__(self, circuit, a_inputs, b_inputs, scheme=DEFAULT_SCHEME):
+        self.circuit = compiler.compile_circuit(circuit)
+        self.scheme = get_scheme(scheme)
+        self.evaluated = 0  # number of gates evaluated so far
+        self._gates = self.circuit.iter_gates()
+        # (key, encr_bit) of each wire
+        self._wire_inputs = [None] * len(self.circuit.wires)
+
+        index = self.circuit.index
+        for inputs in (a_inputs, b_inputs):
+            for wire, wire_input in inputs.items():
+                self._wire_inputs[index[wire]] = wire_input
+        if None in self._wire_inputs[:self.circuit.num_inputs]:
+            raise ValueError("Missing inputs for circuit evaluation")
+
+    def feed(self, g_tables):
+        """Evaluate the next gates with their garbled tables."""
+        wire_inputs = self._wire_inputs
+        evaluate_gate = self.scheme.evaluate_gate
+        # Tables first, not to consume a gate when they run out
+        for table, (gate_type, gate_in, gate_out) in zip(g_tables,
+                                                         self._gates):
+            inputs = [wire_inputs[wire] for wire in gate_in]
+            wire_inputs[gate_out] = evaluate_gate(gate_type, gate_out, table,
+                                                  inputs)
+            self.evaluated += 1
+
+    def result(self, pbits_out):
+        """Return a dict mapping output wires with their result bit.
+
+        Raises:
+            ValueError: Some gates have not been evaluated.
+        """
+        if self.evaluated != len(self.circuit):
+            raise ValueError(f"Missing garbled tables, {self.evaluated} of "
+                             f"{len(self.circuit)} gates evaluated")
+        wires = self.circuit.wires
+        return {
+            wires[out]: self._wire_inputs[out][1] ^ pbits_out[wires[out]]
+            for out in self.circuit.out
+        }
 
 
 class GarbledGate:
@@ -86,10 +669,12 @@ class GarbledGate:
         gate: A dict containing gate spec.
         keys: A dict mapping each wire to a pair of keys.
         pbits: A dict mapping each wire to its p-bit.
+        scheme: Optional; the GarblingScheme encrypting the rows.
     """
-    def __init__(self, gate, keys, pbits):
+    def __init__(self, gate, keys, pbits, scheme=None):
         self.keys = keys  # dict of yao circuit keys
         self.pbits = pbits  # dict of p-bits
+        self.scheme = scheme or FernetScheme()  # encryption of the rows
         self.input = gate["in"]  # list of inputs'ID
         self.output = gate["id"]  # ID of output
         self.gate_type = gate["type"]  # Gate type: OR, AND, ...
@@ -97,21 +682,12 @@ class GarbledGate:
         # A clear representation of the garbled table for debugging purposes
         self.clear_garbled_table = {}
 
-        # Create the garbled table according to the gate type
-        switch = {
-            "OR": lambda b1, b2: b1 or b2,
-            "AND": lambda b1, b2: b1 and b2,
-            "XOR": lambda b1, b2: b1 ^ b2,
-            "NOR": lambda b1, b2: not (b1 or b2),
-            "NAND": lambda b1, b2: not (b1 and b2),
-            "XNOR": lambda b1, b2: not (b1 ^ b2)
-        }
-
         # NOT gate is a special case since it has only one input
         if (self.gate_type == "NOT"):
             self._gen_garbled_table_not()
         else:
-            operator = switch[self.gate_type]
+            # Create the garbled table according to the gate type
+            operator = OPERATORS[self.gate_type]
             self._gen_garbled_table(operator)
 
     def _gen_garbled_table_not(self):
@@ -130,10 +706,9 @@ class GarbledGate:
             key_in = self.keys[inp][bit_in]
             key_out = self.keys[out][bit_out]
 
-            # Serialize the output key along with the encrypted bit
-            msg = pickle.dumps((key_out, encr_bit_out))
-            # Encrypt message and add it to the garbled table
-            self.garbled_table[(encr_bit_in, )] = encrypt(key_in, msg)
+            # Encrypt the output key along with the encrypted bit
+            self.garbled_table[(encr_bit_in, )] = self.scheme.encrypt_row(
+                [key_in], out, key_out, encr_bit_out)
             # Add to the clear table indexes of each keys
             self.clear_garbled_table[(encr_bit_in, )] = [(inp, bit_in),
                                                          (out, bit_out),
@@ -158,9 +733,9 @@ class GarbledGate:
                 key_b = self.keys[in_b][bit_b]
                 key_out = self.keys[out][bit_out]
 
-                msg = pickle.dumps((key_out, encr_bit_out))
-                self.garbled_table[(encr_bit_a, encr_bit_b)] = encrypt(
-                    key_a, encrypt(key_b, msg))
+                self.garbled_table[(encr_bit_a, encr_bit_b)] = \
+                    self.scheme.encrypt_row([key_a, key_b], out, key_out,
+                                            encr_bit_out)
                 self.clear_garbled_table[(encr_bit_a, encr_bit_b)] = [
                     (in_a, bit_a), (in_b, bit_b), (out, bit_out), encr_bit_out
                 ]
@@ -194,52 +769,230 @@ class GarbledCircuit:
 
     Args:
         circuit: A dict containing circuit spec.
-        pbits: Optional; a dict of p-bits for the given circuit.
+        pbits: Optional; a dict of p-bits for the given circuit. When the
+            scheme derives keys of gate outputs, only the p-bits of input
+            wires are kept.
+        scheme: Optional; the name of the garbling scheme to use.
+        lazy: Optional; whether to leave the garbling of gates to
+            iter_garbled_tables(), so that the tables can be sent as they
+            are garbled instead of being all kept in memory.
+        seed: Optional; a seed making the garbling deterministic, see
+            SeededRandom. Ignored if 'scheme' is an instance.
+        pool: Optional; a GarblingPool garbling the gates in parallel,
+            level by level, with the same tables as the serial path.
+        seeded_labels: Optional; whether to derive the keys and p-bits of
+            wires on demand from a session seed (the given one, or a random
+            one), with WireLabels, instead of keeping them. Garbling then
+            only holds the wires still to be read, and afterwards 'keys'
+            and 'pbits' only hold input wires, plus outputs for p-bits.
+        compiled: Optional; the CompiledCircuit of 'circuit', for callers
+            garbling the same circuit many times to compile it once.
+
+    Raises:
+        ValueError: Seeded labels are asked with p-bits or a pool.
     """
-    def __init__(self, circuit, pbits={}):
+    def __init__(self, circuit, pbits={}, scheme=DEFAULT_SCHEME, lazy=False,
+                 seed=None, pool=None, seeded_labels=False, compiled=None):
+        if seeded_labels:
+            if pbits or pool is not None:
+                raise ValueError("Seeded labels are derived one gate at a "
+                                 "time, without given p-bits nor a pool")
+            if seed is None:
+                seed = os.urandom(LABEL_SIZE)
         self.circuit = circuit
+        self.compiled = compiler.compile_circuit(
+            circuit if compiled is None else compiled)
+        random_bytes = SeededRandom(seed) if seed is not None else None
+        self.scheme = get_scheme(scheme, random_bytes)  # garbling scheme
         self.gates = circuit["gates"]  # list of gates
-        self.wires = set()  # list of circuit wires
+        self.wires = self.compiled.wires  # list of circuit wires
 
         self.pbits = {}  # dict of p-bits
         self.keys = {}  # dict of keys
-        self.garbled_tables = {}  # dict of garbled tables
+        self.garbled_tables = []  # list of garbled tables
+        self.labels = None  # WireLabels of seeded labels
 
-        # Retrieve all wire IDs from the circuit
-        for gate in self.gates:
-            self.wires.add(gate["id"])
-            self.wires.update(set(gate["in"]))
-        self.wires = list(self.wires)
+        if seeded_labels:
+            self.labels = WireLabels(seed, self.scheme)
+            self._pbits_out = {}  # map from garbled output wire to p-bit
+            self.pbits = _SeededWires(self, 0)
+            self.keys = _SeededWires(self, 1)
+        else:
+            self._gen_pbits(pbits)
+            self._gen_keys()
+        if pool is not None and not lazy:
+            self._gen_garbled_tables_parallel(pool)
+        elif not lazy:
+            self._gen_garbled_tables()
 
-        self._gen_pbits(pbits)
-        self._gen_keys()
-        self._gen_garbled_tables()
+    @classmethod
+    def restore(cls, circuit, scheme, pbits, keys, garbled_tables,
+                compiled=None):
+        """Return a garbled circuit from the state of a garbled instance.
+
+        Args:
+            circuit: A dict containing circuit spec.
+            scheme: The GarblingScheme instance the circuit was garbled with.
+            pbits: A dict mapping each wire to its p-bit.
+            keys: A dict mapping each wire to its pair of keys.
+            garbled_tables: The list of garbled tables.
+            compiled: Optional; the CompiledCircuit of 'circuit'.
+        """
+        garbled = cls.__new__(cls)
+        garbled.circuit = circuit
+        garbled.compiled = compiler.compile_circuit(
+            circuit if compiled is None else compiled)
+        garbled.scheme = scheme
+        garbled.gates = circuit["gates"]
+        garbled.wires = garbled.compiled.wires
+        garbled.labels = None
+        garbled.pbits = dict(pbits)
+        garbled.keys = {wire: tuple(pair) for wire, pair in keys.items()}
+        garbled.garbled_tables = list(garbled_tables)
+        return garbled
 
     def _gen_pbits(self, pbits):
         """Create a dict mapping each wire to a random p-bit."""
         if pbits:
-            self.pbits = pbits
+            self.pbits = dict(pbits)
         else:
-            self.pbits = {wire: random.randint(0, 1) for wire in self.wires}
+            rand = self.scheme.random_bytes((len(self.wires) + 7) // 8)
+            bits = int.from_bytes(rand, "little")
+            self.pbits = {wire: (bits >> i) & 1
+                          for i, wire in enumerate(self.wires)}
 
     def _gen_keys(self):
-        """Create pair of keys for each wire."""
-        for wire in self.wires:
-            self.keys[wire] = (Fernet.generate_key(), Fernet.generate_key())
+        """Create pair of keys for each wire.
+
+        When the scheme derives the keys of gate outputs while garbling
+        (Free-XOR, row reduction), only input wires get fresh keys.
+        """
+        wires = self.wires
+        if self.scheme.derived_keys:
+            wires = wires[:self.compiled.num_inputs]
+        for wire in wires:
+            self.keys[wire] = self.scheme.gen_keys(self.pbits[wire])
 
     def _gen_garbled_tables(self):
-        """Create the garbled table of each gate."""
-        for gate in self.gates:
-            garbled_gate = GarbledGate(gate, self.keys, self.pbits)
-            self.garbled_tables[gate["id"]] = garbled_gate.get_garbled_table()
+        """Create the garbled table of each gate, in topological order."""
+        for g_tables in self.iter_garbled_tables():
+            self.garbled_tables.extend(g_tables)
+
+    def _gen_garbled_tables_parallel(self, pool):
+        """Create the garbled table of each gate with a GarblingPool."""
+        keys = [self.keys.get(wire) for wire in self.wires]
+        pbits = [self.pbits[wire] for wire in self.wires]
+        self.garbled_tables = pool.garble(self.scheme, self.compiled, keys,
+                                          pbits)
+        self.keys = dict(zip(self.wires, keys))
+        self.pbits = dict(zip(self.wires, pbits))
+
+    def iter_garbled_tables(self, chunk_size=None):
+        """Garble the gates in topological order, chunk by chunk.
+
+        Gates are garbled over lists indexed by compiled wire index. With a
+        scheme deriving keys, the keys and p-bits of gate outputs are only
+        all known when the last chunk is yielded.
+
+        Args:
+            chunk_size: Optional; the number of gates per chunk, all gates
+                in one chunk by default.
+
+        Yields:
+            Lists of garbled tables, by compiled gate index. The last chunk
+            is yielded even if empty.
+        """
+        if self.labels is not None:
+            yield from self._iter_seeded_garbled_tables(chunk_size)
+            return
+        keys = [self.keys.get(wire) for wire in self.wires]
+        pbits = [self.pbits[wire] for wire in self.wires]
+        last_gate = len(self.compiled) - 1
+        g_tables = []
+        for i, (gate_type, gate_in, gate_out) in enumerate(
+                self.compiled.iter_gates()):
+            g_tables.append(
+                self.scheme.garble_gate(gate_type, gate_in, gate_out, keys,
+                                        pbits))
+            if len(g_tables) == chunk_size and i != last_gate:
+                yield g_tables
+                g_tables = []
+        self.keys = dict(zip(self.wires, keys))
+        self.pbits = dict(zip(self.wires, pbits))
+        yield g_tables
+
+    def _iter_seeded_garbled_tables(self, chunk_size):
+        """Garble the gates with seeded labels, see iter_garbled_tables().
+
+        The keys and p-bits of a wire are derived when first read (or
+        written, with a scheme not deriving keys) and dropped after its
+        last reader is garbled, so that memory grows with the width of the
+        circuit, not with its number of gates. Only the p-bits of outputs
+        are kept.
+        """
+        live = _LiveWires(self.labels)
+        last_reads = self.compiled.last_reads()
+        # Outputs that are not inputs, whose p-bits are derived on demand
+        outputs = {out for out in self.compiled.out
+                   if out >= self.compiled.num_inputs}
+        wires = self.wires
+        last_gate = len(self.compiled) - 1
+        self._pbits_out = {}
+        g_tables = []
+        for i, (gate_type, gate_in, gate_out) in enumerate(
+                self.compiled.iter_gates()):
+            g_tables.append(
+                self.scheme.garble_gate(gate_type, gate_in, gate_out,
+                                        live.keys, live.pbits))
+            for wire in (*gate_in, gate_out):
+                if wire in live.keys and last_reads[wire] <= i:
+                    if wire in outputs:
+                        self._pbits_out[wires[wire]] = live.pbits[wire]
+                    live.drop(wire)
+            if len(g_tables) == chunk_size and i != last_gate:
+                yield g_tables
+                g_tables = []
+        yield g_tables
 
     def print_garbled_tables(self):
-        """Print p-bits and a clear representation of all garbled tables."""
+        """Print p-bits, then for each gate in compiled order a clear
+        representation of its rows and the garbled table sent to the
+        evaluator, as hexadecimal rows.
+
+        Raises:
+            ValueError: The circuit was created lazy, without its garbled
+                tables.
+        """
+        compiled = self.compiled
+        if len(self.garbled_tables) != len(compiled):
+            raise ValueError(f"Circuit {compiled.id} has "
+                             f"{len(self.garbled_tables)} garbled tables for "
+                             f"{len(compiled)} gates, lazy circuits cannot "
+                             f"be printed")
+        wires = compiled.wires
         print(f"======== {self.circuit['id']} ========")
         print(f"P-BITS: {self.pbits}")
-        for gate in self.gates:
-            garbled_table = GarbledGate(gate, self.keys, self.pbits)
-            garbled_table.print_garbled_table()
+        for table, (gate_type, gate_in, gate_out) in zip(
+                self.garbled_tables, compiled.iter_gates()):
+            wires_in, out = [wires[i] for i in gate_in], wires[gate_out]
+            operator = OPERATORS[gate_type]
+            print(f"GATE: {out}, TYPE: {gate_type}")
+            for encr_bits in itertools.product((0, 1), repeat=len(gate_in)):
+                bits = [e ^ self.pbits[w] for e, w in zip(encr_bits, wires_in)]
+                bit_out = int(operator(*bits))
+                keys_in = "".join(f"[{w}, {bit}]"
+                                  for w, bit in zip(wires_in, bits))
+                print(f"{list(encr_bits)}: {keys_in}([{out}, {bit_out}], "
+                      f"{bit_out ^ self.pbits[out]})")
+            if table is None:
+                print("TABLE: none")
+            elif isinstance(table, dict):
+                # Rows by encrypted input bits
+                for encr_bits, row in table.items():
+                    print(f"TABLE {list(encr_bits)}: {bytes(row).hex()}")
+            else:
+                for i in range(0, len(table), LABEL_SIZE):
+                    print(f"TABLE: {bytes(table[i:i + LABEL_SIZE]).hex()}")
         print()
 
     def get_pbits(self):
@@ -247,9 +1000,118 @@ class GarbledCircuit:
         return self.pbits
 
     def get_garbled_tables(self):
-        """Return dict mapping each gate to its garbled table."""
+        """Return list of garbled tables, by compiled gate index."""
         return self.garbled_tables
 
     def get_keys(self):
         """Return dict mapping each wire to its pair of keys."""
-        return self.keys
\ No newline at end of file
+        return self.keys
+
+class GarblingPool:
+    """Pool of workers garbling the gates of circuits in parallel.
+
+    Gates of a level of the circuit (see CompiledCircuit.levels) are
+    independent: each wide level is split into one part per worker. Levels
+    of fewer than PARALLEL_MIN_GATES gates per worker are garbled by the
+    caller, not to pay the cost of shipping them to workers. Tables do not
+    depend on the order gates are garbled in, so they are the same as with
+    serial garbling.
+
+    Args:
+        workers: The number of workers.
+        kind: Optional; "process" for a pool of processes, or "thread" for
+            a pool of threads, only worth it if the AES backend releases
+            the GIL.
+    """
+    # Executors of concurrent.futures, imported by the pools only
+    KINDS = {
+        "process": "ProcessPoolExecutor",
+        "thread": "ThreadPoolExecutor",
+    }
+    # Minimum number of gates per worker for a level to be garbled in parallel
+    PARALLEL_MIN_GATES = 64
+
+    def __init__(self, workers, kind="process"):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown pool kind '{kind}', "
+                             f"must be in {list(self.KINDS)}")
+        import concurrent.futures
+
+        self.workers = workers
+        self.kind = kind
+        executor = getattr(concurrent.futures, self.KINDS[kind])
+        self.executor = executor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut the workers down."""
+        self.executor.shutdown()
+
+    def garble(self, scheme, compiled, keys, pbits):
+        """Garble the gates of a compiled circuit.
+
+        Args:
+            scheme: The GarblingScheme instance to garble with.
+            compiled: The CompiledCircuit to garble.
+            keys: A list mapping each wire to a pair of keys. With a scheme
+                deriving keys, the pairs of gate outputs are set.
+            pbits: A list mapping each wire to its p-bit.
+
+        Returns:
+            The list of garbled tables, by compiled gate index.
+        """
+        gates = list(compiled.iter_gates())
+        g_tables = [None] * len(gates)
+
+        for level in compiled.levels():
+            part_size = max(-(-len(level) // self.workers),
+                            self.PARALLEL_MIN_GATES)
+            if part_size >= len(level):
+                for i in level:
+                    g_tables[i] = scheme.garble_gate(*gates[i], keys, pbits)
+                continue
+
+            futures = []
+            for start in range(0, len(level), part_size):
+                part = [gates[i] for i in level[start:start + part_size]]
+                wires = {wire for _, gate_in, gate_out in part
+                         for wire in (*gate_in, gate_out)}
+                futures.append(self.executor.submit(
+                    _garble_gates, scheme, part,
+                    {wire: keys[wire] for wire in wires},
+                    {wire: pbits[wire] for wire in wires}))
+
+            for start, future in zip(range(0, len(level), part_size),
+                                     futures):
+                for i, table, keys_out, pbit_out in zip(
+                        level[start:start + part_size], *future.result()):
+                    g_tables[i] = table
+                    keys[gates[i][2]] = keys_out
+                    pbits[gates[i][2]] = pbit_out
+
+        return g_tables
+
+
+def _garble_gates(scheme, gates, keys, pbits):
+    """Garble gates in a worker of a GarblingPool.
+
+    Args:
+        scheme: The GarblingScheme instance to garble with.
+        gates: A list of (gate_type, gate_in, gate_out).
+        keys: A dict mapping the wires of the gates to pairs of keys.
+        pbits: A dict mapping the wires of the gates to their p-bit.
+
+    Returns:
+        The lists of garbled tables, output keys and output p-bits of the
+        gates.
+    """
+    scheme = copy.copy(scheme)  # own cipher contexts in thread workers
+    g_tables = [scheme.garble_gate(gate_type, gate_in, gate_out, keys, pbits)
+                for gate_type, gate_in, gate_out in gates]
+    return (g_tables, [keys[gate_out] for _, _, gate_out in gates],
+            [pbits[gate_out] for _, _, gate_out in gates])